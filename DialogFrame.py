@@ -17,20 +17,94 @@
         上スクロール: ヘルプ
         下スクロール: 下キー
     およびmacでのBGM再生を無効にした。
+バージョン1.1(2026-10-18)
+    メインテキストを読み込み時にパラグラフ単位でコンパイルするようにした。
+        毎フレームのsplitとタグのパースがなくなった。
+    レンダリングした文字サーフィスをキャッシュするようにした。
+    フォントを(ファイル名, 大きさ)ごとに一個だけ作って使い回すようにした。
+    画面は前フレームから変わったところだけ描き直すようにした。
+    アニメーションのない画面では入力が来るまで待つようにした。
+    ページの画像と文字を一枚に合成しておき、次の数ページぶんも裏で作っておくようにした。
+    画像は初めて使うときに読むようにした。台本から作った順番で、裏で少し先まで読んでおく。
+    cassette_archive.pyで作ったアーカイブがあれば、画像とSEをそこからデコードなしで作るようにした。
+    メインテキストはパラグラフの位置だけ覚えておき、使うときに読むようにした。
+    モジュール全体で使うもの(画面、フォント、キャッシュ、キーコンフィグ)をinitializeで作るようにした。
+        benchmark_dialog_frame.pyから画面なしで動かすため。
+    Conf.profileFramesをTrueにすると、フレームごとに処理の段階ごとの時間を記録して、終了時にlogフォルダに書き出すようにした。
+        Conf.profileOverlayをTrueにすると、フレーム時間とキャッシュのヒット率を左上に出す。
+    セーブDBの接続は一本だけ開きっぱなしにして(WALモード)、セーブの書き込みは裏のスレッドでやるようにした。
+        終了時に書き込みを全部済ませてから閉じる。
+    セーブはカセットの初期値から変わったところだけを、バージョンとチェックサムつきで縮めて書くようにした。
+        古い形式のセーブは、起動したときに一回だけスナップショットを足す。古い列は消さず、DBの写し(.v1.bak)も取っておく。
+    セーブのスロット数の上限をなくして、スロット一覧(セーブ:F5、ロード:F6)から選べるようにした。
+        一覧はslotsテーブルだけを引いてページごとに出す。セーブデータ本体はロードするときにだけ読む。
+    イベントタグの処理をtagRegistryに登録して、タグ名で一回引くだけにした。
+        name=magがimageとして処理されていたのも直った。
+        属性の型はコンパイル時に検査する。カセットのプラグイン(Conf.tagPlugins)でタグを足せる。
+    発言者のキーは全部まとめた正規表現でパラグラフのコンパイル時に探し、関連付けは画像名から引くようにした。
+        毎フレームの関連付けは、表示中の画像にかかわるものだけを見る。
+    表示中の画像(imageOrder)をDisplayListにした。あるかどうか・置く・消す・入れ替えるがO(1)で、
+        背景・キャラ・UI・いつでも画像の層を下から順に重ねる。imageConfのlayerで画像を置く層を決められる。
+        いつでも画像オープンはnum2ではなく一番上の層に置くようにした(セーブの形式はバージョン2)。
+    imageタグのshakeを、経過ミリ秒で動くTimelineにした。座標は書き換えず、貼るときにずらす。
+        move(動く)、fade(フェードイン)、blink(点滅)、duration(shake、blinkの長さ)も書けるようにした。
+    skipタグのpauseをpygame.time.delayではなくタイマーにした。待っているあいだも描画と入力は止まらず、
+        止めているゲームループはpauseの終わる時刻に起きる。Conf.pauseSkippableならページ送りキーで飛ばせる。
+    SEは起動時に全部デコードせず、初めて鳴らすときか台本の先読みでデコードして、
+        合計バイト数に上限のあるSoundCacheに入れるようにした。resetSoundはそのページで鳴らしたSEだけを戻す。
+    BGMをWindows以外でも鳴らすようにした。曲は裏のスレッドでデコードし(台本で先に出てくる曲は先読みする)、
+        専用のチャンネル2本で交互に鳴らして、切り替えはクロスフェードにした。ゲームループは曲の読み込みを待たない。
+    ページ戻りモードで表示するパラグラフの前後の索引をメインテキストの読み込み時に作り、
+        skipTagLinesは再帰せずに索引を一回引くだけにした。
+    ページごとの場面(表示中の画像、座標、BGM)をリングバッファ(SceneHistory)に覚えておき、
+        ページ戻りモードで戻った先のページの画像とBGMを出すようにした。
+    台本をcheckpointIntervalページごとのチェックポイント(CheckpointIndex)から描画せずにたどって、
+        どのページにも画像とBGMの状態ごと飛べるようにした(seekPage)。台本が変わったあとのセーブのロードに使う。
+    既読のパラグラフをビット列(ReadPages)で持ってセーブDBに入れ、スキップモード(Sキー)を足した。
+        スキップ中は描画せずにタグの状態だけを当ててページを進め、1フレームに一回だけ描く。
+    メインテキストの読み込み時に全パラグラフのタグを検査するようにした(ScriptText.validate)。
+    textタグのcolorを、コンパイル時に検査して色のタプルにする型(color)にした。
+    Compositorが描画を比べるキーに透明度を入れた。同じサーフィスの透明度だけが変わるfadeも描き直す。
+    関連付けで立ち絵のmainとbackが入れ替わったら、imageタグのアニメーションを相方の画像に移して続けるようにした。
+    デコードして持っておくBGMを曲数(Conf.bgmTracks)ではなく、PCMの合計バイト数(Conf.bgmCacheBudget)で決めるようにした。
+    ページ戻りモードで場面を覚えていないページまで戻ったら、BGMをいまのものに戻すようにした。
+    セーブと終了時に既読を書くときは、DBに入っている既読と書き込みスレッドで足すようにした。ゲームループはDBを読まない。
+    メインテキストの文字コードは全パラグラフをデコードして確かめ、デコードできなければ次の文字コードで読みなおすようにした。
+    メインテキストを読みかえたら、前のメインテキストのファイルを閉じるようにした。
+    ゲームループを止めているときに来た入力は、来た順のまま各モードに渡すようにした。
+    DBに入っている既読は、台本を開いたときに書き込みスレッドで読んで足すようにした。スキップモードもDBを待たない。
+    FrameResourcesをcloseすると、先読みのスレッドも止まるようにした(ResourcePreloader.stop)。
 """
 
 import sys
 import os
 import traceback
+import atexit
 import pygame
 import datetime
+import time
 import random
 import sqlite3
+import queue
+import copy
 import json
+import zlib
+import struct
+import csv
+import re
+import mmap
+import codecs
+from array import array
+import threading
+import io
+import heapq
+import importlib.util
+from collections import OrderedDict, deque
 from pygame.locals import *
 from html.parser import HTMLParser
 from DialogFrameConfig import Conf
 import accept_mouse_click
+import cassette_archive
 
 # ショートカットからの実行だったらカレントディレクトリをexeのあるディレクトリに移す。
 # NOTE: のちのち、「ショートカット実行ではないのにカレントディレクトリを移してしまう」という事態が発生し
@@ -42,90 +116,154 @@ for d in ['image', 'log', 'maintext', 'other', 'sound']:
         print('NOTE: ショートカットからの実行であると判断され、カレントディレクトリが移されました。')
         break
 
+# サーフィスへの描画とフォントのレンダリングはこのロックを取ってから行う。
+# ページレイヤーを裏のスレッドで作るため。
+renderLock = threading.RLock()
+
 
 class FrameResources:
     """ダイアログプレイに使うリソース(メインテキスト、画像、音楽)を各ディクショナリで管理するクラス。
     これをインスタンス化して実際に使う。
     property
+        archive 画像とSEを詰めたアーカイブ。なければNone
         textList
         imageDic
+        positions imageDicの座標をファイル名で引くためのもの
+        preloader 台本の順に画像とSEを裏で読むもの
         soundDic
+        playedSounds 前のresetSoundから再生したSoundsのset
         bgm
     """
 
     def __init__(self):
         """全リソースを取得する。"""
+        self.archive = self.createArchive()
+        self.imageDic = self.createImageDic()
+        self.positions = ImagePositions(self.imageDic)
+        self.playedSounds = set()
+        self.soundDic = self.createSoundDic()
+        self.bgm = self.createBGM()
+        self.preloader = ResourcePreloader(getattr(Conf, 'imagePreloadPages', 20))
         # メインテキストがリストで指示されてるときは、オープニングの段階では読まない
         if str(type(Conf.maintextName)) != "<class 'str'>":
             self.textList = False
         else:
             self.textList = self.createTextList()
-        self.imageDic = self.createImageDic()
-        self.soundDic = self.createSoundDic()
-        self.bgm = self.createBGM()
 
-    def exportJson(self):
-        """現在のFrameResourcesインスタンスの状態をJSONで出力する。"""
-        imageInstances = {}
+    def exportState(self):
+        """画像の座標、SEの音量、BGMのうち、初期値から変わっているものだけをディクショナリで返す。"""
+        state = {}
+        images = {key: list(instance.xy) for key,instance in self.imageDic.items()
+            if list(instance.xy) != list(Images.defaultXY)}
+        if images:
+            state['images'] = images
+        sounds = {key: instance.vol for key,instance in self.soundDic.items()
+            if instance.vol != Sounds.defaultVolume}
+        if sounds:
+            state['sounds'] = sounds
+        bgm = {key: getattr(self.bgm, key) for key,value in BGMs.defaults.items()
+            if getattr(self.bgm, key) != value}
+        if bgm:
+            state['bgm'] = bgm
+        return state
+
+    def importState(self, state):
+        """exportStateの返したディクショナリを自分自身に反映させる。書いてないものは初期値に戻す。"""
+        images = state.get('images', {})
         for key,instance in self.imageDic.items():
-            imageInstances[key] = {}
-            imageInstances[key]['xy'] = instance.xy
-        soundInstances = {}
+            instance.xy = list(images.get(key, Images.defaultXY))
+        sounds = state.get('sounds', {})
         for key,instance in self.soundDic.items():
-            soundInstances[key] = {}
-            soundInstances[key]['vol'] = instance.vol
-        bgmDic = {
-            'name': self.bgm.name,
-            'vol': self.bgm.vol,
-            'put': self.bgm.put,
-        }
-        data = {
-            'imageInstances': imageInstances,
-            'soundInstances': soundInstances,
-            'bgmDic': bgmDic,
-        }
-        return json.dumps(data)
-
-    def importJson(self, jsondata):
-        """受け取ったjsonデータを自分自身に反映させる。"""
-        data = json.loads(jsondata)
-        for key,dic in data['imageInstances'].items():
-            self.imageDic[key].xy = dic['xy']
-        for key,dic in data['soundInstances'].items():
-            self.soundDic[key].vol = float(dic['vol'])
-        self.bgm.name = data['bgmDic']['name']
-        self.bgm.vol = float(data['bgmDic']['vol'])
-        self.bgm.put = bool(data['bgmDic']['put'])
+            instance.vol = float(sounds.get(key, Sounds.defaultVolume))
+        # BGMは次のフレームのbgm.updateで、曲を読んで鳴らしなおす
+        bgm = state.get('bgm', {})
+        for key,value in BGMs.defaults.items():
+            setattr(self.bgm, key, bgm.get(key, value))
 
     def createTextList(self, maintextName=False):
-        """メインテキストを1パラグラフごとのリストにする。"""
+        """メインテキストを1パラグラフごとに引けるScriptTextにする。"""
         # maintextNameがわざわざ指示されるのはmaintextが複数あるとき
         if maintextName == False:
             filename = Conf.maintextName
         else:
             filename = maintextName
-        # encodingがどれかわからんので総当りでヒットしたやつでtextを作る
-        for enc in ('utf-8', 'sjis', 'euc-jp', 'ascii'):
-            try:
-                with open(Conf.cassette+os.sep+'maintext'+os.sep+filename, 'r', encoding=enc) as f:
-                    text = f.read()
-                    break
-            except:
-                pass
-        return text.split('\n\n')
+        textList = ScriptText(Conf.cassette+os.sep+'maintext'+os.sep+filename,
+            getattr(Conf, 'scriptCacheSize', 64))
+        # 台本の順に画像とSEを裏で読ませておく
+        self.preloader.follow(self.createManifest(textList))
+        return textList
+
+    def replaceTextList(self, maintextName):
+        """メインテキストを読みかえる。前のScriptTextは閉じる。"""
+        textList = self.textList
+        self.textList = self.createTextList(maintextName)
+        if textList is not False:
+            textList.close()
+
+    def close(self):
+        """先読みのスレッドを止めて、メインテキストとアーカイブを閉じる。"""
+        self.preloader.stop()
+        if self.textList is not False:
+            self.textList.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def createArchive(self):
+        """otherフォルダにアーカイブ(Conf.cassetteArchive)があれば開く。なければNone。"""
+        archivePath = Conf.cassette+os.sep+'other'+os.sep+getattr(Conf, 'cassetteArchive', 'cassette.pack')
+        if not os.path.exists(archivePath):
+            return None
+        try:
+            return cassette_archive.CassetteArchive(archivePath)
+        except Exception:
+            print('NOTE: アーカイブ(%s)が読めないので、フォルダの素材を使います。' % archivePath)
+            return None
 
     def createImageDic(self):
-        """Imagesインスタンスの入ったディクショナリを作る。"""
+        """Imagesインスタンスの入ったディクショナリを作る。
+        Conf.lazyImagesがTrue(デフォルト)なら、ここではまだ画像を読まない。"""
+        lazy = getattr(Conf, 'lazyImages', True)
         imageDic = {}
         for image in Conf.imageConf:
-            imageDic[image['name']] = Images(Conf.cassette+os.sep+'image'+os.sep+image['name'], image['trans'])
+            imageDic[image['name']] = Images(Conf.cassette+os.sep+'image'+os.sep+image['name'], image['trans'], lazy,
+                self.archive)
         return imageDic
 
+    def createManifest(self, textList):
+        """メインテキストのimageタグとsoundタグとbgmタグから、(初めて出てくるページ, ImagesかSoundsかBGMTrack)を
+        ページ順に出すジェネレータ。
+        関連付け画像は片方が出てきたらもう片方も並べる。ページ送りのSEは最初に並べる。
+        台本は先読みスレッドが読み進めたところまでしか走査しない。"""
+        partners = speakerIndex.partners
+        seen = set()
+        if Conf.soundTurnPage in self.soundDic:
+            seen.add(('sound', Conf.soundTurnPage))
+            yield (0, self.soundDic[Conf.soundTurnPage])
+        for page,paragraph in enumerate(textList):
+            for tag in paragraph.tags:
+                if tag.name == 'sound':
+                    name = tag.attrs.get('file')
+                    if name in self.soundDic and ('sound', name) not in seen:
+                        seen.add(('sound', name))
+                        yield (page, self.soundDic[name])
+                if tag.name == 'bgm' and 'file' in tag.attrs and ('bgm', tag.attrs['file']) not in seen:
+                    seen.add(('bgm', tag.attrs['file']))
+                    yield (page, self.bgm.track(tag.attrs['file']))
+                if tag.name != 'image':
+                    continue
+                for attr in ('file', 'changeto'):
+                    name = tag.attrs.get(attr)
+                    for name in (name, partners.get(name)):
+                        if name in self.imageDic and ('image', name) not in seen:
+                            seen.add(('image', name))
+                            yield (page, self.imageDic[name])
+
     def createSoundDic(self):
-        """Soundsインスタンスの入ったディクショナリを作る"""
+        """Soundsインスタンスの入ったディクショナリを作る。ここではまだSEをデコードしない。"""
         soundDic = {}
         for sound in Conf.seConf:
-            soundDic[sound['name']] = Sounds(Conf.cassette+os.sep+'sound'+os.sep+sound['name'])
+            soundDic[sound['name']] = Sounds(Conf.cassette+os.sep+'sound'+os.sep+sound['name'], self.archive,
+                self.playedSounds)
         return soundDic
 
     def createBGM(self):
@@ -133,26 +271,60 @@ class FrameResources:
         return BGMs()
 
     def resetSound(self):
-        """SoundDicの中のSoundsインスタンスplayプロパティを全部Falseにする。"""
-        for sound in Conf.seConf:
-            self.soundDic[sound['name']].put = False
+        """再生したSoundsインスタンスのputプロパティをFalseにする。見るのはこのページで鳴らしたものだけ。"""
+        for sound in self.playedSounds:
+            sound.put = False
+        self.playedSounds.clear()
 
 
 class Images:
     """画像のサーフィスと座標をもつクラス。
+    lazyがTrueならサーフィスは初めてsurfaceを参照したときに作る。
+    archiveにその画像があれば、ファイルをデコードせずにそこから作る。
     property
         surface サーフィス
         xy 座標
     """
 
-    def __init__(self, imagePath, transparence=False):
-        self.surface = self.createSurface(imagePath, transparence)
-        self.xy = [0, 0]
+    # 座標の初期値。セーブにはこれと違う座標だけを書く
+    defaultXY = (0, 0)
+
+    def __init__(self, imagePath, transparence=False, lazy=False, archive=None):
+        self.imagePath = imagePath
+        self.transparence = transparence
+        self.archive = archive
+        self.__surface = None
+        # 先読みスレッドとゲームループが同時に読まないように
+        self.__lock = threading.Lock()
+        self.xy = list(Images.defaultXY)
         # 画像の表示状態をimageOrderリストで管理するようになったら必要なくなった
         # self.put = False
+        if not lazy:
+            self.load()
+
+    @property
+    def surface(self):
+        if self.__surface is None:
+            self.load()
+        return self.__surface
+
+    def load(self):
+        """サーフィスを作る。作ってあれば何もしない。"""
+        with self.__lock:
+            if self.__surface is None:
+                self.__surface = self.createSurface(self.imagePath, self.transparence)
+
+    def loaded(self):
+        """サーフィスが作ってあるならTrue。"""
+        return self.__surface is not None
 
     def createSurface(self, imagePath, transparence):
         """画像サーフィスを作成する。"""
+        if self.archive is not None:
+            # アーカイブの画像は透明色の処理まで済んでいる
+            surface = self.archive.surface(os.path.basename(imagePath), imagePath)
+            if surface is not None:
+                return surface
         if transparence == False:
             return pygame.image.load(imagePath).convert_alpha()
         else:
@@ -161,74 +333,839 @@ class Images:
             return surface
 
     def blit(self):
-        """画面にblitする。"""
-        return screen.blit(self.surface, self.xy)
+        """画面へのblitを登録する。"""
+        return compositor.blit(self.surface, self.xy, Compositor.BASE)
+
+
+class ResourcePreloader:
+    """画像とSEを台本のページ順に裏のスレッドで読んでおくクラス。
+    manifestは(初めて出てくるページ, ImagesかSounds)をページ順に出すイテレータ。
+    いまのページからpagesページ先までに出てくるものを読んだら、ページが進むまで待つ。
+    先読みが間に合わなかったものは、使うときにImages.surfaceやSounds.surfaceが読む。
+    使い終わったらstopでスレッドを止める。
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.manifest = None
+        # どのページまでの画像を読んでおくか
+        self.horizon = pages
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def follow(self, manifest):
+        """新しいmanifestで先読みをやりなおす。スレッドがなければ作る。stopしたあとは何もしない。"""
+        with self.condition:
+            if self.stopped:
+                return
+            self.manifest = manifest
+            self.horizon = self.pages
+            self.condition.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def advance(self, page):
+        """いまのページを教える。そこからpagesページ先までを読みにいく。"""
+        with self.condition:
+            if page + self.pages > self.horizon:
+                self.horizon = page + self.pages
+                self.condition.notify()
+
+    def stop(self):
+        """先読みをやめてスレッドを終わらせる。読みかけのものがあれば、読み終わるまで待つ。"""
+        with self.condition:
+            self.stopped = True
+            self.manifest = None
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        manifest = None
+        entry = None
+        while True:
+            with self.condition:
+                # 次の画像がhorizonより先なら、ページが進むかmanifestが変わるかstopされるまで待つ
+                while not self.stopped and (self.manifest is None or (manifest is self.manifest
+                        and entry is not None and entry[0] > self.horizon)):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                if manifest is not self.manifest:
+                    manifest = self.manifest
+                    entry = None
+            if entry is None:
+                # 台本の走査はロックの外でやる
+                try:
+                    entry = next(manifest, None)
+                except ValueError:
+                    # おかしなタグがあるパラグラフ。そこから先は読まない(ゲームループのほうでエラーになる)
+                    entry = None
+                if entry is None:
+                    # 全部読んだ。次のmanifestが来るまで待つ
+                    with self.condition:
+                        while manifest is self.manifest and not self.stopped:
+                            self.condition.wait()
+                continue
+            if entry[0] <= self.horizon:
+                entry[1].load()
+                entry = None
+
+
+class ImagePositions:
+    """imageDicの座標をファイル名で引けるようにするだけのクラス。
+    applyImageTagやapplyLinkingに、座標のディクショナリのかわりに渡す。
+    """
+
+    def __init__(self, imageDic):
+        self.imageDic = imageDic
+
+    def __getitem__(self, name):
+        return self.imageDic[name].xy
+
+    def __setitem__(self, name, xy):
+        self.imageDic[name].xy = xy
+
+    def copy(self):
+        """いまの座標を写したディクショナリを返す。"""
+        return {name: list(image.xy) for name,image in self.imageDic.items()}
 
 
 class Sounds:
-    """音声のサーフィス(?)をもつクラス。
+    """SEの音量と再生状態をもつクラス。
+    デコードしたSound(mixerの形式のPCM)はsoundCacheが持っていて、初めて鳴らすときか先読みのときに作る。
+    archiveにそのSEがあれば、デコードせずにそこから作る。
     property
-        surface サーフィス
+        surface デコード済みのSound
         vol 音量
-        play 再生済みならTrue
+        put 再生済みならTrue
+        played 再生したSoundsを入れるset(FrameResources.playedSounds)
     """
 
-    def __init__(self, soundPath):
-        self.surface = pygame.mixer.Sound(soundPath)
-        self.vol = 0.1
-        self.volume(0.1)
+    # 音量の初期値。セーブにはこれと違う音量だけを書く
+    defaultVolume = 0.1
+
+    def __init__(self, soundPath, archive=None, played=None):
+        self.soundPath = soundPath
+        self.archive = archive
+        self.played = played
+        # 先読みスレッドとゲームループが同時にデコードしないように
+        self.lock = threading.Lock()
+        self.vol = Sounds.defaultVolume
         self.put = False
 
+    @property
+    def surface(self):
+        return soundCache.get(self)
+
+    def load(self):
+        """デコードしてsoundCacheに入れておく。入っていれば何もしない。"""
+        soundCache.get(self)
+
+    def decode(self):
+        """Soundを作る。"""
+        if self.archive is not None:
+            # アーカイブにデコード済みのPCMがあればそれを使う
+            surface = self.archive.sound(os.path.basename(self.soundPath), self.soundPath)
+            if surface is not None:
+                return surface
+        return pygame.mixer.Sound(self.soundPath)
+
     def volume(self, num):
         """音量を設定しつつ変える。"""
         self.vol = float(num)
-        self.surface.set_volume(float(num))
+        surface = soundCache.peek(self)
+        if surface is not None:
+            surface.set_volume(self.vol)
 
     def play(self):
         """再生する。Trueになったself.putはturnPageと共に戻る。"""
         self.put = True
-        return self.surface.play()
+        if self.played is not None:
+            self.played.add(self)
+        surface = self.surface
+        surface.set_volume(self.vol)
+        return surface.play()
+
+
+def soundSize(surface):
+    """SoundのPCMのバイト数。get_rawは写しを作るので、長さとmixerの形式から出す。"""
+    frequency, size, channels = pygame.mixer.get_init()
+    return int(round(surface.get_length() * frequency)) * channels * (abs(size) // 8)
+
+
+class SoundCache:
+    """デコード済みのSEを持っておくクラス。インスタンスは一個だけ生成する。
+    キーはSoundsインスタンスで、合計バイト数(PCMの大きさ)がbudgetを超えたら一番長く使われていないものから捨てる。
+    捨てたSEは次に使うときにまたデコードする。鳴っている途中のSoundはmixerが持っているので、捨てても止まらない。
+    property
+        budget 持っておくPCMの合計バイト数の上限
+        size 持っているPCMの合計バイト数
+        hits, misses, evictions
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.sounds = OrderedDict()
+        self.lock = threading.Lock()
+
+    def peek(self, sound):
+        """カウンタも順番も動かさずに、デコード済みのSoundを返す。なければNone。"""
+        with self.lock:
+            entry = self.sounds.get(sound)
+            return None if entry is None else entry[0]
+
+    def get(self, sound):
+        """デコード済みのSoundを返す。なければデコードして入れる。"""
+        with self.lock:
+            entry = self.sounds.get(sound)
+            if entry is not None:
+                self.sounds.move_to_end(sound)
+                self.hits += 1
+                return entry[0]
+        # デコードはキャッシュのロックの外でやる。同じSEを二回デコードしないようにSoundsのロックを取る
+        with sound.lock:
+            with self.lock:
+                entry = self.sounds.get(sound)
+                if entry is not None:
+                    return entry[0]
+            surface = sound.decode()
+            surfaceSize = soundSize(surface)
+            with self.lock:
+                self.misses += 1
+                self.sounds[sound] = (surface, surfaceSize)
+                self.size += surfaceSize
+                # いま入れたものは捨てない
+                while self.size > self.budget and len(self.sounds) > 1:
+                    oldSound, (oldSurface, oldSize) = self.sounds.popitem(last=False)
+                    self.size -= oldSize
+                    self.evictions += 1
+        return surface
+
+
+class BGMTrack:
+    """BGMの曲一個。デコードしたSoundを持つ。loadは先読みスレッドからも呼ぶ。
+    property
+        name ファイル名
+        sound デコード済みのSound。まだかもう捨てたならNone
+        size soundのPCMのバイト数。soundがNoneなら0
+        failed 読めなかったらTrue
+        loading 裏で読んでいる途中ならTrue
+    """
+
+    def __init__(self, name, owner):
+        self.name = name
+        self.owner = owner
+        self.sound = None
+        self.size = 0
+        self.failed = False
+        self.loading = False
+        # デコードのあいだ取るロックと、loadingを見るだけの短いロック。
+        # ゲームループは後者しか取らないので、裏のデコードを待たない
+        self.lock = threading.Lock()
+        self.stateLock = threading.Lock()
+
+    def loaded(self):
+        """鳴らせるかどうかがもうわかっているならTrue。"""
+        return self.sound is not None or self.failed
+
+    def load(self):
+        """デコードする。デコード済みか読めなかった曲なら何もしない。"""
+        with self.stateLock:
+            if self.loaded():
+                return
+            self.loading = True
+        with self.lock:
+            if not self.loaded():
+                try:
+                    sound = pygame.mixer.Sound(Conf.cassette+os.sep+'sound'+os.sep+self.name)
+                    self.size = soundSize(sound)
+                    self.sound = sound
+                except (pygame.error, OSError) as e:
+                    print('NOTE: BGM(%s)が読めないので鳴らしません。%s' % (self.name, e))
+                    self.failed = True
+        with self.stateLock:
+            self.loading = False
+        self.owner.trim(self.name)
+
+    def loadInBackground(self):
+        """裏のスレッドでデコードさせる。読んでいる途中か読み終わっていれば何もしない。"""
+        with self.stateLock:
+            if self.loading or self.loaded():
+                return
+            self.loading = True
+        threading.Thread(target=self.load, daemon=True).start()
+
+    def unload(self):
+        self.sound = None
+        self.size = 0
 
 
 class BGMs:
-    """再生中のBGMファイル名、音量、状態をもつクラス。インスタンスは一個だけ生成する。
+    """BGMのファイル名、音量、状態をもつクラス。インスタンスは一個だけ生成する。
+    BGMはデコードしたSoundを専用のチャンネル2本で交互に鳴らすので、曲の切り替えはクロスフェードになる。
+    (pygame.mixer.musicは1曲しか流せないのでクロスフェードできない)
+    デコードは裏のスレッドでやる。台本で先に出てくる曲はResourcePreloaderが読んでおく。
+    タグはname、vol、putを書き換えるだけで、実際に鳴らすのはフレームごとのupdate。
+    読み終わっていない曲は、読み終わったフレームから鳴りはじめる。
     property
         name ファイル名
         vol 音量(0.0~1.0)
-        play 流れてる状態かどうか
+        put 流れてる状態かどうか
+        fadeTime クロスフェードの長さ(ミリ秒)
+        budget デコードして持っておく曲のPCMの合計バイト数の上限
+        tracks ファイル名をキーにしたBGMTrack。使った順
+        playing いま鳴らしている曲のファイル名。鳴らしていなければNone
+        channels BGM用のチャンネル2本。mixerがなければNone
+        current いま鳴らしているチャンネルの番号
     """
 
+    # 各プロパティの初期値。セーブにはこれと違うものだけを書く
+    defaults = {'name': '', 'vol': 0.1, 'put': False}
+
     def __init__(self):
-        self.name = ''
-        self.vol = 0.1
-        self.volume(0.1)
-        self.put = False
+        self.name = BGMs.defaults['name']
+        self.vol = BGMs.defaults['vol']
+        self.put = BGMs.defaults['put']
+        self.fadeTime = getattr(Conf, 'bgmFadeTime', 1000)
+        # 1曲で数十MBになるので、曲数ではなくバイト数で持っておく量を決める。書かなければ64MB
+        self.budget = getattr(Conf, 'bgmCacheBudget', 64*1024*1024)
+        self.tracks = OrderedDict()
+        self.lock = threading.Lock()
+        self.playing = None
+        self.appliedVolume = None
+        self.channels = None
+        self.current = 0
+        if pygame.mixer.get_init() is not None:
+            # 0番と1番のチャンネルはSEに使わせない
+            pygame.mixer.set_reserved(2)
+            self.channels = [pygame.mixer.Channel(0), pygame.mixer.Channel(1)]
+
+    def track(self, name):
+        """曲のBGMTrackを返す。なければ作る。ここではまだデコードしない。"""
+        with self.lock:
+            track = self.tracks.get(name)
+            if track is None:
+                track = self.tracks[name] = BGMTrack(name, self)
+            self.tracks.move_to_end(name)
+            return track
+
+    def trim(self, keep):
+        """デコード済みの曲の合計バイト数がbudgetを超えたら、長く使っていない曲から捨てる。
+        鳴っている曲とkeepは捨てないので、その2曲だけでbudgetを超えることはある。"""
+        with self.lock:
+            loaded = [track for track in self.tracks.values() if track.sound is not None]
+            size = sum(track.size for track in loaded)
+            for track in loaded:
+                if size <= self.budget:
+                    break
+                if track.name in (self.playing, keep):
+                    continue
+                size -= track.size
+                track.unload()
 
     def change(self, name):
-        # macではmp3が読めないし、いっそBGM再生はナシにする。
-        if not sys.platform.startswith('win'):
-            return None
+        """曲を変える。鳴らしていればupdateでクロスフェードする。"""
         self.name = name
-        pygame.mixer.music.load(Conf.cassette+os.sep+'sound'+os.sep+name)
+        self.track(name).loadInBackground()
 
     def volume(self, num):
-        if not sys.platform.startswith('win'):
-            return None
-        self.vol = float(0.1)
-        pygame.mixer.music.set_volume(float(num))
+        self.vol = float(num)
 
     def play(self):
-        if not sys.platform.startswith('win'):
-            return None
-        # 同じファイル名がすでに再生中だったらスキップ
         self.put = True
-        pygame.mixer.music.play(-1)
 
     def stop(self):
-        if not sys.platform.startswith('win'):
-            return None
         self.put = False
-        pygame.mixer.music.stop()
+
+    def update(self):
+        """フレームごとに呼ぶ。鳴らすはずの曲と鳴っている曲が違えば切り替える。
+        鳴らすはずの曲をまだ読んでいるあいだはTrueを返す。"""
+        if self.channels is None:
+            return False
+        want = self.name if (self.put and self.name) else None
+        if want != self.playing:
+            if want is not None:
+                track = self.track(want)
+                if not track.loaded():
+                    track.loadInBackground()
+                    return True
+            # いまの曲はフェードアウトさせる
+            if self.playing is not None:
+                if self.fadeTime > 0:
+                    self.channels[self.current].fadeout(self.fadeTime)
+                else:
+                    self.channels[self.current].stop()
+            self.playing = want
+            if want is not None and track.sound is not None:
+                self.current = 1 - self.current
+                channel = self.channels[self.current]
+                channel.set_volume(self.vol)
+                channel.play(track.sound, loops=-1, fade_ms=max(0, self.fadeTime))
+                self.appliedVolume = self.vol
+            self.trim(want)
+        if self.playing is not None and self.appliedVolume != self.vol:
+            self.channels[self.current].set_volume(self.vol)
+            self.appliedVolume = self.vol
+        return False
+
+
+class FontRegistry:
+    """フォントを(ファイル名, 大きさ)ごとに一個だけ作って使い回すクラス。インスタンスは一個だけ生成する。
+    フォントは初めて要求されたときに作る。TTFファイルの中身はファイルごとに一度だけ読んで、
+    大きさ違いのフォントで同じbytesを共有する。フォントファイルはotherフォルダに入れること。
+    property
+        fonts (ファイル名, 大きさ)をキーにしたフォントのディクショナリ
+        files ファイル名をキーにしたTTFファイルの中身のディクショナリ
+    """
+
+    def __init__(self):
+        self.fonts = {}
+        self.files = {}
+
+    def get(self, name, size):
+        """フォントを返す。なければ作る。"""
+        key = (name, size)
+        font = self.fonts.get(key)
+        if font is None:
+            font = pygame.font.Font(io.BytesIO(self.read(name)), size)
+            self.fonts[key] = font
+        return font
+
+    def read(self, name):
+        """TTFファイルの中身を返す。読むのは初回だけ。"""
+        data = self.files.get(name)
+        if data is None:
+            with open(Conf.cassette+os.sep+'other'+os.sep+name, 'rb') as f:
+                data = f.read()
+            self.files[name] = data
+        return data
+
+
+class TextCache:
+    """レンダリング済みの文字サーフィスを使い回すクラス。インスタンスは一個だけ生成する。
+    font.renderの結果を(フォント, 文字列, アンチエイリアス, 色)をキーに保持し、
+    合計バイト数がbudgetを超えたら一番長く使われていないものから捨てる。
+    property
+        budget 保持するサーフィスの合計バイト数の上限
+        size 保持しているサーフィスの合計バイト数
+        hits キャッシュから返した回数
+        misses レンダリングした回数
+        evictions 捨てた回数
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.surfaces = OrderedDict()
+
+    def render(self, font, string, antialias, color):
+        """font.renderと同じ引数(フォントは先頭)でサーフィスを返す。"""
+        # フォントインスタンスがファイルと大きさを表す
+        key = (font, string, bool(antialias), tuple(color))
+        with renderLock:
+            surface = self.surfaces.get(key)
+            if surface is not None:
+                self.surfaces.move_to_end(key)
+                self.hits += 1
+                return surface
+            self.misses += 1
+            surface = font.render(string, antialias, color)
+            self.surfaces[key] = surface
+            self.size += self.surfaceSize(surface)
+            # 予算オーバーなら古いものから捨てる。最新のひとつは残す
+            while self.size > self.budget and len(self.surfaces) > 1:
+                oldKey, oldSurface = self.surfaces.popitem(last=False)
+                self.size -= self.surfaceSize(oldSurface)
+                self.evictions += 1
+            return surface
+
+    def surfaceSize(self, surface):
+        """サーフィスのおおよそのバイト数。"""
+        return surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+    def hitRate(self):
+        """ヒット率(0.0~1.0)を返す。"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        """キャッシュを空にする。カウンタはそのまま。"""
+        with renderLock:
+            self.surfaces.clear()
+            self.size = 0
+
+
+class Compositor:
+    """画面への描画を記録して、前フレームから変わった範囲だけ描き直すクラス。インスタンスは一個だけ生成する。
+    各モードはscreenに直接描かずにblitとrectで描画を登録し、フレームの最後にupdateを呼ぶ。
+    描画は重なり順(BASE, TEXT, TAG, UI)ごとに登録するので、登録する順番は気にしなくてよい。
+    前フレームの描画リストと比べて、増えたもの、消えたもの、重なり順が変わったものの範囲だけを
+    黒で塗って描き直し、その範囲だけdisplay.updateする。何も変わっていなければdisplay.updateもしない。
+    property
+        surface 描画先(screen)
+        dirtyRects 直前のupdateで描き直した範囲のリスト
+        dirtyArea 直前のupdateで描き直した面積(ピクセル数)
+        frames updateした回数
+        updatedFrames 実際にdisplay.updateした回数
+        totalDirtyArea 描き直した面積の合計
+    """
+
+    # 重なり順。小さいほうが下
+    # 背景と立ち絵、あるいは合成済みのページレイヤー
+    BASE = 0
+    # ダイアログ文字
+    TEXT = 1
+    # textタグやdiceタグが描くもの
+    TAG = 2
+    # ヘルプやアナウンスのボックス
+    UI = 3
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.screenRect = surface.get_rect()
+        # 重なり順ごとの描画リスト。要素は(サーフィスか色, Rect)
+        self.ops = [[] for layer in range(Compositor.UI + 1)]
+        # 前フレームの描画リストと、そのときのキー。Noneなら次のupdateで全画面描き直す
+        self.lastOps = None
+        self.lastKeys = None
+        self.dirtyRects = []
+        self.dirtyArea = 0
+        self.frames = 0
+        self.updatedFrames = 0
+        self.totalDirtyArea = 0
+
+    def blit(self, surface, xy, layer):
+        """サーフィスのblitをlayerの重なり順で登録する。"""
+        rect = Rect(tuple(xy), surface.get_size())
+        self.ops[layer].append((surface, rect))
+        return rect
+
+    def rect(self, color, rect, layer):
+        """塗りつぶした四角の描画をlayerの重なり順で登録する。"""
+        rect = Rect(rect)
+        self.ops[layer].append((tuple(color), rect))
+        return rect
+
+    def drop(self, layer):
+        """このフレームでlayerに登録された描画を捨てる。"""
+        self.ops[layer] = []
+
+    def invalidate(self):
+        """次のupdateで全画面を描き直させる。"""
+        self.lastOps = None
+        self.lastKeys = None
+
+    def key(self, op):
+        """描画の同一性を比べるためのキー。サーフィスは同じインスタンスかどうかと、透明度で比べる。
+        同じサーフィスの透明度だけを変えて貼りなおすこと(Timelineのfade)があるので、透明度もキーに入れる。
+        キーは登録したフレームのupdateで作って覚えておく。あとで作ると変わったあとの透明度になってしまう。"""
+        source, rect = op
+        if isinstance(source, tuple):
+            return (source, tuple(rect))
+        # lastOpsとopsがサーフィスを掴んでいるあいだはidが被ることはない
+        return (id(source), source.get_alpha(), tuple(rect))
+
+    def diff(self, lastOps, lastKeys, ops, keys):
+        """前フレームと今フレームの描画リスト(とそのキー)から描き直しが必要な範囲のリストを返す。"""
+        if lastOps is None:
+            return [self.screenRect.copy()]
+        if lastKeys == keys:
+            return []
+        lastSet = set(lastKeys)
+        keySet = set(keys)
+        dirty = []
+        # 消えたものと増えたもの
+        for key,op in zip(lastKeys, lastOps):
+            if key not in keySet:
+                dirty.append(op[1])
+        for key,op in zip(keys, ops):
+            if key not in lastSet:
+                dirty.append(op[1])
+        # 両方にあるものの重なり順が変わっていたら、変わったところから後ろを全部描き直す
+        lastCommon = [(key, op) for key,op in zip(lastKeys, lastOps) if key in keySet]
+        common = [(key, op) for key,op in zip(keys, ops) if key in lastSet]
+        for i in range(min(len(lastCommon), len(common))):
+            if lastCommon[i][0] != common[i][0]:
+                dirty.extend(op[1] for key,op in lastCommon[i:])
+                dirty.extend(op[1] for key,op in common[i:])
+                break
+        return dirty
+
+    def merge(self, rects):
+        """画面内に切り詰めたうえで、重なっている範囲をひとつにまとめる。"""
+        merged = []
+        for rect in rects:
+            rect = rect.clip(self.screenRect)
+            if rect.width == 0 or rect.height == 0:
+                continue
+            # 重なるものがなくなるまで吸収し続ける
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect.union_ip(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def update(self):
+        """登録された描画を、変わった範囲だけ画面に反映する。"""
+        ops = [op for layerOps in self.ops for op in layerOps]
+        self.ops = [[] for layerOps in self.ops]
+        keys = [self.key(op) for op in ops]
+        dirtyRects = self.merge(self.diff(self.lastOps, self.lastKeys, ops, keys))
+        self.lastOps = ops
+        self.lastKeys = keys
+        self.frames += 1
+        self.dirtyRects = dirtyRects
+        self.dirtyArea = sum(rect.width * rect.height for rect in dirtyRects)
+        self.totalDirtyArea += self.dirtyArea
+        if not dirtyRects:
+            profiler.lap('blit')
+            return
+        with renderLock:
+            for dirtyRect in dirtyRects:
+                self.surface.set_clip(dirtyRect)
+                self.surface.fill((0,0,0))
+                for source,rect in ops:
+                    if not rect.colliderect(dirtyRect):
+                        continue
+                    if isinstance(source, tuple):
+                        pygame.draw.rect(self.surface, source, rect)
+                    else:
+                        self.surface.blit(source, rect)
+            self.surface.set_clip(None)
+        profiler.lap('blit')
+        pygame.display.update(dirtyRects)
+        profiler.lap('display')
+        self.updatedFrames += 1
+
+    def averageDirtyArea(self):
+        """1フレームあたりの描き直し面積の平均。"""
+        return self.totalDirtyArea / self.frames if self.frames else 0.0
+
+
+class FrameIdler:
+    """アニメーションのない静止画面でゲームループを止めておくクラス。インスタンスは一個だけ生成する。
+    画面が変わらず、アニメーションもないフレームがsettleFrames回続いたら、
+    clock.tickで回すかわりにpygame.event.waitで入力を待つ。入力が来たらイベントを戻して通常のループに戻る。
+    property
+        enabled Falseならいつもclock.tickで回す
+        timeout 待つ時間の上限(ミリ秒)。過ぎたら1フレームだけ回してまた待つ
+        waits 待った回数
+        idleTime 待っていた時間の合計(秒)
+        idleCpuTime 待っているあいだに使ったCPU時間の合計(秒)
+        lastWakeLatency 入力で起きてからそのフレームを描き終わるまでの時間(秒)
+        maxWakeLatency lastWakeLatencyの最大
+    """
+
+    def __init__(self, enabled=True, timeout=500, settleFrames=2):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.settleFrames = settleFrames
+        self.quietFrames = 0
+        self.wokeAt = None
+        self.waits = 0
+        self.wakes = 0
+        self.idleTime = 0.0
+        self.idleCpuTime = 0.0
+        self.lastWakeLatency = 0.0
+        self.maxWakeLatency = 0.0
+        self.totalWakeLatency = 0.0
+
+    def frameDone(self, busy):
+        """フレームの最後に呼ぶ。busyは画面が変わったかアニメーション中ならTrue。"""
+        if self.wokeAt is not None:
+            self.lastWakeLatency = time.perf_counter() - self.wokeAt
+            self.maxWakeLatency = max(self.maxWakeLatency, self.lastWakeLatency)
+            self.totalWakeLatency += self.lastWakeLatency
+            self.wokeAt = None
+        self.quietFrames = 0 if busy else self.quietFrames + 1
+
+    def idle(self):
+        """ループを止めて待ってよいならTrue。"""
+        return self.enabled and self.quietFrames >= self.settleFrames
+
+    def wait(self, until=None):
+        """入力が来るかtimeoutが過ぎるまで待つ。来たイベントはキューに戻して各モードに処理させる。
+        untilはpygame.time.get_ticksの時刻(ミリ秒)で、skipタグのpauseのように決まった時刻に
+        フレームを回したいときは、それより長くは待たない。"""
+        timeout = self.timeout
+        if until is not None:
+            # event.waitは0だとずっと待ってしまう
+            timeout = max(1, min(timeout, until - pygame.time.get_ticks()))
+        start = time.perf_counter()
+        startCpu = time.process_time()
+        event = pygame.event.wait(timeout)
+        self.idleTime += time.perf_counter() - start
+        self.idleCpuTime += time.process_time() - startCpu
+        self.waits += 1
+        if event.type != NOEVENT:
+            # 起こしたイベントはキューの先頭にあったものなので、後ろに来ていたものより先に戻す
+            for queued in [event] + pygame.event.get():
+                pygame.event.post(queued)
+            # 入力を処理したフレームの次でやっと画面に出るものがあるので、また何フレームか回す
+            self.quietFrames = 0
+            self.wokeAt = time.perf_counter()
+            self.wakes += 1
+
+    def report(self):
+        """待機状況をディクショナリで返す。"""
+        return {
+            'waits': self.waits,
+            'wakes': self.wakes,
+            'idleTime': self.idleTime,
+            'idleCpuTime': self.idleCpuTime,
+            'idleCpuRatio': self.idleCpuTime / self.idleTime if self.idleTime else 0.0,
+            'lastWakeLatencyMs': self.lastWakeLatency * 1000,
+            'maxWakeLatencyMs': self.maxWakeLatency * 1000,
+            'averageWakeLatencyMs': self.totalWakeLatency / self.wakes * 1000 if self.wakes else 0.0,
+        }
+
+
+class FrameProfiler:
+    """フレームごとに、処理の段階ごとにかかった時間を記録するクラス。インスタンスは一個だけ生成する。
+    ゲームループはフレームの最初にstartFrame、最後にendFrameを呼び、
+    処理の区切りごとにlap(段階)を呼ぶ。前の区切りからの時間がその段階に足される。
+    enabledがFalseならどのメソッドもすぐ戻るので、ほとんど重くならない。
+    段階
+        event イベント処理(キー入力と、それで起きるセーブ、ロードなど)
+        tag イベントタグの処理
+        text ダイアログ文字のレンダリングと登録
+        image 画像の表示状態の更新と登録
+        blit compositorの差分計算と描き直し
+        display display.update
+        other それ以外(ヘルプ、アナウンス、オープニングなど)
+        wait 次のフレームまでの待ち。frame(1フレームの処理時間)には入れない
+    property
+        enabled
+        records フレームごとの記録(フレーム番号, 開始時刻ms, モード, ページ, 各段階ms, frame)。古いものから捨てる
+        windows 段階ごと(とframe)の直近windowフレームぶんの時間(ms)。パーセンタイルはここから出す
+    """
+
+    PHASES = ('event', 'tag', 'text', 'image', 'blit', 'display', 'other', 'wait')
+
+    def __init__(self, enabled=False, history=100000, window=300):
+        self.enabled = enabled
+        self.records = deque(maxlen=history)
+        self.windows = {phase: deque(maxlen=window) for phase in FrameProfiler.PHASES + ('frame',)}
+        self.frameNum = 0
+        self.started = time.perf_counter()
+        self.frameStart = self.last = self.started
+        self.mode = ''
+        self.page = 0
+        self.current = dict.fromkeys(FrameProfiler.PHASES, 0.0)
+        # オーバーレイの文字は何度も作らないよう、間をあけて作りなおす
+        self.overlayLines = []
+        self.overlayAt = 0.0
+
+    def startFrame(self, mode, page):
+        """フレームの最初に呼ぶ。"""
+        if not self.enabled:
+            return
+        self.frameStart = self.last = time.perf_counter()
+        self.mode = mode
+        self.page = page
+        self.current = dict.fromkeys(FrameProfiler.PHASES, 0.0)
+
+    def lap(self, phase):
+        """前の区切りからここまでの時間をphaseに足す。"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    def endFrame(self):
+        """フレームの最後に呼ぶ。このフレームの記録を残す。"""
+        if not self.enabled:
+            return
+        times = [self.current[phase] * 1000 for phase in FrameProfiler.PHASES]
+        frame = sum(times) - self.current['wait'] * 1000
+        for phase,ms in zip(FrameProfiler.PHASES, times):
+            self.windows[phase].append(ms)
+        self.windows['frame'].append(frame)
+        self.records.append((self.frameNum, (self.frameStart - self.started) * 1000,
+            self.mode, self.page) + tuple(times) + (frame,))
+        self.frameNum += 1
+
+    def percentile(self, values, q):
+        """valuesのqパーセンタイル(最近傍)。"""
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[max(0, -(-len(values) * q // 100) - 1)]
+
+    def rolling(self):
+        """直近windowフレームの段階ごとのp50、p95、p99、最大(ms)。"""
+        stats = {}
+        for phase,values in self.windows.items():
+            stats[phase] = {
+                'p50': self.percentile(values, 50),
+                'p95': self.percentile(values, 95),
+                'p99': self.percentile(values, 99),
+                'max': max(values) if values else 0.0,
+            }
+        return stats
+
+    def summary(self):
+        """記録した全フレームの段階ごとのp50、p95、p99、最大、平均(ms)。"""
+        columns = FrameProfiler.PHASES + ('frame',)
+        stats = {'frames': len(self.records)}
+        for i,phase in enumerate(columns):
+            values = [record[4+i] for record in self.records]
+            stats[phase] = {
+                'p50': self.percentile(values, 50),
+                'p95': self.percentile(values, 95),
+                'p99': self.percentile(values, 99),
+                'max': max(values) if values else 0.0,
+                'mean': sum(values) / len(values) if values else 0.0,
+            }
+        return stats
+
+    def overlay(self, interval=0.5):
+        """オーバーレイに出す行のリスト。interval秒ごとに作りなおす。"""
+        now = time.perf_counter()
+        if now - self.overlayAt >= interval:
+            self.overlayAt = now
+            stats = self.rolling()
+            layerTotal = layerCache.hits + layerCache.misses
+            self.overlayLines = [
+                'frame p50 %.1fms p95 %.1fms max %.1fms' % (
+                    stats['frame']['p50'], stats['frame']['p95'], stats['frame']['max']),
+                'p95 tag %.1f text %.1f image %.1f blit %.1f display %.1f' % tuple(
+                    stats[phase]['p95'] for phase in ('tag', 'text', 'image', 'blit', 'display')),
+                'text cache %.0f%% layer cache %.0f%%' % (
+                    textCache.hitRate() * 100, layerCache.hits / layerTotal * 100 if layerTotal else 0.0),
+            ]
+        return self.overlayLines
+
+    def export(self, path):
+        """記録をpathに書き出す。拡張子が.jsonならJSON、それ以外はCSV。"""
+        columns = ('frame', 'time', 'mode', 'page') + tuple(FrameProfiler.PHASES) + ('total',)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            if path.endswith('.json'):
+                json.dump({
+                    'unit': 'ms',
+                    'columns': columns,
+                    'summary': self.summary(),
+                    'records': list(self.records),
+                }, f, ensure_ascii=False)
+            else:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                for record in self.records:
+                    writer.writerow(record[:1] + ('%.3f' % record[1],) + record[2:4]
+                        + tuple('%.3f' % ms for ms in record[4:]))
 
 
 class TagParse(HTMLParser):
@@ -242,6 +1179,1023 @@ class TagParse(HTMLParser):
         self.dic = dict(attrs)
 
 
+class ScriptText:
+    """メインテキストを、パラグラフの位置(バイトオフセット)だけ覚えておいて必要なときに読むクラス。
+    textListとしてParagraphのリストのかわりに使う。len、インデックス、スライス、forが使える。
+    ファイルはmmapで開いたままにして、読み込み時に一回だけ全体を走査してパラグラフの区切りを探す。
+    文字コードは先頭のサンプルで見当をつけ、読み込み時に全パラグラフをデコードして確かめる。
+    デコードできないパラグラフがあれば、encodingsの次の文字コードで全体を読みなおす。
+    使い終わったらcloseで閉じる。パラグラフは使うときにデコードしてParagraphにし、
+    最近使ったcacheSize個だけ覚えておく。台本がどんなに長くても覚えておくのは位置の配列だけ。
+    property
+        path
+        encoding 判定した文字コード
+        starts 各パラグラフの開始バイト位置
+        ends 各パラグラフの終了バイト位置
+        size ファイルのバイト数
+        prevDisplayable 各パラグラフから前に向かって(自分も含めて)一番近い、表示するパラグラフの番号。なければ-1
+        nextDisplayable 各パラグラフから後ろに向かって(自分も含めて)一番近い、表示するパラグラフの番号。なければ-1
+    """
+
+    # 空行(改行ふたつ)がパラグラフの区切り。改行は\r\n、\r、\nのどれでもよい
+    # \r\nを\rと\nのふたつに数えないように、\rだけの改行は後ろに\nがないものに限る
+    separator = re.compile(rb'(?:\r\n|\r(?!\n)|\n)(?:\r\n|\r(?!\n)|\n)')
+    # 判定する文字コード。前から順に試す
+    encodings = ('utf-8', 'sjis', 'euc-jp', 'ascii')
+    # 文字コードの見当をつけるのに使う先頭のバイト数
+    sampleSize = 64 * 1024
+
+    def __init__(self, path, cacheSize=64):
+        self.path = path
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.file = open(path, 'rb')
+        size = self.size = os.fstat(self.file.fileno()).st_size
+        # 空のファイルはmmapできない
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.encoding = self.detectEncoding(self.data[:ScriptText.sampleSize])
+        self.starts = array('q', [0])
+        self.ends = array('q')
+        for match in ScriptText.separator.finditer(self.data):
+            self.ends.append(match.start())
+            self.starts.append(match.end())
+        self.ends.append(size)
+        self.createNavigation()
+
+    def createNavigation(self):
+        """ページ戻りモードで使う索引(prevDisplayable、nextDisplayable)を作る。
+        パラグラフはコンパイルせず、Paragraph.isDisplayableで文字列だけ見る。
+        ついでに全パラグラフをデコードして文字コードを確かめ、タグを検査して書き間違いは読み込み時にエラーにする。
+        デコードできないパラグラフがあれば、encodingsの次の文字コードにして最初からやりなおす。"""
+        encodings = ScriptText.encodings
+        candidates = list(encodings[encodings.index(self.encoding)+1:])
+        while True:
+            try:
+                self.scanParagraphs()
+                return
+            except UnicodeDecodeError as e:
+                if not candidates:
+                    raise ValueError('%s: cannot decode with any of %s (%s)'
+                        % (os.path.basename(self.path), ', '.join(encodings), e))
+                self.encoding = candidates.pop(0)
+                self.cache.clear()
+
+    def scanParagraphs(self):
+        """いまのencodingで全パラグラフをデコードして、索引を作りタグを検査する。
+        デコードできなければUnicodeDecodeError。"""
+        count = len(self.starts)
+        self.prevDisplayable = array('q', [-1]) * count
+        self.nextDisplayable = array('q', [-1]) * count
+        found = -1
+        checked = set()
+        for index in range(count):
+            draft = self.draft(index)
+            self.validate(index, draft, checked)
+            if Paragraph.isDisplayable(draft):
+                found = index
+            self.prevDisplayable[index] = found
+        found = -1
+        for index in range(count-1, -1, -1):
+            if self.prevDisplayable[index] == index:
+                found = index
+            self.nextDisplayable[index] = found
+
+    def validate(self, index, draft, checked):
+        """パラグラフのタグを検査する。おかしければ、何番目のパラグラフかを添えてValueError。
+        checkedは検査済みのタグ行のset。同じ行は何度も検査しない。"""
+        for line in draft.split('\n'):
+            if line.startswith('<event ') and line.endswith('>') and line not in checked:
+                try:
+                    EventTag(line)
+                except ValueError as e:
+                    raise ValueError('%s paragraph %d: %s' % (os.path.basename(self.path), index+1, e))
+                checked.add(line)
+
+    def seek(self, index, back, last):
+        """indexから表示するパラグラフを探して番号を返す。探すのは0~lastの範囲。
+        backがTrueなら前へ、Falseなら後ろへ探して、なければ逆向きに探す。どちらにもなければindexのまま。"""
+        if back:
+            found = self.prevDisplayable[index]
+            if found < 0:
+                found = self.nextDisplayable[index]
+        else:
+            found = self.nextDisplayable[index]
+            if found < 0 or found > last:
+                found = self.prevDisplayable[index]
+        return index if (found < 0 or found > last) else found
+
+    def detectEncoding(self, sample):
+        """サンプルをエラーなしでデコードできた文字コードを返す。"""
+        for enc in ScriptText.encodings:
+            try:
+                # サンプルの最後で文字が切れていてもいいように、インクリメンタルデコーダを使う
+                codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+                return enc
+            except UnicodeDecodeError:
+                pass
+        return 'utf-8'
+
+    def draft(self, index):
+        """パラグラフの文字列を返す。改行は\nにそろえる。closeしたあとはValueError。"""
+        raw = self.data[self.starts[index]:self.ends[index]]
+        text = raw.decode(self.encoding)
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+
+    def close(self):
+        """mmapとファイルを閉じる。裏のスレッドが読みかけていても、そのパラグラフがValueErrorになるだけ。"""
+        with self.lock:
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+            self.file.close()
+            self.cache.clear()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('paragraph index out of range')
+        with self.lock:
+            paragraph = self.cache.get(index)
+            if paragraph is not None:
+                self.cache.move_to_end(index)
+                return paragraph
+        paragraph = self.compile(index)
+        with self.lock:
+            self.cache[index] = paragraph
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        return paragraph
+
+    def __iter__(self):
+        """全パラグラフを順に出す。走査用なのでキャッシュには入れない。"""
+        for index in range(len(self)):
+            yield self.compile(index)
+
+    def compile(self, index):
+        """パラグラフをParagraphにする。タグがおかしければ、何番目のパラグラフかを添えてValueError。"""
+        try:
+            return Paragraph(self.draft(index))
+        except ValueError as e:
+            raise ValueError('%s paragraph %d: %s' % (os.path.basename(self.path), index+1, e))
+
+
+def parseColor(value):
+    """タグに書いた色(255,0,0のようにカンマ区切りの0~255の整数が3個か4個)をタプルにする。おかしければValueError。"""
+    color = tuple(int(part) for part in value.strip('()').split(','))
+    if len(color) not in (3, 4) or not all(0 <= c <= 255 for c in color):
+        raise ValueError(value)
+    return color
+
+
+class TagRegistry:
+    """イベントタグの種類ごとに、処理する関数と属性の型を登録しておくクラス。インスタンスは一個だけ生成する。
+    EventTagはコンパイル時にここで属性を検査して型を変換しておき、dialogEventは種類名で処理を一回引くだけ。
+    カセットはotherフォルダに置いたプラグイン(Conf.tagPlugins)から、DialogFrame.pyを触らずにタグを足せる。
+    プラグインはregister(registry, engine)という関数を持つ.pyファイル。
+        registry このインスタンス。registry.register(...)でタグを登録する
+        engine 動いているDialogFrameモジュール。compositor、textCache、fonts、Confなどが使える
+    処理はhandler(frame, dic)で呼ぶ。frameはDialogFrameインスタンス、dicは型を変換済みの属性。
+    属性の型
+        str 文字列のまま
+        int 整数
+        float 小数
+        flag 値を書かない属性(putなど)
+        color 色。255,0,0のようにカンマ区切りの整数3個(RGB)か4個(RGBA)
+    property
+        handlers タグ名をキーにした処理のディクショナリ
+        attrs タグ名をキーにした{属性名: 型}のディクショナリ
+        required タグ名をキーにした、必ず書く属性のタプル
+    """
+
+    types = {'str': str, 'int': int, 'float': float, 'flag': None, 'color': parseColor}
+
+    def __init__(self):
+        self.handlers = {}
+        self.attrs = {}
+        self.required = {}
+
+    def register(self, name, handler, attrs={}, required=()):
+        """タグを登録する。同じ名前がすでにあれば置き換える。"""
+        for key,kind in attrs.items():
+            if kind not in TagRegistry.types:
+                raise ValueError('Unknown attribute type "%s" for %s.%s' % (kind, name, key))
+        self.handlers[name] = handler
+        self.attrs[name] = dict(attrs, name='str')
+        self.required[name] = tuple(required)
+
+    def compile(self, line, dic):
+        """パースしたタグの属性を検査して、型を変換したディクショナリを返す。おかしければValueError。"""
+        name = dic.get('name')
+        if name not in self.handlers:
+            raise ValueError('Unknown event tag "%s": %s' % (name, line))
+        attrs = self.attrs[name]
+        result = {}
+        for key,value in dic.items():
+            if key not in attrs:
+                raise ValueError('Unknown attribute "%s" for %s tag: %s' % (key, name, line))
+            kind = attrs[key]
+            if kind == 'flag':
+                result[key] = value
+                continue
+            if value is None:
+                raise ValueError('Attribute "%s" needs a value: %s' % (key, line))
+            try:
+                result[key] = TagRegistry.types[kind](value)
+            except ValueError:
+                raise ValueError('Attribute "%s" must be %s: %s' % (key, kind, line))
+        for key in self.required[name]:
+            if key not in result:
+                raise ValueError('Attribute "%s" is required: %s' % (key, line))
+        return result
+
+    def loadPlugins(self, folder, names, engine):
+        """folderにあるプラグインを読んで、register(self, engine)を呼ぶ。"""
+        for name in names:
+            path = folder+os.sep+name
+            spec = importlib.util.spec_from_file_location(
+                'dialogframe_plugin_' + os.path.splitext(name)[0], path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.register(self, engine)
+
+
+# イベントタグの登録簿。組み込みのタグはDialogFrameクラスのあとで登録する
+tagRegistry = TagRegistry()
+
+
+class EventTag:
+    """パース済みのイベントタグ。メインテキストのコンパイル時に一度だけ作る。
+    属性はtagRegistryに登録された型で検査して変換する。知らないタグや属性、型の合わない値はValueError。
+    property
+        raw タグ行の文字列
+        name タグの種類(image, sound, bgm, text, skip, dice, それとプラグインで足したもの)
+        attrs 属性のディクショナリ。型は変換済み。
+        backPass ページ戻りモードでも処理するタグならTrue
+    """
+
+    def __init__(self, line):
+        parser = TagParse()
+        parser.feed(line)
+        self.raw = line
+        self.attrs = tagRegistry.compile(line, getattr(parser, 'dic', {}))
+        self.name = self.attrs['name']
+        self.backPass = False
+        for string in Conf.pageBackMode['pass']:
+            if line.startswith(string):
+                self.backPass = True
+
+
+class SpeakerIndex:
+    """発言者と立ち絵の関連付け(Conf.linkingList)を、引きやすい形にしておくクラス。インスタンスは一個だけ生成する。
+    キーは全部まとめた正規表現で、行を一回走査するだけで探す。各位置では一番長いキーに当たるので、
+    その中に含まれる短いキーはcontainedで補う。
+    画像名からは、その画像がmainかbackになっている関連付けと、相方の画像が引ける。
+    property
+        links (キー, main, back)のリスト。linkingListの順
+        pattern 全キーのどれかに当たる正規表現
+        contained キーをキーにした、そのキーの中に含まれるほかのキーのタプル
+        linksOf 画像名をキーにした、その画像がmainかbackになっている関連付け(linksの番号)のリスト
+        partners 画像名をキーにした相方の画像名
+    """
+
+    def __init__(self, linkingList):
+        self.links = []
+        for linkingDic in linkingList:
+            for key,dic in linkingDic.items():
+                self.links.append((key, dic['main'], dic['back']))
+        keys = sorted({link[0] for link in self.links}, key=len, reverse=True)
+        # 先読みにしておけば、キーどうしが重なっていても全部の位置で当たる
+        self.pattern = re.compile('(?=(%s))' % '|'.join(re.escape(key) for key in keys)) if keys else None
+        self.contained = {key: tuple(other for other in keys if other != key and other in key) for key in keys}
+        self.linksOf = {}
+        self.partners = {}
+        for i,(key,main,back) in enumerate(self.links):
+            self.linksOf.setdefault(main, []).append(i)
+            self.linksOf.setdefault(back, []).append(i)
+            self.partners[main] = back
+            self.partners[back] = main
+
+    def find(self, line):
+        """行に出てくるキーのsetを返す。"""
+        found = set()
+        if self.pattern is None:
+            return found
+        for match in self.pattern.finditer(line):
+            key = match.group(1)
+            if key not in found:
+                found.add(key)
+                found.update(self.contained[key])
+        return found
+
+
+class Paragraph:
+    """メインテキストの1パラグラフをコンパイルしたもの。
+    property
+        lines EventTagとテキスト行(str)を出現順に並べたリスト。コメント行は含まない。
+        textLines テキスト行だけのリスト
+        tags EventTagだけのリスト
+        speakerKeys パラグラフに出てくる関連付け画像(Conf.linkingList)のキー
+        skipBack <event name=skip back>を含むならTrue
+        displayable ページ戻りモードで表示するパラグラフならTrue
+        animated 繰り返すアニメーション(shakeかblink)をするimageタグを含むならTrue
+    """
+
+    def __init__(self, draft):
+        self.lines = []
+        self.textLines = []
+        self.tags = []
+        speakerKeys = set()
+        self.skipBack = False
+        for line in draft.split('\n'):
+            # <event name=skip back>のときは通常行があろうとページ戻りモードでスキップする
+            if 'event name=skip' in line and 'back' in line:
+                self.skipBack = True
+            if (line.startswith('<event ') and line.endswith('>')):
+                tag = EventTag(line)
+                self.lines.append(tag)
+                self.tags.append(tag)
+            elif line.startswith('#'):
+                # コメント欄は捨てる
+                pass
+            else:
+                speakerKeys.update(speakerIndex.find(line))
+                self.lines.append(line)
+                self.textLines.append(line)
+        self.speakerKeys = frozenset(speakerKeys)
+        self.displayable = Paragraph.isDisplayable(draft)
+        self.animated = any(('shake' in tag.attrs or 'blink' in tag.attrs) for tag in self.tags)
+
+    @staticmethod
+    def isDisplayable(draft):
+        """ページ戻りモードで表示するパラグラフならTrue。タグをパースせずに文字列だけで判定する。
+        <event name=skip back>がなくて、通常行かページ戻りモードでも処理するタグがあれば表示する。"""
+        displayable = False
+        for line in draft.split('\n'):
+            if 'event name=skip' in line and 'back' in line:
+                return False
+            if (line.startswith('<event ') and line.endswith('>')):
+                if any(line.startswith(string) for string in Conf.pageBackMode['pass']):
+                    displayable = True
+            elif not line.startswith('#'):
+                displayable = True
+        return displayable
+
+
+class DisplayList:
+    """表示中の画像を、層ごとに表示順で持つクラス。__status['imageOrder']はこれ。
+    層は下からLAYERSの順で、同じ層の中は置いた順。入れ替えた画像は、入れ替える前の画像の位置に入る。
+    画像名から(層, 通し番号)を辞書で引くので、あるかどうか・置く・消す・入れ替えるはO(1)。
+    表示順のタプルは中身が変わったときだけ作りなおす。
+    property
+        defaultLayers 画像名をキーにした、その画像を置く層。Conf.imageConfのlayerから作る。ないものはCHARACTER
+        entries 画像名をキーにした(層, 通し番号)
+        counts 層ごとの画像の数
+        serial 次に置く画像の通し番号
+    """
+
+    LAYERS = ('background', 'character', 'ui', 'overlay')
+    BACKGROUND, CHARACTER, UI, OVERLAY = range(len(LAYERS))
+    # imageタグのremoveallで消す層。OVERLAYはいつでも画像オープンの層なので消さない
+    SCENE_LAYERS = (BACKGROUND, CHARACTER, UI)
+    defaultLayers = {}
+
+    def __init__(self, names=()):
+        self.entries = {}
+        self.counts = [0] * len(DisplayList.LAYERS)
+        self.serial = 0
+        self.__order = ()
+        for name in names:
+            self.put(name)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.order())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __eq__(self, other):
+        if not isinstance(other, DisplayList):
+            return NotImplemented
+        return self.exportState() == other.exportState()
+
+    def __repr__(self):
+        return 'DisplayList(%r)' % (self.exportState(),)
+
+    def order(self):
+        """表示順(下から)の画像名のタプル。"""
+        if self.__order is None:
+            self.__order = tuple(sorted(self.entries, key=self.entries.__getitem__))
+        return self.__order
+
+    def layerOf(self, name):
+        """画像を置いている層。置いてなければNone。"""
+        entry = self.entries.get(name)
+        return None if entry is None else entry[0]
+
+    def hasLayer(self, layer):
+        """層に画像があるか。"""
+        return self.counts[layer] > 0
+
+    def put(self, name, layer=None):
+        """画像を層の一番上に置く。もう置いてあれば何もしない。layerがなければdefaultLayersの層。"""
+        if name in self.entries:
+            return
+        if layer is None:
+            layer = DisplayList.defaultLayers.get(name, DisplayList.CHARACTER)
+        self.entries[name] = (layer, self.serial)
+        self.counts[layer] += 1
+        self.serial += 1
+        self.__order = None
+
+    def remove(self, name):
+        """画像を消す。置いてなければ何もしない。"""
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.counts[entry[0]] -= 1
+            self.__order = None
+
+    def replace(self, old, new):
+        """oldのあった層と位置にnewを置く。newがほかの位置にあればそっちは消す。"""
+        if old == new or old not in self.entries:
+            return
+        self.remove(new)
+        self.entries[new] = self.entries.pop(old)
+        self.__order = None
+
+    def clear(self, layers=None):
+        """layersの層(なければ全部の層)の画像を消す。"""
+        if layers is None:
+            layers = range(len(DisplayList.LAYERS))
+        for name in [name for name,entry in self.entries.items() if entry[0] in layers]:
+            self.remove(name)
+
+    def copy(self):
+        displayList = DisplayList()
+        displayList.entries = dict(self.entries)
+        displayList.counts = list(self.counts)
+        displayList.serial = self.serial
+        displayList.__order = self.__order
+        return displayList
+
+    def exportState(self):
+        """セーブ用に表示順のリストにする。defaultLayersと違う層に置いた画像だけ[画像名, 層]にする。"""
+        state = []
+        for name in self.order():
+            layer = self.entries[name][0]
+            if layer == DisplayList.defaultLayers.get(name, DisplayList.CHARACTER):
+                state.append(name)
+            else:
+                state.append([name, layer])
+        return state
+
+    @classmethod
+    def fromState(cls, state):
+        """exportStateのリスト(バージョン1.0の画像名だけのリストでもいい)から作る。"""
+        displayList = cls()
+        for item in state:
+            if isinstance(item, str):
+                displayList.put(item)
+            else:
+                displayList.put(item[0], int(item[1]))
+        return displayList
+
+
+def applyImageTag(dic, order, positions):
+    """imageタグのうち、表示順(imageOrder)と座標にかかわる部分を反映する。shakeは扱わない。
+    orderはDisplayList、positionsはファイル名から座標のリストを引けるもの。
+    ゲーム中の状態にも、先読み用に写した状態にも使う。
+    """
+    # property: name file x y put remove changefrom changeto
+    if 'x' in dic:
+        positions[dic['file']][0] = int(dic['x'])
+    if 'y' in dic:
+        positions[dic['file']][1] = int(dic['y'])
+    if ('put' in dic) and (dic['file'] not in order):
+        order.put(dic['file'])
+        # imageOrder内にリンク画像同士があったら今追加したのを削除 = リンク画像は片方しか表示できない
+        # 見るのは今追加した画像の関連付けだけ
+        for i in speakerIndex.linksOf.get(dic['file'], ()):
+            key, main, back = speakerIndex.links[i]
+            if main in order and back in order:
+                order.remove(dic['file'])
+                break
+    if 'remove' in dic:
+        if dic['file'] not in order:
+            # 表示してないのにremoveしようとするのはただのミスか、あるいはリンク画像の可能性
+            for i in speakerIndex.linksOf.get(dic['file'], ()):
+                key, main, back = speakerIndex.links[i]
+                if dic['file'] == main and back in order:
+                    order.remove(back)
+                elif dic['file'] == back and main in order:
+                    order.remove(main)
+        else:
+            order.remove(dic['file'])
+    if 'removeall' in dic:
+        order.clear(DisplayList.SCENE_LAYERS)
+    if ('changefrom' in dic and 'changeto' in dic
+                and dic['changefrom'] in order):
+        order.replace(dic['changefrom'], dic['changeto'])
+
+
+def applyLinking(speakerKeys, order, positions):
+    """発言者と立ち絵の関連付けを反映する。
+    キーがspeakerKeysに入ってたらmainを、入ってなけりゃbackを表示する。
+    見るのは表示中の画像にかかわる関連付けだけで、linkingListの順に当てる。"""
+    linksOf = speakerIndex.linksOf
+    pending = [i for name in order if name in linksOf for i in linksOf[name]]
+    heapq.heapify(pending)
+    done = -1
+    while pending:
+        i = heapq.heappop(pending)
+        if i <= done:
+            continue
+        done = i
+        key, main, back = speakerIndex.links[i]
+        if key in speakerKeys:
+            # backがある -> mainと交換
+            source, target = back, main
+        else:
+            # mainがある -> backと交換
+            source, target = main, back
+        if source in order:
+            order.replace(source, target)
+            # 座標も同じにする
+            positions[target] = positions[source]
+            # 入れ替えた画像にかかわる、あとの関連付けも見る
+            for j in linksOf[target]:
+                if j > i:
+                    heapq.heappush(pending, j)
+
+
+def layerSignature(order, positions):
+    """表示中の画像と座標をページレイヤーのキーにできる形にする。"""
+    return tuple((name, positions[name][0], positions[name][1]) for name in order)
+
+
+class Tween:
+    """Timelineのアニメーション一個。曲線は始めたときに作っておく。
+    property
+        kind 'shake' 'move' 'fade' 'blink'
+        curve 種類ごとの曲線。shakeは(dx, dy)のタプル、moveは始めのずれ(dx, dy)、blinkは点滅の半周期(ミリ秒)
+        start 始めた時刻(ミリ秒)
+        duration 長さ(ミリ秒)。Noneならシーンが変わるまで繰り返す
+        scene 始めたときの(モード, ページ)
+    """
+
+    def __init__(self, kind, curve, start, duration, scene):
+        self.kind = kind
+        self.curve = curve
+        self.start = start
+        self.duration = duration
+        self.scene = scene
+
+    def finished(self, now):
+        return self.duration is not None and now - self.start >= self.duration
+
+    def sample(self, now):
+        """時刻nowの(dx, dy, alpha, visible)を返す。"""
+        elapsed = now - self.start
+        if self.kind == 'shake':
+            dx, dy = self.curve[(elapsed // Timeline.SHAKE_STEP) % len(self.curve)]
+            return dx, dy, 255, True
+        if self.kind == 'move':
+            # 始めのずれから0まで、だんだんゆっくりになるように
+            rest = 1.0 - min(1.0, elapsed / self.duration)
+            rest *= rest
+            return round(self.curve[0]*rest), round(self.curve[1]*rest), 255, True
+        if self.kind == 'fade':
+            return 0, 0, min(255, 255 * elapsed // self.duration), True
+        # blink
+        return 0, 0, 255, (elapsed // self.curve) % 2 == 0
+
+
+class Timeline:
+    """imageタグのアニメーション(shake move fade blink)を、経過ミリ秒で動かすクラス。
+    アニメーションは画像の座標(xy)を書き換えず、composeImagesで貼るときにずらしと透明度として当てる。
+    フレーム数ではなく時刻で動くので、framerateが変わっても同じ速さで動く。
+    タグは表示中のページで毎フレーム実行されるので、同じシーンの同じアニメーションは一回しか始めない。
+    長さのあるアニメーションは終わったら消え、シーンが変わっても最後まで動く。
+    繰り返すアニメーション(durationのないshakeとblink)はシーンが変わったら止まる。
+    property
+        tweens 画像名をキーにした{種類: Tween}
+        started 始めたアニメーションの(画像名, 種類, シーン)のset
+        scene いまの(モード, ページ)
+        faded 画像名をキーにした(元のサーフィス, 透明度を付けるために写したサーフィス)
+    """
+
+    # shakeで画像をずらす向き。左下、右上、下、左上、右、左、右下、上
+    SHAKE_CURVE = ((-1,1), (1,-1), (0,1), (-1,-1), (1,0), (-1,0), (1,-1), (0,-1))
+    # shakeの曲線の1点を出すミリ秒。もとはframerate 20で2フレームずつだった
+    SHAKE_STEP = 100
+
+    def __init__(self):
+        self.tweens = {}
+        self.started = set()
+        self.scene = None
+        self.faded = {}
+
+    def clear(self):
+        self.tweens.clear()
+        self.started.clear()
+        self.faded.clear()
+        self.scene = None
+
+    def start(self, name, kind, curve, duration, scene, now):
+        """画像nameのアニメーションを始める。同じシーンですでに始めていたら何もしない。"""
+        key = (name, kind, scene)
+        if key in self.started:
+            return
+        self.started.add(key)
+        if duration is not None and duration <= 0:
+            return
+        self.tweens.setdefault(name, {})[kind] = Tween(kind, curve, now, duration, scene)
+
+    def setScene(self, scene):
+        """いまのシーン(モード, ページ)を教える。変わっていたら繰り返すアニメーションを止める。"""
+        if scene == self.scene:
+            return
+        self.scene = scene
+        self.started = {key for key in self.started if key[2] == scene}
+        for name,tweens in self.tweens.items():
+            for kind in [kind for kind,tween in tweens.items()
+                    if tween.duration is None and tween.scene != scene]:
+                del tweens[kind]
+
+    def update(self, now, order):
+        """終わったアニメーションと、表示していない画像のアニメーションを捨てる。
+        関連付け(applyLinking)でmainとbackが入れ替わったときは、アニメーションを表示中の相方に移す。"""
+        for name in list(self.tweens):
+            tweens = self.tweens[name]
+            if name in order:
+                for kind in [kind for kind,tween in tweens.items() if tween.finished(now)]:
+                    del tweens[kind]
+            else:
+                partner = speakerIndex.partners.get(name)
+                if partner in order:
+                    # 相方で始めていたアニメーションのほうを残す
+                    partnerTweens = self.tweens.setdefault(partner, {})
+                    for kind,tween in tweens.items():
+                        partnerTweens.setdefault(kind, tween)
+                tweens.clear()
+            if not tweens:
+                del self.tweens[name]
+                self.faded.pop(name, None)
+
+    def running(self):
+        """動いているアニメーションがあるか。"""
+        return bool(self.tweens)
+
+    def apply(self, name, surface, xy, now):
+        """画像を貼るときの(サーフィス, 座標)を返す。blinkで消えているときサーフィスはNone。"""
+        tweens = self.tweens.get(name)
+        if not tweens:
+            return surface, tuple(xy)
+        x, y = xy
+        alpha = 255
+        visible = True
+        for tween in tweens.values():
+            dx, dy, tweenAlpha, tweenVisible = tween.sample(now)
+            x += dx
+            y += dy
+            alpha = alpha * tweenAlpha // 255
+            visible = visible and tweenVisible
+        if not visible:
+            return None, (x, y)
+        if alpha < 255:
+            # 元のサーフィスはページレイヤーでも使うので、写したほうに透明度を付ける
+            faded = self.faded.get(name)
+            if faded is None or faded[0] is not surface:
+                faded = self.faded[name] = (surface, surface.copy())
+            faded[1].set_alpha(alpha)
+            surface = faded[1]
+        return surface, (x, y)
+
+
+class Scene:
+    """SceneHistoryに入れる、ページ一個ぶんの場面。作ったあとは書き換えない。
+    property
+        order 表示中の画像(DisplayList)。いつでも画像は入れない
+        positions orderの画像の座標を、画像名をキーにした(x, y)で
+        bgm BGMの(name, vol, put)
+    """
+
+    def __init__(self, order, positions, bgm):
+        self.order = order
+        self.positions = positions
+        self.bgm = bgm
+
+
+class SceneHistory:
+    """ページごとの場面(Scene)を、最近のcapacityページぶんだけ覚えておくリングバッファ。
+    ページ戻りモードは戻った先のページの場面をここから一回引くだけで、そのときの画像とBGMを出せる。
+    ページ番号をcapacityで割った余りの場所に入れるので、覚えておくのは最大capacity個。
+    前に記録した場面と変わっていない部分(表示中の画像、座標、BGM)は写さずに同じオブジェクトを使い、
+    変わったものだけ写す。
+    property
+        capacity 覚えておくページ数
+        slots (ページ, Scene)を入れるリスト。空いていればNone
+        last 最後に記録したScene
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self.clear()
+
+    def clear(self):
+        self.slots = [None] * self.capacity
+        self.last = None
+
+    def record(self, page, order, positions, bgm):
+        """pageの場面としていまの状態を覚える。orderはDisplayList、positionsはファイル名から座標を引けるもの、
+        bgmはBGMの(name, vol, put)。"""
+        last = self.last
+        if order.hasLayer(DisplayList.OVERLAY):
+            order = order.copy()
+            order.clear((DisplayList.OVERLAY,))
+        if last is not None and last.order.entries == order.entries:
+            order = last.order
+        else:
+            order = order.copy()
+        xy = {name: tuple(positions[name]) for name in order}
+        if last is not None and last.positions == xy:
+            xy = last.positions
+        if last is not None and last.bgm == bgm:
+            bgm = last.bgm
+        if last is not None and (last.order, last.positions, last.bgm) == (order, xy, bgm):
+            scene = last
+        else:
+            scene = Scene(order, xy, bgm)
+        self.slots[page % self.capacity] = (page, scene)
+        self.last = scene
+
+    def get(self, page):
+        """pageの場面。覚えていなければNone。"""
+        slot = self.slots[page % self.capacity]
+        if slot is None or slot[0] != page:
+            return None
+        return slot[1]
+
+
+class ScriptState:
+    """台本を描画せずに頭からたどったときの、画像とBGMとSEの音量の状態。CheckpointIndexで使う。
+    タグのうち状態を変えるもの(imageタグ、bgmタグ、soundタグのvolume)と関連付けだけを当てる。
+    property
+        order 表示中の画像(DisplayList)
+        positions 画像名をキーにした座標のリスト
+        volumes SE名をキーにした音量。変えたものだけ
+        bgm BGMのname、vol、putのディクショナリ
+    引数を渡せばそれを状態として使う(スキップモードはゲーム中のimageOrderと座標をそのまま渡す)。なければ初期値。
+    """
+
+    def __init__(self, order=None, positions=None, volumes=None, bgm=None):
+        self.order = DisplayList() if order is None else order
+        self.positions = ({image['name']: list(Images.defaultXY) for image in Conf.imageConf}
+            if positions is None else positions)
+        self.volumes = {} if volumes is None else volumes
+        self.bgm = dict(BGMs.defaults) if bgm is None else bgm
+
+    def apply(self, paragraph):
+        """パラグラフのタグと関連付けを当てる。ゲーム中のタグの処理(imageTag、soundTag、bgmTag)と同じ結果になる。"""
+        for tag in paragraph.tags:
+            dic = tag.attrs
+            if tag.name == 'image':
+                applyImageTag(dic, self.order, self.positions)
+            elif tag.name == 'sound' and 'volume' in dic:
+                self.volumes[dic['file']] = float(dic['volume'])
+            elif tag.name == 'bgm':
+                if 'file' in dic and dic['file'] != self.bgm['name']:
+                    self.bgm['put'] = False
+                    self.bgm['name'] = dic['file']
+                if 'volume' in dic:
+                    self.bgm['vol'] = float(dic['volume'])
+                if self.bgm['put'] == False:
+                    if 'play' in dic:
+                        self.bgm['put'] = True
+                elif 'stop' in dic:
+                    self.bgm['put'] = False
+        applyLinking(paragraph.speakerKeys, self.order, self.positions)
+
+
+class CheckpointIndex:
+    """台本のintervalページごとに、そのページのタグを当てる前の状態(ScriptState)を覚えておく索引。
+    台本一個につき一回だけ作る。作るときは台本を頭から一回たどるだけで、描画はしない。
+    どのページの状態も、その前の一番近いチェックポイントを写して、多くてもintervalページぶんのタグを当てれば作れる。
+    property
+        textList 索引を作った台本
+        interval チェックポイントの間隔(ページ数)
+        checkpoints 0、interval、interval*2...ページのScriptState
+    """
+
+    def __init__(self, textList, interval):
+        self.textList = textList
+        self.interval = max(1, interval)
+        self.checkpoints = []
+        state = ScriptState()
+        for page,paragraph in enumerate(textList):
+            if page % self.interval == 0:
+                # 関連付けで座標のリストを共有しているところは、写しても共有のまま
+                self.checkpoints.append(copy.deepcopy(state))
+            state.apply(paragraph)
+
+    def stateAt(self, page):
+        """pageのタグを当てる前の状態を、新しいScriptStateで返す。"""
+        base = page // self.interval
+        state = copy.deepcopy(self.checkpoints[base])
+        for index in range(base * self.interval, page):
+            state.apply(self.textList[index])
+        return state
+
+
+class ReadPages:
+    """台本のどのパラグラフを読んだ(dialogModeで表示した)かを、1パラグラフ1ビットで持つクラス。
+    スキップモードで既読のパラグラフだけを飛ばすのに使う。セーブDBに台本のファイル名ごとに入れておき、
+    パラグラフ数が変わった台本のものは捨てる。
+    property
+        script 台本のファイル名
+        count パラグラフ数
+        bits ビット列。パラグラフpageはbits[page >> 3]の(page & 7)ビット目
+        dirty DBに書いてから既読が増えたらTrue
+        merged DBに入っていたビット列を足し終わっていたらTrue。足すのは書き込みスレッド(mergeStored)
+    """
+
+    def __init__(self, script, count, bits=None):
+        self.script = script
+        self.count = count
+        size = (count + 7) // 8
+        self.bits = bytearray(bits) if (bits is not None and len(bits) == size) else bytearray(size)
+        self.dirty = False
+        self.merged = False
+        # markはゲームループ、mergeは書き込みスレッドから呼ぶ
+        self.lock = threading.Lock()
+
+    def merge(self, bits):
+        """DBに入っていたビット列を足す。長さが違えば(パラグラフ数が変わった台本のものは)捨てる。"""
+        with self.lock:
+            if len(bits) == len(self.bits):
+                self.bits[:] = bytes(a | b for a,b in zip(self.bits, bits))
+            self.merged = True
+
+    def mergeStored(self, stored):
+        """DBAccess.loadReadPagesLaterのコールバック。storedは(パラグラフ数, ビット列)かNone。"""
+        # パラグラフ数が変わった台本の既読は使えない
+        self.merge(stored[1] if (stored is not None and stored[0] == self.count) else b'')
+
+    def mark(self, page):
+        mask = 1 << (page & 7)
+        if not self.bits[page >> 3] & mask:
+            with self.lock:
+                self.bits[page >> 3] |= mask
+            self.dirty = True
+
+    def isRead(self, page):
+        return bool(self.bits[page >> 3] & (1 << (page & 7)))
+
+
+class PageLayerCache:
+    """ページの静的な部分(表示中の画像とダイアログ文字)を一枚に合成したサーフィスを保持するクラス。
+    インスタンスは一個だけ生成する。キーは(メインテキスト, ページ番号, layerSignature)なので、
+    画像の状態やメインテキストが変わればキーも変わって古いレイヤーは使われない。
+    合計バイト数がbudgetを超えたら一番長く使われていないものから捨てる。
+    property
+        budget 保持するレイヤーの合計バイト数の上限。0ならレイヤーを使わない
+        size 保持しているレイヤーの合計バイト数
+        generation invalidateのたびに増える番号。裏で作りかけていたレイヤーが、捨てたあとに入らないように
+        hits, misses
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.layers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """レイヤーを返す。まだ出来ていなければNone。"""
+        with self.lock:
+            layer = self.layers.get(key)
+            if layer is None:
+                self.misses += 1
+                return None
+            self.layers.move_to_end(key)
+            self.hits += 1
+            return layer
+
+    def has(self, key):
+        """カウンタを動かさずに、レイヤーがあるかどうかを返す。"""
+        with self.lock:
+            return key in self.layers
+
+    def put(self, key, layer, generation=None):
+        """レイヤーを登録する。generationを渡せば、それが今のgenerationと違うとき(作っているあいだに
+        invalidateされたとき)は登録しない。"""
+        layerSize = layer.get_bytesize() * layer.get_width() * layer.get_height()
+        if layerSize > self.budget:
+            return
+        with self.lock:
+            if key in self.layers or (generation is not None and generation != self.generation):
+                return
+            self.layers[key] = layer
+            self.size += layerSize
+            while self.size > self.budget:
+                oldKey, oldLayer = self.layers.popitem(last=False)
+                self.size -= oldLayer.get_bytesize() * oldLayer.get_width() * oldLayer.get_height()
+
+    def invalidate(self):
+        """レイヤーを全部捨てる。ロードやタイトルに戻ったときなど、状態が飛んだときに呼ぶ。"""
+        with self.lock:
+            self.layers.clear()
+            self.size = 0
+            self.generation += 1
+
+
+class PagePrefetcher:
+    """今のページと、その先pagesページぶんのページレイヤーを裏のスレッドで作るクラス。
+    インスタンスは一個だけ生成する。
+    コンパイル済みのパラグラフのimageタグと関連付けを、写した画像の状態に順に当てて
+    各ページの表示状態を予想し、レイヤーを作ってPageLayerCacheに入れる。
+    新しい依頼が来たら、作りかけの古い依頼はやめる。
+    依頼したときのlayerCache.generationを覚えておき、そのあとでinvalidateされていたら作ったレイヤーは入れない。
+    """
+
+    def __init__(self, rsrc, layerCache, template, pages):
+        self.rsrc = rsrc
+        self.layerCache = layerCache
+        # レイヤーのピクセル形式はこのサーフィス(screen)に合わせる
+        self.template = template
+        self.pages = pages
+        self.request = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """スレッドを動かす。"""
+        if self.pages >= 0 and self.layerCache.budget > 0:
+            self.thread.start()
+
+    def prefetch(self, textList, page, order, positions):
+        """pageからpagesページ先までのレイヤー作りを依頼する。
+        order、positionsはpageのタグを当てたあとの状態を写したもの。"""
+        with self.condition:
+            self.request = (textList, page, order, positions, self.layerCache.generation)
+            self.condition.notify()
+
+    def cancel(self):
+        """作りかけの依頼をやめる。"""
+        with self.condition:
+            self.request = None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.request is None:
+                    self.condition.wait()
+                request = self.request
+                self.request = None
+            textList, page, order, positions, generation = request
+            for page in range(page, min(page+self.pages+1, len(textList))):
+                # 新しい依頼が来ていたら、こっちはもう要らない
+                if self.request is not None:
+                    break
+                try:
+                    paragraph = textList[page]
+                except ValueError:
+                    # おかしなタグがあるパラグラフ。エラーはゲームループのほうで出す
+                    break
+                for tag in paragraph.tags:
+                    if tag.name == 'image':
+                        applyImageTag(tag.attrs, order, positions)
+                applyLinking(paragraph.speakerKeys, order, positions)
+                if paragraph.animated:
+                    continue
+                key = (textList, page, layerSignature(order, positions))
+                if not self.layerCache.has(key):
+                    self.layerCache.put(key, self.build(paragraph, order, positions), generation)
+
+    def build(self, paragraph, order, positions):
+        """表示中の画像とダイアログ文字を一枚に合成する。"""
+        with renderLock:
+            layer = pygame.Surface(self.template.get_size(), 0, self.template)
+            layer.fill((0,0,0))
+            for imagename in order:
+                layer.blit(self.rsrc.imageDic[imagename].surface, tuple(positions[imagename]))
+            for textLineNum,line in enumerate(paragraph.textLines):
+                text = textCache.render(font, line, True, Conf.dialogColor)
+                layer.blit(text, (Conf.dialogX, Conf.dialogY+font.get_linesize()*textLineNum))
+        return layer
+
+
 class DialogFrame:
     """ダイアログプレイを起動するクラス。"""
 
@@ -251,66 +2205,220 @@ class DialogFrame:
         self.__status = {
             'default': {
                 'mode':'opening' if Conf.useOpening else 'dialog',
-                'page':0,'imageOrder':[],'num':0,'num2':0,'message':'','frameNum':0,
+                'page':0,'imageOrder':DisplayList(),'num':0,'message':'','frameNum':0,
             },
             'mode': 'opening' if Conf.useOpening else 'dialog',
             'page': 0,
-            # 現在表示している画像のblit順序を保存しておく
-            'imageOrder': [],
+            # 現在表示している画像を層ごとのblit順序で保存しておく。いつでも画像オープンの画像はOVERLAYの層
+            'imageOrder': DisplayList(),
             # ページ送りごとに初期値に戻る汎用プロパティ ダイスロールのときに使ったりする
             'num': 0,
-            'num2': 0,
             'message': '',
             # アニメーションのためのフレーム数
             'frameNum': 0,
             # ページ戻りモードのとき使用。「何ページ戻ったか」
             'pageBack': 0,
         }
+        # オープニング用のパラグラフリスト。Confから作るので初回に一度だけコンパイルする
+        self.__openingList = None
+        # このフレームでアニメーション(imageタグのアニメーション、ダイスロール、skip)が動いたらTrue。毎フレーム戻る
+        self.__animating = False
+        # imageタグのアニメーション
+        self.__timeline = Timeline()
+        # 待っているskipタグのpause。((モード, ページ), 終わる時刻)。待っていなければNone
+        self.__pause = None
+        # ページごとの場面。ページ戻りモードで使う
+        self.__scenes = SceneHistory(getattr(Conf, 'sceneHistoryPages', 256))
+        # ページ戻りモードに入る前に鳴らしていたBGMの(name, vol, put)。戻りモードでなければNone
+        self.__liveBGM = None
+        # seekPageで使う台本のCheckpointIndex。初めて飛ぶときに作る
+        self.__checkpoints = None
+        # いまの台本の既読(ReadPages)と、それを作ったときの台本。DBのぶんはスキップかセーブで要るときに足す
+        self.__readPages = None
+        self.__readPagesOf = None
+        # このフレームでdialogModeが文字を描いたページ。毎フレーム戻る
+        self.__drawnPage = None
+        # ページレイヤーを裏で作るスレッド。mainで動かす
+        self.__prefetcher = PagePrefetcher(self.__rsrc, layerCache, screen, getattr(Conf, 'prefetchPages', 3))
+        # 最後にレイヤーの先読みを依頼したページ
+        self.__prefetchedPage = None
+        # オーバーレイの行と、それをレンダリングしたもの
+        self.__profileLines = None
+        self.__profileTexts = []
+        # スロット一覧の状態。開いていなければNone
+        self.__slots = None
+
+    def createOpeningList(self):
+        """Confの設定からオープニング用のパラグラフリストを作る。"""
+        # line0: 土台表示
+        # line1: 「はじめから」選択中
+        # line2: 「つづきから」選択中
+        line0  = ('<event name=image removeall>\n')
+        line0 += ('<event name=image file="%s" x=0 y=0 put>\n'
+            % Conf.openingBackGroundImage)
+        line0 += ('<event name=bgm file="%s" volume=%s play>\n'
+            % (Conf.openingBGM['name'], Conf.openingBGM['volume']))
+        line0 += ('<event name=image file="%s" x=%s y=%s put>\n'
+            % (Conf.openingStart['name1'], Conf.openingStart['x'], Conf.openingStart['y']))
+        line0 += ('<event name=image file="%s" x=%s y=%s put>\n'
+            % (Conf.openingContinue['name1'], Conf.openingContinue['x'], Conf.openingContinue['y']))
+        line0 += '<event name=skip>'
+
+        line1  = ('<event name=image file="%s" remove>\n'
+            % Conf.openingContinue['name2'])
+        line1 += ('<event name=image file="%s" x=%s y=%s shake=%s put>'
+            % (Conf.openingStart['name2'], Conf.openingStart['x'],
+                Conf.openingStart['y'], Conf.openingStart['shake']))
+
+        line2  = ('<event name=image file="%s" remove>\n'
+            % Conf.openingStart['name2'])
+        line2 += ('<event name=image file="%s" x=%s y=%s shake=%s put>'
+            % (Conf.openingContinue['name2'], Conf.openingContinue['x'],
+                Conf.openingContinue['y'], Conf.openingContinue['shake']))
+
+        return [Paragraph(line) for line in (line0, line1, line2)]
+
+    def createOpeningList2(self):
+        """メインテキストがふたつ以上あるときのオープニング用パラグラフリストを作る。"""
+        # name2を全消しするタグを作っとく
+        removeName2 = ''
+        for openingStart in Conf.openingStartList:
+            removeName2 += ('<event name=image file="%s" remove>\n'
+                % openingStart['name2'])
+
+        textList = []
+        for i in range(len(Conf.openingStartList) + 1):
+            # +1は土台のぶん
+            if i == 0:
+                line  = '<event name=image removeall>\n'
+                line += ('<event name=image file="%s" x=0 y=0 put>\n'
+                    % Conf.openingBackGroundImage)
+                line += ('<event name=bgm file="%s" volume=%s play>\n'
+                    % (Conf.openingBGM['name'], Conf.openingBGM['volume']))
+                for openingStart in Conf.openingStartList:
+                    line += ('<event name=image file="%s" x=%s y=%s put>\n'
+                        % (openingStart['name1'], openingStart['x'], openingStart['y']))
+                line += '<event name=skip>'
+            else:
+                line += removeName2
+                line += ('<event name=image file="%s" x=%s y=%s shake=%s put>'
+                    % (Conf.openingStartList[i-1]['name2'], Conf.openingStartList[i-1]['x'],
+                        Conf.openingStartList[i-1]['y'], Conf.openingStartList[i-1]['shake']))
+            textList.append(line)
+        return [Paragraph(line) for line in textList]
 
     def main(self):
         """ゲームループのあるメソッド。"""
+        self.__prefetcher.start()
 
         while True:
-            screen.fill((0,0,0))
-
-            # いつでも画像オープンが有効なら、imageOrderの一番最後に該当ファイルを追加
-            if self.__status['num2'] == 1:
-                self.__status['imageOrder'].append(Conf.imageOpenName)
+            profiler.startFrame(self.__status['mode'], self.__status['page'])
+            self.__animating = False
 
-            # 表示状態の画像を順番にブリる
-            for imagename in self.__status['imageOrder']:
-                screen.blit(self.__rsrc.imageDic[imagename].surface,
-                    tuple(self.__rsrc.imageDic[imagename].xy))
+            self.__drawnPage = None
 
-            # 他の処理に絡まないように、画像blitが終わったら「いつでも画像」は消す
-            if self.__status['num2'] == 1:
-                del self.__status['imageOrder'][len(self.__status['imageOrder'])-1]
+            # 描き直しが必要な範囲はcompositorが判断するので、ここで画面を塗りつぶしはしない
+            # ウィンドウが隠れて戻ってきたときは全画面描き直す
+            if pygame.event.peek(VIDEOEXPOSE):
+                compositor.invalidate()
 
             if self.__status['mode'].endswith('__announce'):
                 self.announceMode()
                 self.showHelp()
             if self.__status['mode'].endswith('__back'):
                 self.backMode()
+            if self.__status['mode'].endswith('__slots'):
+                self.slotMode()
             if self.__status['mode'] == 'opening':
                 # maintextがいっこのときと複数のときで分岐
                 if str(type(Conf.maintextName)) != "<class 'str'>":
                     self.openingMode2()
                 else:
                     self.openingMode()
+            if self.__status['mode'].endswith('__skip'):
+                self.skipMode()
             if self.__status['mode'] == 'dialog':
                 self.dialogMode()
                 self.showHelp()
-
-            pygame.display.update()
-            clock.tick(framerate)
+            # タグで変わったBGMを鳴らす。曲を読んでいるあいだはループを止めない
+            if self.__rsrc.bgm.update():
+                self.__animating = True
+            profiler.lap('other')
+
+            # 画像はモードの処理が終わってから登録する。このフレームのタグが反映された状態が出る
+            self.composeImages()
+            profiler.lap('image')
+            if profileOverlay:
+                self.showProfile()
+                profiler.lap('other')
+            compositor.update()
+            # 画面が変わらずアニメーションもないフレームが続いたら、入力が来るまで待つ
+            idler.frameDone(bool(compositor.dirtyRects) or self.__animating)
+            if idler.idle():
+                idler.wait(self.pauseUntil())
+            else:
+                clock.tick(framerate)
+            profiler.lap('wait')
+            profiler.endFrame()
             # 特に理由があって0に戻すわけじゃない。なんとなくそのほうがいいかなって思うだけ。
             self.__status['frameNum'] = (self.__status['frameNum'] + 1
                 if self.__status['frameNum'] < 1800 else 0)
 
+    def composeImages(self):
+        """表示状態の画像をcompositorに登録する。
+        dialogModeのページのレイヤーが出来ていれば、画像と文字のかわりにそれを一枚だけ貼る。
+        ページ戻りモードでは、戻った先のページの場面(SceneHistory)を覚えていればその画像を貼る。"""
+        if self.__status['mode'].endswith('__back'):
+            scene = self.__scenes.get(self.__status['page'] - self.__status['pageBack'])
+            if scene is not None:
+                for imagename in scene.order:
+                    compositor.blit(self.__rsrc.imageDic[imagename].surface, scene.positions[imagename],
+                        Compositor.BASE)
+                return
+        order = self.__status['imageOrder']
+        now = pygame.time.get_ticks()
+        self.__timeline.setScene((self.__status['mode'].split('__')[0], self.__status['page']))
+        self.__timeline.update(now, order)
+        if self.__timeline.running():
+            self.__animating = True
+        if self.__drawnPage is not None:
+            paragraph = self.__rsrc.textList[self.__drawnPage]
+            # ページが変わったら、そこから先のレイヤーを裏で作らせる
+            if self.__drawnPage != self.__prefetchedPage:
+                self.__prefetchedPage = self.__drawnPage
+                self.__rsrc.preloader.advance(self.__drawnPage)
+                # いつでも画像はレイヤーに入れないので、先読みの状態からも外す
+                scene = order.copy()
+                scene.clear((DisplayList.OVERLAY,))
+                self.__prefetcher.prefetch(self.__rsrc.textList, self.__drawnPage,
+                    scene, self.__rsrc.positions.copy())
+            # アニメーション中と、いつでも画像が文字より上に出てしまうときはレイヤーを使わない
+            if (not paragraph.animated and not self.__timeline.running()
+                    and not order.hasLayer(DisplayList.OVERLAY)):
+                layer = layerCache.get((self.__rsrc.textList, self.__drawnPage,
+                    layerSignature(order, self.__rsrc.positions)))
+                if layer is not None:
+                    compositor.drop(Compositor.TEXT)
+                    compositor.blit(layer, (0,0), Compositor.BASE)
+                    return
+
+        # 表示状態の画像を層の順番にブリる。いつでも画像オープンの画像は一番上の層なので一番最後
+        for imagename in order:
+            image = self.__rsrc.imageDic[imagename]
+            surface, xy = self.__timeline.apply(imagename, image.surface, image.xy, now)
+            if surface is not None:
+                compositor.blit(surface, xy, Compositor.BASE)
+
+    def invalidateLayers(self):
+        """ページレイヤーと先読みを捨てる。画像の状態やメインテキストが飛んだときに呼ぶ。"""
+        self.__prefetcher.cancel()
+        layerCache.invalidate()
+        self.__prefetchedPage = None
+
     def showHelp(self):
         """dialogモードで、「ヘルプ:F11」みたいな表示を表示。"""
         padding = 3
-        font = pygame.font.Font(Conf.cassette+os.sep+'other'+os.sep+Conf.dialogFont, 11)
+        font = fonts.get(Conf.dialogFont, 11)
         if self.__status['mode'].endswith('__announce'):
             textSize = font.size(Conf.keyConf['turnPage'] + 'キーで閉じる')
         else:
@@ -323,13 +2431,31 @@ class DialogFrame:
             location = (padding*2, 480-padding*2-textSize[1])
         elif Conf.helpConf['location'] in 'se':
             location = (640-padding*2-textSize[0], 480-padding*2-textSize[1])
-        pygame.draw.rect(screen, Conf.helpConf['boxColor'],
-            Rect(location[0]-padding,location[1]-padding,textSize[0]+padding*2,textSize[1]+padding*2))
+        compositor.rect(Conf.helpConf['boxColor'],
+            Rect(location[0]-padding,location[1]-padding,textSize[0]+padding*2,textSize[1]+padding*2), Compositor.UI)
         if self.__status['mode'].endswith('__announce'):
-            text = font.render(Conf.keyConf['turnPage'] + 'キーで閉じる', True, Conf.helpConf['mesColor'])
+            text = textCache.render(font, Conf.keyConf['turnPage'] + 'キーで閉じる', True, Conf.helpConf['mesColor'])
         else:
-            text = font.render('ヘルプ:' + Conf.keyConf['showHelp'], True, Conf.helpConf['mesColor'])
-        screen.blit(text, location)
+            text = textCache.render(font, 'ヘルプ:' + Conf.keyConf['showHelp'], True, Conf.helpConf['mesColor'])
+        compositor.blit(text, location, Compositor.UI)
+
+    def showProfile(self):
+        """フレーム時間とキャッシュのヒット率を左上に表示。Conf.profileOverlayがTrueのときだけ。"""
+        padding = 3
+        font = fonts.get(Conf.dialogFont, 11)
+        lines = profiler.overlay()
+        if not lines:
+            return
+        # 中身が変わり続けるのでtextCacheには入れず、行が作りなおされたときだけレンダリングする
+        if lines is not self.__profileLines:
+            self.__profileLines = lines
+            with renderLock:
+                self.__profileTexts = [font.render(line, True, (255,255,0)) for line in lines]
+        width = max(text.get_width() for text in self.__profileTexts)
+        compositor.rect((0,0,0),
+            Rect(padding, padding, width+padding*2, font.get_linesize()*len(lines)+padding*2), Compositor.UI)
+        for i,text in enumerate(self.__profileTexts):
+            compositor.blit(text, (padding*2, padding*2+font.get_linesize()*i), Compositor.UI)
 
     def announceMode(self):
         """アナウンスモードのときゲームループに差し込まれるメソッド。
@@ -338,10 +2464,10 @@ class DialogFrame:
         if str(type(self.__status['message'])) == "<class 'str'>":
             # テキストのサイズを取得して、それに見合ったサイズのrectを作る
             textSize = font.size(self.__status['message'])
-            pygame.draw.rect(screen, Conf.announceConf['boxColor'],
-                Rect(50,50,textSize[0]+20, textSize[1]+20))
-            text = font.render(self.__status['message'], True, Conf.announceConf['mesColor'])
-            screen.blit(text, (60,60))
+            compositor.rect(Conf.announceConf['boxColor'],
+                Rect(50,50,textSize[0]+20, textSize[1]+20), Compositor.UI)
+            text = textCache.render(font, self.__status['message'], True, Conf.announceConf['mesColor'])
+            compositor.blit(text, (60,60), Compositor.UI)
         if str(type(self.__status['message'])) == "<class 'list'>":
             textLineNum = 0
             # メッセージボックスの大きさを求める (一番長い行の幅+20, フォントの高さ*行数+20)
@@ -351,11 +2477,11 @@ class DialogFrame:
                 width = textSize[0] if width < textSize[0] else width
             width = width + 20
             height = textSize[1] * len(self.__status['message']) + 20
-            pygame.draw.rect(screen, Conf.announceConf['boxColor'],
-                Rect(50,50+font.get_linesize()*textLineNum,width, height))
+            compositor.rect(Conf.announceConf['boxColor'],
+                Rect(50,50+font.get_linesize()*textLineNum,width, height), Compositor.UI)
             for line in self.__status['message']:
-                text = font.render(line, True, Conf.dialogColor)
-                screen.blit(text, (60,60+font.get_linesize()*textLineNum))
+                text = textCache.render(font, line, True, Conf.dialogColor)
+                compositor.blit(text, (60,60+font.get_linesize()*textLineNum), Compositor.UI)
                 textLineNum += 1
 
         for event in pygame.event.get():
@@ -370,43 +2496,105 @@ class DialogFrame:
                 if event.key == keyConf['turnPage'] or event.key == K_RETURN:
                     self.__status['mode'] = self.__status['mode'].rstrip('__announce')
 
-    def openingMode(self):
-        """オープニングモードのときゲームループに差し込まれるメソッド。"""
-        # Confの設定からオープニング用のtextListを作る
-        # line0: 土台表示
-        # line1: 「はじめから」選択中
-        # line2: 「つづきから」選択中
-        line0  = ('<event name=image removeall>\n')
-        line0 += ('<event name=image file="%s" x=0 y=0 put>\n'
-            % Conf.openingBackGroundImage)
-        line0 += ('<event name=bgm file="%s" volume=%s play>\n'
-            % (Conf.openingBGM['name'], Conf.openingBGM['volume']))
-        line0 += ('<event name=image file="%s" x=%s y=%s put>\n'
-            % (Conf.openingStart['name1'], Conf.openingStart['x'], Conf.openingStart['y']))
-        line0 += ('<event name=image file="%s" x=%s y=%s put>\n'
-            % (Conf.openingContinue['name1'], Conf.openingContinue['x'], Conf.openingContinue['y']))
-        line0 += '<event name=skip>'
+    def openSlots(self, action):
+        """スロット一覧を開く。actionは'save'か'load'。"""
+        # サムネイルは一覧を出す前の画面から作る
+        with renderLock:
+            screenshot = screen.copy()
+        self.__slots = {'action': action, 'page': 0, 'cursor': 0, 'screenshot': screenshot}
+        self.loadSlotPage(0)
+        self.__status['mode'] = self.__status['mode'] + '__slots'
+
+    def loadSlotPage(self, page):
+        """スロット一覧のpageページ目を読む。読むのはslotsテーブルだけで、サムネイルはここでサーフィスにしておく。"""
+        perPage = getattr(Conf, 'slotsPerPage', 5)
+        count = saveStore.countSlots()
+        # セーブするときは最後に「新しいスロット」を足す
+        entries = count + 1 if self.__slots['action'] == 'save' else count
+        pages = max(1, -(-entries // perPage))
+        page = page % pages
+        rows = saveStore.listSlots(page*perPage, perPage)
+        for row in rows:
+            row['thumbnail'] = saveStore.thumbnailSurface(row['thumbnail'])
+        if self.__slots['action'] == 'save' and page == pages-1:
+            rows.append({'savenum': saveStore.nextSlot(), 'page': None, 'paragraph': None,
+                'savedAt': None, 'thumbnail': None})
+        self.__slots.update({'page': page, 'pages': pages, 'rows': rows,
+            'cursor': max(0, min(self.__slots['cursor'], len(rows)-1))})
+
+    def slotMode(self):
+        """スロット一覧のときゲームループに差し込まれるメソッド。"""
+        slots = self.__slots
+        font = fonts.get(Conf.dialogFont, 14)
+        rowHeight = DBAccess.thumbnailSize[1] + 6
+        compositor.rect(Conf.announceConf['boxColor'], Rect(40,10,560,460), Compositor.UI)
+        title = '%sするスロットを選んでください (%d/%d)' % (
+            'セーブ' if slots['action'] == 'save' else 'ロード', slots['page']+1, slots['pages'])
+        compositor.blit(textCache.render(font, title, True, Conf.announceConf['mesColor']), (60,20), Compositor.UI)
+        guide = '↑↓:選ぶ ←→:ページ %s:決定 %s:閉じる' % (Conf.keyConf['turnPage'], Conf.keyConf['backPage'])
+        compositor.blit(textCache.render(font, guide, True, Conf.announceConf['mesColor']),
+            (60,20+font.get_linesize()), Compositor.UI)
+        if not slots['rows']:
+            text = textCache.render(font, 'セーブデータはありません', True, Conf.announceConf['mesColor'])
+            compositor.blit(text, (60,70), Compositor.UI)
+        for i,row in enumerate(slots['rows']):
+            y = 66 + rowHeight*i
+            if i == slots['cursor']:
+                compositor.rect(Conf.helpConf['boxColor'], Rect(50,y-3,540,rowHeight), Compositor.UI)
+            if row['thumbnail'] is not None:
+                compositor.blit(row['thumbnail'], (60,y), Compositor.UI)
+            else:
+                compositor.rect((0,0,0), Rect((60,y), DBAccess.thumbnailSize), Compositor.UI)
+            if row['savedAt'] is None and row['page'] is None:
+                lines = ['No.%d' % row['savenum'], '新しいスロット']
+            else:
+                lines = ['No.%d' % row['savenum'], '%s/%sページ  %s' % (
+                    '?' if row['page'] is None else row['page']+1, row['paragraph'], row['savedAt'] or '')]
+            for j,line in enumerate(lines):
+                text = textCache.render(font, line, True, Conf.announceConf['mesColor'])
+                compositor.blit(text, (70+DBAccess.thumbnailSize[0], y+4+font.get_linesize()*j), Compositor.UI)
 
-        line1  = ('<event name=image file="%s" remove>\n'
-            % Conf.openingContinue['name2'])
-        line1 += ('<event name=image file="%s" x=%s y=%s shake=%s put>'
-            % (Conf.openingStart['name2'], Conf.openingStart['x'],
-                Conf.openingStart['y'], Conf.openingStart['shake']))
+        for event in pygame.event.get():
 
-        line2  = ('<event name=image file="%s" remove>\n'
-            % Conf.openingStart['name2'])
-        line2 += ('<event name=image file="%s" x=%s y=%s shake=%s put>'
-            % (Conf.openingContinue['name2'], Conf.openingContinue['x'],
-                Conf.openingContinue['y'], Conf.openingContinue['shake']))
+            event = self.swicth_mouse_click(event)
 
-        textList = [line0, line1, line2]
-        draft = textList[self.__status['page']]
-        lineList = draft.split('\n')
+            if event.type == QUIT:
+                sys.exit()
+            if event.type == KEYDOWN:
+                if event.key == K_F4 and bool(event.mod and KMOD_ALT):
+                    sys.exit()
+                rows = slots['rows']
+                if event.key == K_UP and rows:
+                    slots['cursor'] = (slots['cursor'] - 1) % len(rows)
+                if event.key == K_DOWN and rows:
+                    slots['cursor'] = (slots['cursor'] + 1) % len(rows)
+                if event.key == K_LEFT:
+                    self.loadSlotPage(slots['page'] - 1)
+                if event.key == K_RIGHT:
+                    self.loadSlotPage(slots['page'] + 1)
+                if event.key == keyConf['backPage']:
+                    self.__status['mode'] = self.__status['mode'][:-len('__slots')]
+                    self.__slots = None
+                    break
+                if (event.key == keyConf['turnPage'] or event.key == K_RETURN) and rows:
+                    row = rows[slots['cursor']]
+                    self.__status['mode'] = self.__status['mode'][:-len('__slots')]
+                    self.__slots = None
+                    if slots['action'] == 'save':
+                        self.saveData(row['savenum'], slots['screenshot'])
+                    else:
+                        self.loadData(row['savenum'])
+                    break
 
-        for line in lineList:
-            if (line.startswith('<event ') and line.endswith('>')):
-                # タグ行ならタグ種類に合わせた処理へ
-                self.dialogEvent(line)
+    def openingMode(self):
+        """オープニングモードのときゲームループに差し込まれるメソッド。"""
+        if self.__openingList is None:
+            self.__openingList = self.createOpeningList()
+        paragraph = self.__openingList[self.__status['page']]
+
+        for tag in paragraph.tags:
+            # タグ種類に合わせた処理へ
+            self.dialogEvent(tag)
 
         for event in pygame.event.get():
 
@@ -438,7 +2626,7 @@ class DialogFrame:
                     else:
                         # セーブ機能がない場合はメッセージだけ出す
                         if Conf.useSave:
-                            self.loadData(1)
+                            self.openSlots('load')
                         else:
                             self.__status['message'] = 'This dialog doesn\'t allow loading data.'
                             self.__status['mode'] = self.__status['mode'] + '__announce'
@@ -447,38 +2635,13 @@ class DialogFrame:
         """メインテキストがふたつ以上あるときのオープニング。
         openingStartListのぶんだけ選択肢を作り、選択中のインデックス番号をmaintextのリストから取り出して読む。
         """
-        # name2を全消しするタグを作っとく
-        removeName2 = ''
-        for openingStart in Conf.openingStartList:
-            removeName2 += ('<event name=image file="%s" remove>\n'
-                % openingStart['name2'])
-
-        textList = []
-        for i in range(len(Conf.openingStartList) + 1):
-            # +1は土台のぶん
-            if i == 0:
-                line  = '<event name=image removeall>\n'
-                line += ('<event name=image file="%s" x=0 y=0 put>\n'
-                    % Conf.openingBackGroundImage)
-                line += ('<event name=bgm file="%s" volume=%s play>\n'
-                    % (Conf.openingBGM['name'], Conf.openingBGM['volume']))
-                for openingStart in Conf.openingStartList:
-                    line += ('<event name=image file="%s" x=%s y=%s put>\n'
-                        % (openingStart['name1'], openingStart['x'], openingStart['y']))
-                line += '<event name=skip>'
-            else:
-                line += removeName2
-                line += ('<event name=image file="%s" x=%s y=%s shake=%s put>'
-                    % (Conf.openingStartList[i-1]['name2'], Conf.openingStartList[i-1]['x'],
-                        Conf.openingStartList[i-1]['y'], Conf.openingStartList[i-1]['shake']))
-            textList.append(line)
-        draft = textList[self.__status['page']]
-        lineList = draft.split('\n')
+        if self.__openingList is None:
+            self.__openingList = self.createOpeningList2()
+        paragraph = self.__openingList[self.__status['page']]
 
-        for line in lineList:
-            if (line.startswith('<event ') and line.endswith('>')):
-                # タグ行ならタグ種類に合わせた処理へ
-                self.dialogEvent(line)
+        for tag in paragraph.tags:
+            # タグ種類に合わせた処理へ
+            self.dialogEvent(tag)
 
         for event in pygame.event.get():
 
@@ -503,7 +2666,8 @@ class DialogFrame:
                     self.__status['page'] = page+1 if page!=len(Conf.openingStartList) else 1
                 if event.key == keyConf['turnPage'] or event.key == K_RETURN:
                     # page番号-1のmaintextをロードしてdialogModeへGO
-                    self.__rsrc.textList = self.__rsrc.createTextList(Conf.maintextName[self.__status['page'] - 1])
+                    self.__rsrc.replaceTextList(Conf.maintextName[self.__status['page'] - 1])
+                    self.invalidateLayers()
                     self.__status['mode'] = 'dialog'
                     self.__status['page'] = 0
                     self.__rsrc.soundDic[Conf.openingSound['name']].volume(Conf.openingSound['volume'])
@@ -512,54 +2676,33 @@ class DialogFrame:
 
     def dialogMode(self):
         """本編モードのときゲームループに差し込まれるメソッド。"""
-        draft = self.__rsrc.textList[self.__status['page']]
-        lineList = draft.split('\n')
+        self.__drawnPage = self.__status['page']
+        paragraph = self.__rsrc.textList[self.__status['page']]
+        profiler.lap('other')
         # テキスト行をblitするたびに増える数値(=改行の数)
         textLineNum = 0
-        # パラグラフ全体に関連付け画像のキーがあるかどうか
-        linkingKeyList = []
-        for line in lineList:
-            if (line.startswith('<event ') and line.endswith('>')):
+        for line in paragraph.lines:
+            if isinstance(line, EventTag):
                 # タグ行ならタグ種類に合わせた処理へ
                 self.dialogEvent(line)
-            elif line.startswith('#'):
-                # コメント欄は無視
-                pass
+                profiler.lap('tag')
             else:
-                # 関連付け画像のキー検索
-                for linkingDic in Conf.linkingList:
-                    for key in linkingDic:
-                        if key in line:
-                            linkingKeyList.append(key)
-
                 # テキスト行なら一行ずつblitへ
-                text = font.render(line, True, Conf.dialogColor)
-                screen.blit(text, (Conf.dialogX, Conf.dialogY+font.get_linesize()*textLineNum))
+                text = textCache.render(font, line, True, Conf.dialogColor)
+                compositor.blit(text, (Conf.dialogX, Conf.dialogY+font.get_linesize()*textLineNum), Compositor.TEXT)
                 textLineNum += 1
-
-        # キーがリストに入ってたらmainをブリって、入ってなけりゃbackをブリる
-        for linkingDic in Conf.linkingList:
-            for key,dic in linkingDic.items():
-                if key in linkingKeyList:
-                    if dic['back'] in self.__status['imageOrder']:
-                        # backがある -> mainと交換
-                        targetIndex = self.__status['imageOrder'].index(dic['back'])
-                        self.__status['imageOrder'][targetIndex] = dic['main']
-                        # 座標も同じにする
-                        self.__rsrc.imageDic[dic['main']].xy = self.__rsrc.imageDic[dic['back']].xy
-                    else:
-                        # mainがあるかどっちもない
-                        pass
-                else:
-                    if dic['main'] in self.__status['imageOrder']:
-                        # mainがある -> backと交換
-                        targetIndex = self.__status['imageOrder'].index(dic['main'])
-                        self.__status['imageOrder'][targetIndex] = dic['back']
-                        # 座標も同じにする
-                        self.__rsrc.imageDic[dic['back']].xy = self.__rsrc.imageDic[dic['main']].xy
-                    else:
-                        # backがあるかどっちもない
-                        pass
+                profiler.lap('text')
+
+        # キーがパラグラフに入ってたらmainをブリって、入ってなけりゃbackをブリる
+        # パラグラフ全体に関連付け画像のキーがあるかどうかはコンパイル時に検索済み
+        applyLinking(paragraph.speakerKeys, self.__status['imageOrder'], self.__rsrc.positions)
+        # ページ戻りモードで出せるように、このページの場面を覚えておく
+        bgm = self.__rsrc.bgm
+        self.__scenes.record(self.__drawnPage, self.__status['imageOrder'], self.__rsrc.positions,
+            (bgm.name, bgm.vol, bgm.put))
+        # スキップモードで飛ばせるように、既読にする。DBはここでは読まない
+        self.readPages().mark(self.__drawnPage)
+        profiler.lap('image')
 
         for event in pygame.event.get():
 
@@ -572,15 +2715,24 @@ class DialogFrame:
                     sys.exit()
 
                 # いつでも画像オープン中はその画像を消す以外の行動はできない
-                if self.__status['num2'] == 1:
+                order = self.__status['imageOrder']
+                if order.hasLayer(DisplayList.OVERLAY):
                     if event.key == keyConf['imageOpen'] and Conf.imageOpenName:
-                        self.__status['num2'] = 0
+                        order.clear((DisplayList.OVERLAY,))
                     break
                 if event.key == keyConf['imageOpen'] and Conf.imageOpenName:
-                    # imageOrderへの追加削除はmainメソッド内で行う
-                    self.__status['num2'] = 1
+                    # 一番上の層に置くだけ。ブリるのはcomposeImages
+                    order.put(Conf.imageOpenName, DisplayList.OVERLAY)
                     self.__rsrc.imageDic[Conf.imageOpenName].xy = Conf.imageOpenXY
 
+                # pause中のページ送りは、カセットが許していればpauseを終わらせるだけ
+                if ((event.key == keyConf['turnPage'] or event.key == K_RETURN)
+                        and self.pauseUntil() is not None):
+                    if getattr(Conf, 'pauseSkippable', False):
+                        self.__pause = (self.__pause[0], 0)
+                        self.__animating = True
+                    continue
+
                 page = self.__status['page']
                 maxIndex = len(self.__rsrc.textList) - 1
                 if event.key == keyConf['turnPage'] or event.key == K_RETURN:
@@ -592,6 +2744,9 @@ class DialogFrame:
                     self.__status['num'] = 0
                     self.__rsrc.soundDic[Conf.soundTurnPage].play()
                     self.__rsrc.resetSound()
+                if event.key == keyConf['skip']:
+                    # スキップモードへ
+                    self.__status['mode'] = self.__status['mode'] + '__skip'
                 if event.key == keyConf['backPage']:
                     # ページ戻りモードへ
                     if self.__status['page'] > 0:
@@ -618,37 +2773,51 @@ class DialogFrame:
                     self.loadData(3)
                 if event.key == keyConf['load4']:
                     self.loadData(4)
+                if event.key == keyConf['saveSlots']:
+                    self.openSlots('save')
+                if event.key == keyConf['loadSlots']:
+                    self.openSlots('load')
+        profiler.lap('event')
 
     def backMode(self):
         """ページ戻りモードのときゲームループに差し込まれるメソッド。"""
         # 現在のページに戻ってきたらモードを戻す
         if self.__status['pageBack'] == 0:
             self.__status['mode'] = self.__status['mode'].rstrip('__back')
+            self.restoreLiveBGM()
+
+        # 戻った先のページの場面を覚えていれば、そのときのBGMにする
+        scene = self.__scenes.get(self.__status['page'] - self.__status['pageBack'])
+        if scene is not None and self.__status['pageBack'] > 0:
+            if self.__liveBGM is None:
+                self.__liveBGM = (self.__rsrc.bgm.name, self.__rsrc.bgm.vol, self.__rsrc.bgm.put)
+            self.__rsrc.bgm.name, self.__rsrc.bgm.vol, self.__rsrc.bgm.put = scene.bgm
+        elif scene is None:
+            # 覚えていないページは画像もいまのものを出すので、BGMもいまのものに戻す
+            self.restoreLiveBGM()
 
         # 「いまページ戻りモードですよ」の通知
         textSize = font.size(Conf.pageBackMode['message'])
-        pygame.draw.rect(screen, Conf.pageBackMode['boxColor'],
-            Rect(50,50,textSize[0]+20, textSize[1]+20))
-        text = font.render(Conf.pageBackMode['message'], True, Conf.pageBackMode['mesColor'])
-        screen.blit(text, (60,60))
+        compositor.rect(Conf.pageBackMode['boxColor'],
+            Rect(50,50,textSize[0]+20, textSize[1]+20), Compositor.UI)
+        text = textCache.render(font, Conf.pageBackMode['message'], True, Conf.pageBackMode['mesColor'])
+        compositor.blit(text, (60,60), Compositor.UI)
 
         # 通常行のみblit
-        draft = self.__rsrc.textList[self.__status['page'] - self.__status['pageBack']]
-        lineList = draft.split('\n')
+        paragraph = self.__rsrc.textList[self.__status['page'] - self.__status['pageBack']]
+        profiler.lap('other')
         textLineNum = 0
-        for line in lineList:
-            # 基本的にタグは飛ばすが、指定タグは処理する
-            for string in Conf.pageBackMode['pass']:
-                if line.startswith(string):
+        for line in paragraph.lines:
+            if isinstance(line, EventTag):
+                # 基本的にタグは飛ばすが、指定タグは処理する
+                if line.backPass:
                     self.dialogEvent(line)
-            if (line.startswith('<event ') and line.endswith('>')):
-                continue
-            elif line.startswith('#'):
-                continue
+                    profiler.lap('tag')
             else:
-                text = font.render(line, True, Conf.dialogColor)
-                screen.blit(text, (Conf.dialogX, Conf.dialogY+font.get_linesize()*textLineNum))
+                text = textCache.render(font, line, True, Conf.dialogColor)
+                compositor.blit(text, (Conf.dialogX, Conf.dialogY+font.get_linesize()*textLineNum), Compositor.TEXT)
                 textLineNum += 1
+                profiler.lap('text')
 
         for event in pygame.event.get():
 
@@ -668,129 +2837,164 @@ class DialogFrame:
                     if self.__status['pageBack'] < self.__status['page']:
                         self.__status['pageBack'] += 1
                         self.skipTagLines(True)
+        profiler.lap('event')
+
+    def skipMode(self):
+        """スキップモードのときゲームループに差し込まれるメソッド。
+        1フレームにConf.skipFrameTimeミリ秒ぶんだけパラグラフを進めて(skipParagraphs)、たどり着いたページだけを描く。
+        なにかキーを押すか、進めなくなったら本編モードに戻る。戻ったフレームはdialogModeが描く。"""
+        for event in pygame.event.get():
+
+            event = self.swicth_mouse_click(event)
+
+            if event.type == QUIT:
+                sys.exit()
+            if event.type == KEYDOWN:
+                if event.key == K_F4 and bool(event.mod and KMOD_ALT):
+                    sys.exit()
+                # なにかキーを押したら止める
+                self.__status['mode'] = self.__status['mode'][:-len('__skip')]
+                return
+        self.skipParagraphs(getattr(Conf, 'skipFrameTime', 30) / 1000)
+        if not self.__status['mode'].endswith('__skip'):
+            return
+        # まだ進めるので次のフレームも描く
+        self.__animating = True
+
+        # 「いまスキップ中ですよ」の通知
+        message = getattr(Conf, 'skipMessage', 'スキップ中です。なにかキーを押すと止まります。')
+        textSize = font.size(message)
+        compositor.rect(Conf.announceConf['boxColor'],
+            Rect(50,50,textSize[0]+20, textSize[1]+20), Compositor.UI)
+        text = textCache.render(font, message, True, Conf.announceConf['mesColor'])
+        compositor.blit(text, (60,60), Compositor.UI)
+
+        # 通常行のみblit
+        paragraph = self.__rsrc.textList[self.__status['page']]
+        for textLineNum,line in enumerate(paragraph.textLines):
+            text = textCache.render(font, line, True, Conf.dialogColor)
+            compositor.blit(text, (Conf.dialogX, Conf.dialogY+font.get_linesize()*textLineNum), Compositor.TEXT)
+        profiler.lap('text')
+
+    def skipParagraphs(self, budget):
+        """budget秒たつまで、次のパラグラフのタグの状態(ScriptState)だけを当ててページを進める。描画もSEもしない。
+        台本の最後か、Conf.skipReadOnly(デフォルトTrue)なら未読のパラグラフの手前まで来たら、スキップモードを終える。"""
+        textList = self.__rsrc.textList
+        readPages = self.readPages()
+        readOnly = getattr(Conf, 'skipReadOnly', True)
+        bgm = self.__rsrc.bgm
+        state = ScriptState(self.__status['imageOrder'], self.__rsrc.positions, {},
+            {'name': bgm.name, 'vol': bgm.vol, 'put': bgm.put})
+        page = self.__status['page']
+        last = len(textList) - 1
+        deadline = time.perf_counter() + budget
+        while True:
+            if page >= last or (readOnly and not readPages.isRead(page+1)):
+                self.__status['mode'] = self.__status['mode'][:-len('__skip')]
+                break
+            page += 1
+            state.apply(textList[page])
+            # 飛ばしたページもページ戻りモードで出せるように
+            self.__scenes.record(page, state.order, state.positions,
+                (state.bgm['name'], state.bgm['vol'], state.bgm['put']))
+            if time.perf_counter() >= deadline:
+                break
+        for name,vol in state.volumes.items():
+            self.__rsrc.soundDic[name].volume(vol)
+        # BGMはこのフレームのbgm.updateで、たどり着いたページの曲になる
+        bgm.name, bgm.vol, bgm.put = state.bgm['name'], state.bgm['vol'], state.bgm['put']
+        if page != self.__status['page']:
+            self.__status['page'] = page
+            self.__status['num'] = 0
+            self.__rsrc.resetSound()
+
+    def readPages(self):
+        """いまの台本のReadPagesを返す。台本が変わっていたら、前の台本のものを書いてから作りなおす。
+        DBに入っている既読は、作ったときに書き込みスレッドに読ませて、届いたら足す(ReadPages.mergeStored)。
+        ゲームループはDBを待たないので、届くまではこの実行で読んだぶんだけが既読。"""
+        textList = self.__rsrc.textList
+        if self.__readPagesOf is not textList:
+            self.storeReadPages()
+            self.__readPages = ReadPages(os.path.basename(textList.path), len(textList))
+            self.__readPagesOf = textList
+            saveStore.loadReadPagesLater(self.__readPages.script, self.__readPages.mergeStored)
+        return self.__readPages
+
+    def storeReadPages(self):
+        """既読が増えていればDBに書く。終了時にも呼ぶ。DBのぶんとは書き込みスレッドが足す。"""
+        readPages = self.__readPages
+        if readPages is not None and readPages.dirty:
+            saveStore.writeReadPages(readPages)
+
+    def checkpoints(self):
+        """いまの台本のCheckpointIndexを返す。台本が変わっていたら作りなおす。"""
+        textList = self.__rsrc.textList
+        if self.__checkpoints is None or self.__checkpoints.textList is not textList:
+            self.__checkpoints = CheckpointIndex(textList, getattr(Conf, 'checkpointInterval', 50))
+        return self.__checkpoints
+
+    def seekPage(self, page):
+        """本編のpageページに飛ぶ。画像、BGM、SEの音量は、台本を頭から読んできたときの状態にする。
+        状態は一番近いチェックポイントから、多くてもConf.checkpointIntervalページぶんのタグを当てて作る。"""
+        page = max(0, min(page, len(self.__rsrc.textList) - 1))
+        state = self.checkpoints().stateAt(page)
+        for name,xy in state.positions.items():
+            self.__rsrc.imageDic[name].xy = xy
+        for name,instance in self.__rsrc.soundDic.items():
+            instance.vol = state.volumes.get(name, Sounds.defaultVolume)
+        # BGMは次のフレームのbgm.updateで切り替わる
+        for key,value in state.bgm.items():
+            setattr(self.__rsrc.bgm, key, value)
+        self.__rsrc.resetSound()
+        self.invalidateLayers()
+        self.__timeline.clear()
+        self.__pause = None
+        self.__scenes.clear()
+        self.__liveBGM = None
+        self.__status.update({'mode': 'dialog', 'page': page, 'imageOrder': state.order, 'num': 0, 'pageBack': 0})
+
+    def restoreLiveBGM(self):
+        """ページ戻りモードで変えたBGMを、戻りモードに入る前のものに戻す。"""
+        if self.__liveBGM is not None:
+            self.__rsrc.bgm.name, self.__rsrc.bgm.vol, self.__rsrc.bgm.put = self.__liveBGM
+            self.__liveBGM = None
 
     def skipTagLines(self, back):
         """通常行の含まれるパラグラフまでpageBack数をスキップする。
-        backがFalseならページを進め、Trueならページを戻す。"""
-        draft = self.__rsrc.textList[self.__status['page'] - self.__status['pageBack']]
-        lineList = draft.split('\n')
-        normalLineExists = False
-        for line in lineList:
-            for string in Conf.pageBackMode['pass']:
-                if line.startswith(string):
-                    normalLineExists = True
-            # <event name=skip back>のときは通常行があろうとスキップする
-            if 'event name=skip' in line and 'back' in line:
-                normalLineExists = False
-                break
-            if (line.startswith('<event ') and line.endswith('>')):
-                continue
-            elif line.startswith('#'):
-                continue
-            else:
-                normalLineExists = True
-        if normalLineExists:
-            return
-        else:
-            # スキップした結果0~pageの範囲を飛び出すようなら元に戻す
-            if not back:
-                self.__status['pageBack'] -= 1
-                if self.__status['pageBack'] < 0:
-                    self.__status['pageBack'] += 1
-                    self.skipTagLines(True)
-                else:
-                    self.skipTagLines(back)
-            else:
-                self.__status['pageBack'] += 1
-                if self.__status['pageBack'] > self.__status['page']:
-                    self.__status['pageBack'] -= 1
-                    self.skipTagLines(False)
-                else:
-                    self.skipTagLines(back)
+        backがFalseならページを進め、Trueならページを戻す。0~pageの範囲になければ逆向きに探す。
+        探すのは読み込み時に作った索引(ScriptText.seek)を一回引くだけ。"""
+        page = self.__status['page']
+        target = self.__rsrc.textList.seek(page - self.__status['pageBack'], back, page)
+        self.__status['pageBack'] = page - target
 
     def dialogEvent(self, tag):
-        """ダイアログにイベントタグが現れたときの処理。"""
-        parser = TagParse()
-        parser.feed(tag)
-        dic = parser.dic
-        if   dic['name'] in 'image':
-            self.imageTag(dic)
-        elif dic['name'] in 'sound':
-            self.soundTag(dic)
-        elif dic['name'] in 'bgm':
-            self.bgmTag(dic)
-        elif dic['name'] in 'text':
-            self.textTag(dic)
-        elif dic['name'] in 'skip':
-            self.skipTag(dic)
-        elif dic['name'] in 'dice':
-            self.diceTag(dic)
+        """ダイアログにイベントタグ(EventTag)が現れたときの処理。処理はtagRegistryにタグ名で引く。"""
+        tagRegistry.handlers[tag.name](self, tag.attrs)
 
     def imageTag(self, dic):
         """imageタグから入るメソッド。"""
-        # property: name file x y put remove changefrom changeto shake
-        if 'x' in dic:
-            self.__rsrc.imageDic[dic['file']].xy[0] = int(dic['x'])
-        if 'y' in dic:
-            self.__rsrc.imageDic[dic['file']].xy[1] = int(dic['y'])
-        if ('put' in dic) and (dic['file'] not in self.__status['imageOrder']):
-            self.__status['imageOrder'].append(dic['file'])
-            # imageOrder内にリンク画像同士があったら今追加したのを削除 = リンク画像は片方しか表示できない
-            for linkingDic in Conf.linkingList:
-                for key,imageDic in linkingDic.items():
-                    if (imageDic['main'] in self.__status['imageOrder']
-                            and imageDic['back'] in self.__status['imageOrder']):
-                        self.__status['imageOrder'].remove(dic['file'])
-        if 'remove' in dic:
-            if dic['file'] not in self.__status['imageOrder']:
-                # いつでも画像オープンの画像を消そうとしてる場合は、num2が1だったら無視する
-                if dic['file'] == Conf.imageOpenName and self.__status['num2'] == 1:
-                    pass
-                # リストにないのにremoveしようとするのはただのミスか、あるいはリンク画像の可能性
-                for linkingDic in Conf.linkingList:
-                    for key,imageDic in linkingDic.items():
-                        if (dic['file'] == imageDic['main']
-                                and imageDic['back'] in self.__status['imageOrder']):
-                            self.__status['imageOrder'].remove(imageDic['back'])
-                        elif (dic['file'] == imageDic['back']
-                                and imageDic['main'] in self.__status['imageOrder']):
-                            self.__status['imageOrder'].remove(imageDic['main'])
-                        else:
-                            # ミスなら
-                            pass
-            else:
-                self.__status['imageOrder'].remove(dic['file'])
-        if 'removeall' in dic:
-            self.__status['imageOrder'] = []
-        if ('changefrom' in dic and 'changeto' in dic
-                    and dic['changefrom'] in self.__status['imageOrder']):
-            targetIndex = self.__status['imageOrder'].index(dic['changefrom'])
-            self.__status['imageOrder'][targetIndex] = dic['changeto']
+        # property: name file x y put remove changefrom changeto shake move fade blink duration
+        before = tuple(self.__rsrc.positions[dic['file']]) if 'file' in dic else None
+        applyImageTag(dic, self.__status['imageOrder'], self.__rsrc.positions)
+        if not ('shake' in dic or 'move' in dic or 'fade' in dic or 'blink' in dic):
+            return
+        # アニメーションは座標を書き換えない。貼るときにcomposeImagesでずらす
+        # <event name=image file="%s" x=%s y=%s shake=5 put> shakeは振れ幅、move fadeは長さ、blinkは周期(ミリ秒)
+        scene = (self.__status['mode'].split('__')[0], self.__status['page'])
+        now = pygame.time.get_ticks()
+        duration = dic.get('duration')
         if 'shake' in dic:
-            # 指定の画像の座標をフレーム加算ごとに動かす <event name=image file="%s" x=%s y=%s shake=5 put>
-            # 左下、右上、下、左上、右、左、右下、上をそれぞれフレーム数/6の余りと対応させる
-            baseX = self.__rsrc.imageDic[dic['file']].xy[0]
-            baseY = self.__rsrc.imageDic[dic['file']].xy[1]
-            shake = int(dic['shake'])
-            lisNum = self.__status['frameNum'] % 16
-            if   lisNum in {0,1}:
-                xy = [baseX-shake, baseY+shake]
-            elif lisNum in {2,3}:
-                xy = [baseX+shake, baseY-shake]
-            elif lisNum in {4,5}:
-                xy = [baseX, baseY+shake]
-            elif lisNum in {6,7}:
-                xy = [baseX-shake, baseY-shake]
-            elif lisNum in {8,9}:
-                xy = [baseX+shake, baseY]
-            elif lisNum in {10,11}:
-                xy = [baseX-shake, baseY]
-            elif lisNum in {12,13}:
-                xy = [baseX+shake, baseY-shake]
-            elif lisNum in {14,15}:
-                xy = [baseX, baseY-shake]
-            self.__rsrc.imageDic[dic['file']].xy[0] = xy[0]
-            self.__rsrc.imageDic[dic['file']].xy[1] = xy[1]
+            curve = tuple((dx*dic['shake'], dy*dic['shake']) for dx,dy in Timeline.SHAKE_CURVE)
+            self.__timeline.start(dic['file'], 'shake', curve, duration, scene, now)
+        if 'move' in dic:
+            # 動く前の座標からx yまで動く
+            after = self.__rsrc.positions[dic['file']]
+            curve = (before[0]-after[0], before[1]-after[1])
+            self.__timeline.start(dic['file'], 'move', curve, dic['move'], scene, now)
+        if 'fade' in dic:
+            self.__timeline.start(dic['file'], 'fade', None, dic['fade'], scene, now)
+        if 'blink' in dic:
+            self.__timeline.start(dic['file'], 'blink', max(1, dic['blink']//2), duration, scene, now)
 
     def soundTag(self, dic):
         """soundタグから入るメソッド。"""
@@ -821,18 +3025,30 @@ class DialogFrame:
         """textタグから入るメソッド。"""
         # property: string color fontsize x y
         string = ' ' if not 'string' in dic else dic['string']
-        color = (255,255,255) if not 'color' in dic else tuple(dic['color'])
+        color = (255,255,255) if not 'color' in dic else dic['color']
         font = Conf.dialogFont if not 'font' in dic else dic['font']
         fontsize = 18 if not 'fontsize' in dic else int(dic['fontsize'])
         x = 0 if not 'x' in dic else int(dic['x'])
         y = 0 if not 'y' in dic else int(dic['y'])
-        font = pygame.font.Font(Conf.cassette+os.sep+'other'+os.sep+font, fontsize)
-        text = font.render(string, True, color)
-        screen.blit(text, (x, y))
+        font = fonts.get(font, fontsize)
+        text = textCache.render(font, string, True, color)
+        compositor.blit(text, (x, y), Compositor.TAG)
 
     def skipTag(self, dic):
         """skipタグから入るメソッド。"""
         # property: pause back
+        if 'pause' in dic:
+            # pauseはタイマーにする。待っているあいだも描画と入力は止めない
+            # タグは毎フレーム実行されるので、同じページでは最初の一回だけタイマーを始める
+            scene = (self.__status['mode'].split('__')[0], self.__status['page'])
+            now = pygame.time.get_ticks()
+            if self.__pause is None or self.__pause[0] != scene:
+                self.__pause = (scene, now + int(dic['pause']))
+            if now < self.__pause[1]:
+                return
+            self.__pause = None
+        # ページが変わるので次のフレームも描く
+        self.__animating = True
         page = self.__status['page']
         # この処理は現在がdialogModeのときにだけ必要
         if self.__status['mode'] == 'dialog':
@@ -841,18 +3057,27 @@ class DialogFrame:
         else:
             self.__status['page'] += 1
         self.__rsrc.resetSound()
-        if 'pause' in dic:
-            pygame.time.delay(int(dic['pause']))
         if 'back' in dic:
             # これはページ戻りモードのときのみ作用
             pass
 
+    def pauseUntil(self):
+        """いまのページで待っているpauseの終わる時刻。待っていなければNone。"""
+        if self.__pause is None:
+            return None
+        scene, until = self.__pause
+        if scene != (self.__status['mode'].split('__')[0], self.__status['page']):
+            return None
+        return until
+
     def diceTag(self, dic):
         """diceタグから入るメソッド。"""
         # property: skill result x y
         passingMark = ''
         succeed = ''
         if self.__status['num'] != Conf.diceNum:
+            # ロール中
+            self.__animating = True
             result = random.randint(1, 100)
             if dic['skill'] in Conf.diceDic:
                 passingMark = Conf.diceDic[dic['skill']]
@@ -872,44 +3097,86 @@ class DialogFrame:
                         succeed = '→ ｸﾘﾃｨｶﾙ!!'
         string1 = '%s: %s' % (dic['skill'], passingMark)
         string2 = '%s %s' % (result, succeed)
-        text1 = font.render(string1, True, Conf.dialogColor)
-        text2 = font.render(string2, True, Conf.dialogColor)
-        screen.blit(text1, (int(dic['x']), int(dic['y'])))
-        screen.blit(text2, (int(dic['x']), int(dic['y'])+font.get_linesize()))
+        text1 = textCache.render(font, string1, True, Conf.dialogColor)
+        text2 = textCache.render(font, string2, True, Conf.dialogColor)
+        compositor.blit(text1, (int(dic['x']), int(dic['y'])), Compositor.TAG)
+        compositor.blit(text2, (int(dic['x']), int(dic['y'])+font.get_linesize()), Compositor.TAG)
 
     def resetStatus(self):
         """__statusをデフォルト値へ戻す(オープニング画面へ戻す)。"""
+        self.invalidateLayers()
+        self.__timeline.clear()
+        self.__pause = None
+        self.__scenes.clear()
+        self.__liveBGM = None
         for key,value in self.__status['default'].items():
-            self.__status[key] = value
-
-    def saveData(self, savenum):
-        """現在のrsrcとstatusを保存する。"""
-        jsonRsrc = self.__rsrc.exportJson()
-        jsonStatus = json.dumps(self.__status)
-        # そのsavenumのレコードなかったら先に作る
-        DBAccess.igsertData({'savenum':savenum}, {})
-        # セーブする
+            # imageOrderはこのあと書き換えるので、defaultのものは写して使う
+            self.__status[key] = copy.deepcopy(value)
+
+    def saveData(self, savenum, screenshot=None):
+        """現在のrsrcとstatusを、初期値から変わったところだけスナップショットにして保存する。
+        スロット一覧用のサムネイルはscreenshot(なければいまの画面)から書き込みスレッドで作る。"""
+        snapshot = encodeSnapshot({
+            'status': statusDiff(self.__status),
+            'rsrc': self.__rsrc.exportState(),
+            'script': [len(self.__rsrc.textList), self.__rsrc.textList.size],
+        })
+        # セーブする。書き込みは裏でやるので、ここでは待たない
+        # 古い形式の列は空にしておく
         data = {
-            'rsrc':jsonRsrc,
-            'status':jsonStatus,
+            'rsrc':None,
+            'status':None,
+            'paragraph':len(self.__rsrc.textList),
+            'snapshot':snapshot,
+        }
+        slot = {
+            'page':self.__status['page'],
             'paragraph':len(self.__rsrc.textList),
+            'savedAt':datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S'),
         }
-        DBAccess.updateData(data, {'savenum':savenum})
+        if screenshot is None:
+            with renderLock:
+                screenshot = screen.copy()
+        # 既読も一緒に書く。DBのぶんとは書き込みスレッドが足すので、ここではDBを読まない
+        saveStore.writeData(savenum, data, slot, screenshot, self.readPages())
         # セーブしたことを言う
         self.__status['message'] = '%s番にセーブしました!' % savenum
         self.__status['mode'] = self.__status['mode'] + '__announce'
 
     def loadData(self, savenum):
         """DBからもってきたrsrcとstatusを反映する。"""
-        rows = DBAccess.selectData({'savenum':savenum})
-        if rows == []:
+        # スナップショットはここで初めて読む
+        snapshot = saveStore.loadSnapshot(savenum)
+        if snapshot is None:
             # セーブがなければそう言う
             self.__status['message'] = '%s番にセーブデータはありません!' % savenum
             self.__status['mode'] = self.__status['mode'] + '__announce'
             return
-        data = rows[0]
-        self.__rsrc.importJson(data['rsrc'])
-        self.__status = json.loads(data['status'])
+        try:
+            state = decodeSnapshot(snapshot)
+        except (ValueError, TypeError, zlib.error):
+            self.__status['message'] = '%s番のセーブデータは壊れています!' % savenum
+            self.__status['mode'] = self.__status['mode'] + '__announce'
+            return
+        self.__rsrc.importState(state.get('rsrc', {}))
+        # セーブに書いてないものはdefaultの値
+        status = copy.deepcopy(self.__status['default'])
+        status.update({'default': self.__status['default'], 'pageBack': 0})
+        saved = dict(state.get('status', {}))
+        if 'imageOrder' in saved:
+            saved['imageOrder'] = DisplayList.fromState(saved['imageOrder'])
+        status.update(saved)
+        self.__status = status
+        self.invalidateLayers()
+        self.__timeline.clear()
+        self.__pause = None
+        self.__scenes.clear()
+        self.__liveBGM = None
+        # セーブしたあとで台本が変わっていたら、画像とBGMはいまの台本をそのページまでたどった状態にする
+        textList = self.__rsrc.textList
+        if (state.get('script', [len(textList), textList.size]) != [len(textList), textList.size]
+                and status['mode'] == 'dialog'):
+            self.seekPage(status['page'])
         # ロード完了を言う
         self.__status['message'] = '%s番のデータをロードしました!' % savenum
         self.__status['mode'] = self.__status['mode'] + '__announce'
@@ -927,10 +3194,126 @@ class DialogFrame:
             )
 
 
-class DBAccess:
-    """DBとの仲介をするメソッドはこちらのクラスに。"""
+# セーブデータ(スナップショット)の形式
+#     先頭9バイト: MAGIC(4バイト) + 形式のバージョン(1バイト) + 中身のCRC32(4バイト、リトルエンディアン)
+#     そのあと: 状態のディクショナリをJSONにしてzlibで縮めたもの
+# 状態のディクショナリはカセットの初期値から変わっているものだけを書く。
+#     status __statusのうち、SNAPSHOT_STATUS_KEYSでdefaultと違うもの
+#     rsrc FrameResources.exportState
+#     script セーブしたときの台本の[パラグラフ数, バイト数]。ロードするとき台本が変わっていないか見る
+SNAPSHOT_MAGIC = b'DFSV'
+# バージョン2からいつでも画像オープンをnum2ではなくimageOrderのOVERLAYの層で持つ
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct('<4sBI')
+# セーブする__statusのキー。message、frameNum、pageBackは毎回初期値に戻るので書かない
+SNAPSHOT_STATUS_KEYS = ('mode', 'page', 'imageOrder', 'num')
+
+
+def encodeSnapshot(state):
+    """状態のディクショナリをスナップショットのbytesにする。"""
+    payload = zlib.compress(json.dumps(state, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, zlib.crc32(payload)) + payload
+
+
+def decodeSnapshot(snapshot):
+    """スナップショットのbytesを状態のディクショナリに戻す。壊れていたらValueError。"""
+    snapshot = bytes(snapshot)
+    if len(snapshot) < SNAPSHOT_HEADER.size:
+        raise ValueError('Snapshot is too short.')
+    magic, version, checksum = SNAPSHOT_HEADER.unpack_from(snapshot, 0)
+    payload = snapshot[SNAPSHOT_HEADER.size:]
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('Not a save snapshot.')
+    if version > SNAPSHOT_VERSION:
+        raise ValueError('Snapshot version %d is newer than this DialogFrame.' % version)
+    if zlib.crc32(payload) != checksum:
+        raise ValueError('Snapshot checksum mismatch.')
+    state = json.loads(zlib.decompress(payload).decode('utf-8'))
+    if version < 2:
+        upgradeImageOpen(state.setdefault('status', {}))
+    return state
+
+
+def upgradeImageOpen(status):
+    """いつでも画像オープンをnum2で持っていたころの__statusを、imageOrderのOVERLAYの層に直す。"""
+    if status.pop('num2', 0) == 1 and Conf.imageOpenName:
+        status['imageOrder'] = list(status.get('imageOrder', [])) + [[Conf.imageOpenName, DisplayList.OVERLAY]]
+
+
+def statusDiff(status):
+    """__statusのうち、セーブするキーでdefaultと違うものだけを返す。
+    modeの__announceや__backはロードしたときには要らないので落とす。"""
+    status = dict(status, mode=status['mode'].split('__')[0])
+    diff = {}
+    for key in SNAPSHOT_STATUS_KEYS:
+        if key in status and status[key] != status['default'].get(key):
+            value = status[key]
+            diff[key] = value.exportState() if isinstance(value, DisplayList) else value
+    return diff
+
+
+def legacySnapshot(jsonRsrc, jsonStatus):
+    """バージョン1.0のセーブ(rsrc列とstatus列のJSON)をスナップショットに作りなおす。"""
+    rsrc = json.loads(jsonRsrc)
+    status = json.loads(jsonStatus)
+    upgradeImageOpen(status)
+    state = {}
+    images = {key: list(dic['xy']) for key,dic in rsrc['imageInstances'].items()
+        if list(dic['xy']) != list(Images.defaultXY)}
+    if images:
+        state['images'] = images
+    sounds = {key: float(dic['vol']) for key,dic in rsrc['soundInstances'].items()
+        if float(dic['vol']) != Sounds.defaultVolume}
+    if sounds:
+        state['sounds'] = sounds
+    bgm = {key: rsrc['bgmDic'][key] for key,value in BGMs.defaults.items()
+        if key in rsrc['bgmDic'] and rsrc['bgmDic'][key] != value}
+    if bgm:
+        state['bgm'] = bgm
+    return encodeSnapshot({'status': statusDiff(status), 'rsrc': state})
+
+
+# 組み込みのイベントタグ
+tagRegistry.register('image', DialogFrame.imageTag, {
+    'file': 'str', 'x': 'int', 'y': 'int', 'put': 'flag', 'remove': 'flag', 'removeall': 'flag',
+    'changefrom': 'str', 'changeto': 'str', 'shake': 'int',
+    'move': 'int', 'fade': 'int', 'blink': 'int', 'duration': 'int',
+})
+tagRegistry.register('sound', DialogFrame.soundTag, {
+    'file': 'str', 'volume': 'float', 'play': 'flag', 'reset': 'flag',
+}, required=('file',))
+tagRegistry.register('bgm', DialogFrame.bgmTag, {
+    'file': 'str', 'volume': 'float', 'play': 'flag', 'stop': 'flag',
+})
+tagRegistry.register('text', DialogFrame.textTag, {
+    'string': 'str', 'color': 'color', 'font': 'str', 'fontsize': 'int', 'x': 'int', 'y': 'int',
+})
+tagRegistry.register('skip', DialogFrame.skipTag, {
+    'pause': 'int', 'back': 'flag',
+})
+tagRegistry.register('dice', DialogFrame.diceTag, {
+    'skill': 'str', 'result': 'int', 'x': 'int', 'y': 'int',
+}, required=('skill', 'result', 'x', 'y'))
 
-    dbPath = Conf.cassette+os.sep+'other'+os.sep+'save.sqlite3'
+
+class DBAccess:
+    """セーブDBとの仲介をするクラス。インスタンスは一個だけ生成する。
+    接続は初めて使うときに一本だけ開き、終了まで開きっぱなしにする(WALモード)。
+    SQLは全部プレースホルダで組む。
+    書き込みは書き込みスレッドに渡すだけなので、ゲームループはディスクを待たない。
+    溜まった書き込みはまとめて一回のトランザクションにする。
+    読み込みは、書き込み待ちのものを済ませてから読む。
+    スロットの一覧はslotsテーブル(スロット番号、ページ、パラグラフ数、日時、サムネイル)だけを引き、
+    savesテーブルのスナップショットはロードするときにだけ読む。サムネイルは書き込みスレッドで作る。
+    既読のパラグラフ(ReadPages)は台本のファイル名ごとにreadPagesテーブルに入れる。
+    既読は減らないので、書き込みスレッドがDBに入っているビット列と足してから書く。
+    property
+        dbPath
+        dbFields savesテーブルの列
+        slotFields slotsテーブルの列
+        pending 書き込みスレッドに渡して、まだ済んでいない書き込み(と既読の読み込み)のキュー
+        error 書き込みスレッドで起きた例外。次に呼ばれたときゲームループ側で投げなおす
+    """
 
     dbFields = [
         'id',
@@ -938,74 +3321,288 @@ class DBAccess:
         'rsrc',
         'status',
         'paragraph',
+        'snapshot',
     ]
 
-    def assoc(trash):
+    slotFields = [
+        'savenum',
+        'page',
+        'paragraph',
+        'savedAt',
+        'thumbnail',
+    ]
+
+    # サムネイルの大きさ。zlibで縮めたRGBで持つ
+    thumbnailSize = (96, 72)
+
+    def __init__(self, dbPath):
+        self.dbPath = dbPath
+        self.connection = None
+        # 接続は書き込みスレッドとゲームループで共有するので、使うときはこのロックを取る
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.thread = None
+        self.error = None
+
+    def connect(self):
+        """接続を返す。なければ開く。"""
+        with self.lock:
+            if self.connection is None:
+                connection = sqlite3.connect(self.dbPath, check_same_thread=False)
+                connection.execute('PRAGMA journal_mode=WAL')
+                # WALならNORMALでもDBは壊れない。コミットごとのfsyncはしない
+                connection.execute('PRAGMA synchronous=NORMAL')
+                self.connection = connection
+            return self.connection
+
+    def migrate(self):
+        """バージョン1.0のDBならsnapshot列とslotsテーブルを足して、古い形式のセーブのスナップショットを作る。
+        initialize()から一回だけ、書き込みスレッドが動く前に呼ぶ。
+        古い形式の列(rsrc, status)は消さないので、前のバージョンに戻してもそのセーブは読める。
+        念のため、作りなおす前のDBをdbPath+'.v1.bak'に写しておく(もうあれば写さない)。"""
+        connection = self.connect()
+        with self.lock, connection:
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(saves)')]
+            if 'snapshot' not in columns and not os.path.exists(self.dbPath + '.v1.bak') \
+                    and connection.execute('SELECT count(*) FROM saves').fetchone()[0]:
+                backup = sqlite3.connect(self.dbPath + '.v1.bak')
+                connection.backup(backup)
+                backup.close()
+            if 'snapshot' not in columns:
+                connection.execute('ALTER TABLE saves ADD COLUMN snapshot BLOB')
+            connection.execute('CREATE TABLE IF NOT EXISTS slots ('
+                'savenum INTEGER PRIMARY KEY, page INTEGER, paragraph INTEGER, savedAt TEXT, thumbnail BLOB)')
+            connection.execute('CREATE INDEX IF NOT EXISTS slots_savedAt ON slots (savedAt)')
+            connection.execute('CREATE TABLE IF NOT EXISTS readPages ('
+                'script TEXT PRIMARY KEY, paragraphs INTEGER, bitmap BLOB)')
+            rows = connection.execute(
+                'SELECT id, rsrc, status FROM saves WHERE snapshot IS NULL AND status IS NOT NULL').fetchall()
+            for rowId,jsonRsrc,jsonStatus in rows:
+                try:
+                    snapshot = legacySnapshot(jsonRsrc, jsonStatus)
+                except (ValueError, KeyError, TypeError):
+                    # 読めない古いセーブはそのまま残す(ロードすると壊れていると言う)
+                    continue
+                connection.execute('UPDATE saves SET snapshot = ? WHERE id = ?', (snapshot, rowId))
+            # slotsテーブルがなかったころのセーブは、ページをスナップショットから拾う
+            rows = connection.execute('SELECT savenum, paragraph, snapshot FROM saves '
+                'WHERE savenum IS NOT NULL AND savenum NOT IN (SELECT savenum FROM slots)').fetchall()
+            for savenum,paragraph,snapshot in rows:
+                try:
+                    page = decodeSnapshot(snapshot).get('status', {}).get('page', 0)
+                except (ValueError, TypeError, zlib.error):
+                    page = None
+                connection.execute('INSERT INTO slots (savenum, page, paragraph) VALUES (?, ?, ?)',
+                    (savenum, page, paragraph))
+
+    def assoc(self, trash):
         """い つ も の。"""
-        rows = []
-        for i in range(len(trash)):
-            rows.append({})
-            for j in range(len(trash[i])):
-                rows[i][DBAccess.dbFields[j]] = trash[i][j]
-        return rows
-
-    def selectData(condDic={}):
-        """WHERE条件をディクショナリで受け取り、selectしてリストで返す。"""
-        connection = sqlite3.connect(DBAccess.dbPath)
-        cursor = connection.cursor()
-        sql = 'SELECT * FROM saves WHERE 1=1 '
-        for key,value in condDic.items():
-            # メンドいのでプリペアドステートメントは使わない。
-            sql += 'AND %s=%s ' % (key, value)
-        cursor.execute(sql)
-        trash = cursor.fetchall()
-        if trash:
-            rows = DBAccess.assoc(trash)
-        else:
-            rows = []
-        cursor.close()
-        connection.close()
-        return rows
-
-    def igsertData(valueDic={}, condDic={}):
-        """そのsavenumがなければinsertする。"""
-        connection = sqlite3.connect(DBAccess.dbPath)
-        cursor = connection.cursor()
-        fields = ''
-        values = ''
-        for key,value in valueDic.items():
-            # メンドいのでプリペアドステートメントは使わない。
-            fields += key + ','
-            values += str(value) + ','
-        fields = fields.rstrip(',')
-        values = values.rstrip(',')
-        sql = 'INSERT OR IGNORE INTO saves (%s) VALUES (%s)' % (fields, values)
-        for key,value in condDic.items():
-            sql += 'AND %s=%s ' % (key, value)
-        cursor.execute(sql)
-        connection.commit()
-        cursor.close()
-        connection.close()
-
-    def updateData(valueDic={}, condDic={}):
-        """valueDicの内容をcondDicの条件でupdateする。"""
-        connection = sqlite3.connect(DBAccess.dbPath)
-        cursor = connection.cursor()
-        stmt = ''
+        return [dict(zip(DBAccess.dbFields, row)) for row in trash]
+
+    def where(self, condDic):
+        """WHERE条件のSQLとバインドする値を作る。列名はdbFieldsにあるものだけ。"""
+        sql = ''
         bind = []
-        for key,value in valueDic.items():
-            # json入るのでプリペアドステートメント使う(文字列の直書きちょっとあやふや)。
-            stmt += '%s = ?,' % key
-            bind.append(value)
-        stmt = stmt.rstrip(',')
-        sql = 'UPDATE saves SET %s WHERE 1=1 ' % stmt
         for key,value in condDic.items():
-            # メンドいのでプリペアドステートメントは使わない。
-            sql += 'AND %s=%s ' % (key, value)
-        cursor.execute(sql, tuple(bind))
-        connection.commit()
-        cursor.close()
-        connection.close()
+            if key not in DBAccess.dbFields:
+                raise KeyError(key)
+            sql += 'AND %s = ? ' % key
+            bind.append(value)
+        return sql, bind
+
+    def selectData(self, condDic={}):
+        """WHERE条件をディクショナリで受け取り、selectしてリストで返す。"""
+        self.flush()
+        connection = self.connect()
+        sql, bind = self.where(condDic)
+        with self.lock:
+            trash = connection.execute('SELECT %s FROM saves WHERE 1=1 ' % ', '.join(DBAccess.dbFields) + sql,
+                bind).fetchall()
+        return self.assoc(trash)
+
+    def writeData(self, savenum, valueDic, slotDic={}, screenshot=None, readPages=None):
+        """savenumのレコードをvalueDicの内容にする(なければ作る)。書き込みは書き込みスレッドがやる。
+        slotDicはslotsテーブルに書く内容。screenshotを渡せば、そこからサムネイルを作って一緒に書く。
+        readPagesを渡せば、既読のビット列も同じトランザクションで書く。"""
+        self.raiseError()
+        for key in valueDic:
+            if key not in DBAccess.dbFields:
+                raise KeyError(key)
+        for key in slotDic:
+            if key not in DBAccess.slotFields:
+                raise KeyError(key)
+        self.enqueue((savenum, dict(valueDic), dict(slotDic), screenshot, self.readPagesRow(readPages)))
+
+    def writeReadPages(self, readPages):
+        """既読のビット列(ReadPages)だけを書く。書き込みは書き込みスレッドがやる。"""
+        self.raiseError()
+        self.enqueue((None, {}, {}, None, self.readPagesRow(readPages)))
+
+    def readPagesRow(self, readPages):
+        """readPagesテーブルに書く(台本, パラグラフ数, ビット列)。書き込みスレッドに渡すので写しておく。
+        DBのぶんを足していないビット列でもよい(mergeReadRow)。"""
+        if readPages is None:
+            return None
+        readPages.dirty = False
+        return (readPages.script, readPages.count, bytes(readPages.bits))
+
+    def loadReadPages(self, script):
+        """台本scriptの(パラグラフ数, ビット列)を返す。なければNone。書き込み待ちのものが済むまで待つ。"""
+        self.flush()
+        return self.selectReadPages(script)
+
+    def loadReadPagesLater(self, script, callback):
+        """台本scriptの(パラグラフ数, ビット列)かNoneを、書き込みスレッドで読んでcallbackに渡す。
+        それより前に頼んだ書き込みが済んでから読む。callbackは書き込みスレッドで呼ばれる。"""
+        self.raiseError()
+        self.enqueue(lambda: callback(self.selectReadPages(script)))
+
+    def selectReadPages(self, script):
+        connection = self.connect()
+        with self.lock:
+            return connection.execute('SELECT paragraphs, bitmap FROM readPages WHERE script = ?',
+                (script,)).fetchone()
+
+    def enqueue(self, write):
+        """書き込みを書き込みスレッドに渡す。スレッドがなければ動かす。"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.pending.put(write)
+
+    def run(self):
+        while True:
+            writes = [self.pending.get()]
+            # 溜まっているぶんを全部まとめる
+            while True:
+                try:
+                    writes.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            count = len(writes)
+            stop = None in writes
+            try:
+                # 関数(loadReadPagesLaterの読み込み)は、いっしょに溜まっていた書き込みのあとで呼ぶ
+                reads = [write for write in writes if callable(write)]
+                writes = [write for write in writes if write is not None and not callable(write)]
+                # サムネイルはDBのロックの外で作る
+                for savenum,valueDic,slotDic,screenshot,readRow in writes:
+                    if screenshot is not None:
+                        slotDic['thumbnail'] = self.createThumbnail(screenshot)
+                self.write(writes)
+                for read in reads:
+                    read()
+            except Exception:
+                self.error = traceback.format_exc()
+            for i in range(count):
+                self.pending.task_done()
+            if stop:
+                return
+
+    def write(self, writes):
+        """書き込みを一回のトランザクションで済ませる。"""
+        if not writes:
+            return
+        connection = self.connect()
+        with self.lock:
+            with connection:
+                for savenum,valueDic,slotDic,screenshot,readRow in writes:
+                    if readRow is not None:
+                        connection.execute('INSERT OR REPLACE INTO readPages (script, paragraphs, bitmap) '
+                            'VALUES (?, ?, ?)', self.mergeReadRow(connection, readRow))
+                    if savenum is None:
+                        continue
+                    connection.execute('INSERT OR IGNORE INTO saves (savenum) VALUES (?)', (savenum,))
+                    stmt = ', '.join('%s = ?' % key for key in valueDic)
+                    connection.execute('UPDATE saves SET %s WHERE savenum = ?' % stmt,
+                        tuple(valueDic.values()) + (savenum,))
+                    if slotDic:
+                        connection.execute('INSERT OR IGNORE INTO slots (savenum) VALUES (?)', (savenum,))
+                        stmt = ', '.join('%s = ?' % key for key in slotDic)
+                        connection.execute('UPDATE slots SET %s WHERE savenum = ?' % stmt,
+                            tuple(slotDic.values()) + (savenum,))
+
+    def mergeReadRow(self, connection, readRow):
+        """readPagesテーブルに書く行に、DBに入っているビット列を足す。書き込みスレッドでトランザクションの中で呼ぶ。
+        パラグラフ数が変わった台本のものは捨てる。"""
+        script, paragraphs, bitmap = readRow
+        stored = connection.execute('SELECT paragraphs, bitmap FROM readPages WHERE script = ?',
+            (script,)).fetchone()
+        if stored is None or stored[0] != paragraphs or len(stored[1]) != len(bitmap):
+            return readRow
+        return (script, paragraphs, bytes(a | b for a,b in zip(bitmap, stored[1])))
+
+    def createThumbnail(self, screenshot):
+        """画面のコピーからサムネイルのbytesを作る。書き込みスレッドで呼ぶ。"""
+        if screenshot.get_bitsize() not in (24, 32):
+            screenshot = screenshot.convert(32)
+        thumbnail = pygame.transform.smoothscale(screenshot, DBAccess.thumbnailSize)
+        return zlib.compress(pygame.image.tostring(thumbnail, 'RGB'))
+
+    def thumbnailSurface(self, thumbnail):
+        """サムネイルのbytesをサーフィスに戻す。"""
+        if thumbnail is None:
+            return None
+        return pygame.image.frombuffer(zlib.decompress(thumbnail), DBAccess.thumbnailSize, 'RGB').copy()
+
+    def countSlots(self):
+        """セーブのあるスロットの数。"""
+        self.flush()
+        connection = self.connect()
+        with self.lock:
+            return connection.execute('SELECT COUNT(*) FROM slots').fetchone()[0]
+
+    def nextSlot(self):
+        """まだ使っていないスロット番号(いま一番大きい番号の次)。"""
+        self.flush()
+        connection = self.connect()
+        with self.lock:
+            return (connection.execute('SELECT MAX(savenum) FROM slots').fetchone()[0] or 0) + 1
+
+    def listSlots(self, offset, limit):
+        """スロット番号順にoffset番目からlimit個ぶんのslotsテーブルの行を返す。スナップショットは読まない。"""
+        self.flush()
+        connection = self.connect()
+        with self.lock:
+            trash = connection.execute('SELECT %s FROM slots ORDER BY savenum LIMIT ? OFFSET ?'
+                % ', '.join(DBAccess.slotFields), (limit, offset)).fetchall()
+        return [dict(zip(DBAccess.slotFields, row)) for row in trash]
+
+    def loadSnapshot(self, savenum):
+        """savenumのスナップショットを返す。セーブがなければNone。
+        作りなおせなかった古い形式のセーブは空のbytesを返す(ロードすると壊れていると言う)。"""
+        self.flush()
+        connection = self.connect()
+        with self.lock:
+            row = connection.execute('SELECT snapshot FROM saves WHERE savenum = ?', (savenum,)).fetchone()
+        if row is None:
+            return None
+        return b'' if row[0] is None else row[0]
+
+    def flush(self):
+        """書き込み待ちのものが全部済むまで待つ。"""
+        if self.thread is not None:
+            self.pending.join()
+        self.raiseError()
+
+    def raiseError(self):
+        """書き込みスレッドで例外が起きていたら、ここで投げなおす。"""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise IOError('セーブの書き込みに失敗しました。\n' + error)
+
+    def close(self):
+        """書き込みを全部済ませ、WALをDBに書き戻してから閉じる。終了時に呼ぶ。"""
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            if self.connection is not None:
+                self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                self.connection.close()
+                self.connection = None
+        self.raiseError()
 
 
 class FrameError:
@@ -1022,20 +3619,47 @@ class FrameError:
         sys.exit()
 
 
-if __name__ == '__main__':
+def initialize(dbPath=None):
+    """画面、フォント、キャッシュ、キーコンフィグなど、モジュール全体で使うものを作る。
+    DialogFrameをインスタンス化する前に一度だけ呼ぶ。
+    dbPathはセーブDB。書かなければカセットのother/save.sqlite3。"""
+    global screen, compositor, framerate, clock, idler, profiler, profileOverlay
+    global fonts, font, textCache, layerCache, soundCache, keyConf, saveStore, speakerIndex
     pygame.init()
     screenSize = (640, 480)
     screen = pygame.display.set_mode(screenSize)
+    compositor = Compositor(screen)
     framerate = Conf.framerate
     clock = pygame.time.Clock()
+    idler = FrameIdler(getattr(Conf, 'useIdle', True), getattr(Conf, 'idleTimeout', 500))
+    # フレームの段階ごとの時間の記録。Conf.profileFramesがFalse(デフォルト)なら何もしない
+    profiler = FrameProfiler(getattr(Conf, 'profileFrames', False),
+        getattr(Conf, 'profileHistory', 100000), getattr(Conf, 'profileWindow', 300))
+    profileOverlay = profiler.enabled and getattr(Conf, 'profileOverlay', False)
     icon = Images(Conf.cassette+os.sep+'other'+os.sep+Conf.dialogIcon, (0,0))
     pygame.display.set_icon(icon.surface)
     pygame.display.set_caption(Conf.dialogTitle)
-    font = pygame.font.Font(Conf.cassette+os.sep+'other'+os.sep+Conf.dialogFont, Conf.dialogFontSize)
+    fonts = FontRegistry()
+    font = fonts.get(Conf.dialogFont, Conf.dialogFontSize)
+    # 文字サーフィスキャッシュの大きさ(バイト)。Confで指定がなければ16MB
+    textCache = TextCache(getattr(Conf, 'textCacheBudget', 16*1024*1024))
+    soundCache = SoundCache(getattr(Conf, 'soundCacheBudget', 32*1024*1024))
+    # ページレイヤーの大きさ(バイト)と、何ページ先まで作っておくか
+    layerCache = PageLayerCache(getattr(Conf, 'layerCacheBudget', 16*1024*1024))
+    saveStore = DBAccess(dbPath or Conf.cassette+os.sep+'other'+os.sep+'save.sqlite3')
+    saveStore.migrate()
+    # 発言者と立ち絵の関連付けの索引。メインテキストのコンパイルより先に
+    speakerIndex = SpeakerIndex(Conf.linkingList)
+    # 画像を置く層。imageConfにlayerがなければCHARACTER
+    DisplayList.defaultLayers = {image['name']: DisplayList.LAYERS.index(image['layer'])
+        for image in Conf.imageConf if 'layer' in image}
+    # カセットのプラグインのタグを登録する。メインテキストのコンパイルより先に
+    tagRegistry.loadPlugins(Conf.cassette+os.sep+'other', getattr(Conf, 'tagPlugins', []), sys.modules[__name__])
     keyDic = {
         'z': K_z,
         'x': K_x,
         'c': K_c,
+        's': K_s,
         '1': K_1,
         '2': K_2,
         '3': K_3,
@@ -1067,15 +3691,33 @@ if __name__ == '__main__':
         'load2': keyDic[Conf.keyConf['load2']],
         'load3': keyDic[Conf.keyConf['load3']],
         'load4': keyDic[Conf.keyConf['load4']],
+        'saveSlots': keyDic[Conf.keyConf.get('saveSlots', 'f5')],
+        'loadSlots': keyDic[Conf.keyConf.get('loadSlots', 'f6')],
         'showHelp': keyDic[Conf.keyConf['showHelp']],
         'goToStart': keyDic[Conf.keyConf['goToStart']],
+        'skip': keyDic[Conf.keyConf.get('skip', 's')],
     }
 
+
+if __name__ == '__main__':
+    initialize()
+    if getattr(Conf, 'idleReport', False):
+        # 終了時に待機状況をprintする
+        atexit.register(lambda: print('idle report: %s' % json.dumps(idler.report())))
+    # 終了時にセーブの書き込みを全部済ませる
+    atexit.register(saveStore.close)
+    if profiler.enabled:
+        # 終了時にフレームの記録をlogフォルダに書き出す
+        atexit.register(profiler.export,
+            Conf.cassette+os.sep+'log'+os.sep+getattr(Conf, 'profileFile', 'frames.csv'))
+
     # frame = DialogFrame()
     # frame.main()
 
     try:
         frame = DialogFrame()
+        # 終了時に既読を書く(saveStore.closeより先に呼ばれる)
+        atexit.register(frame.storeReadPages)
         frame.main()
     except Exception as e:
         FrameError(traceback.format_exc())
@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''benchmark_dialog_frame
+
+DialogFrameの重いところを、ウィンドウを出さずに計るモジュール。
+SDLのdummyドライバで動かすので、画面も音も出ない。
+チュートリアルのカセットと、その場で作る大きめの合成カセットで
+    startup         FrameResources()の作成(起動)
+    dialogMode      1ページぶんのdialogMode
+    dialogEvent     イベントタグ1個ぶんのdialogEvent(タグの種類ごとにも出す)
+    imageLinking    1ページぶんの関連付け(applyLinking)
+    backMode        1ページぶんのbackMode
+    skipTagLines    ページ戻り1回ぶんのskipTagLines(戻る向きと進む向き)
+    seekPage        好きなページに飛ぶseekPage 1回と、初回に作るチェックポイントの索引(seekPage.index)
+    skipParagraphs  スキップモードで1パラグラフ進めるぶん
+    saveData        saveData 1回(ゲームループが待つぶん)と、書き込みスレッドが書き終わるまで(saveData.flush)
+    loadData        loadData 1回
+を別々に計って、結果をJSONで出す。バージョンごとのJSONを比べれば遅くなったところがわかる。
+
+使い方:
+    python benchmark_dialog_frame.py
+        結果をJSONで標準出力に出す。進み具合は標準エラーに出す。
+    python benchmark_dialog_frame.py --out result.json --pages 200,5000 --repeat 20
+        --out     JSONの出力先
+        --pages   合成カセットのページ数。カンマ区切りでいくつでも。0ならチュートリアルだけ
+        --repeat  startup、saveData、loadDataを何回計るか
+        --config  元にするDialogFrameConfig.py。書かなければチュートリアルのもの
+
+ただし使用条件:
+    DialogFrame.pyと同じフォルダで実行すること。
+    合成カセットとセーブDBは一時フォルダに作って最後に消すので、カセットのセーブデータは変わらない。
+
+========================================
+バージョン1.0(2026-10-18)
+    完成。
+'''
+
+import os
+import sys
+import json
+import time
+import math
+import random
+import shutil
+import wave
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+
+# pygameを読む前にダミーのドライバにしておく
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+# 結果のJSONを標準出力に出すので、pygameの挨拶は出さない
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TUTORIAL_CONFIG = os.path.join(HERE, 'cassette-DialogFrameTutorial', 'config', '(Tutorial)DialogFrameConfig.py')
+
+
+def loadConfig(path):
+    '''DialogFrameConfig.pyを読んで、DialogFrameがimportするものとして登録する。'''
+    spec = importlib.util.spec_from_file_location('DialogFrameConfig', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules['DialogFrameConfig'] = module
+    return module.Conf
+
+
+def summarize(samples):
+    '''秒のリストをミリ秒の統計にする。'''
+    if not samples:
+        return {'n': 0}
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        'n': n,
+        'total_ms': sum(samples) * 1000,
+        'mean_ms': sum(samples) / n * 1000,
+        'median_ms': (samples[(n-1)//2] + samples[n//2]) / 2 * 1000,
+        'p95_ms': samples[max(0, math.ceil(n*0.95) - 1)] * 1000,
+        'min_ms': samples[0] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def timed(function, *args):
+    '''functionを一回呼んでかかった秒を返す。'''
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def createSyntheticCassette(root, baseConf, pages, speakers, seed=0):
+    '''pagesページ、speakers人ぶんの立ち絵のある合成カセットをrootに作り、そのConfを返す。
+    フォントとアイコンとセーブDBは元のカセットのものを写す。'''
+    rand = random.Random(seed)
+    for d in ['image', 'log', 'maintext', 'other', 'sound']:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    # other: フォント、アイコン、まっさらのセーブDB
+    baseOther = os.path.join(HERE, baseConf.cassette, 'other')
+    for name in (baseConf.dialogFont, baseConf.dialogIcon):
+        shutil.copy(os.path.join(baseOther, name), os.path.join(root, 'other', name))
+    shutil.copy(os.path.join(baseOther, '(新品)save.sqlite3'), os.path.join(root, 'other', 'save.sqlite3'))
+
+    # image: 背景、ダイアログボックス、いつでも画像、話者ごとの立ち絵(明るいのと暗いの)
+    def saveImage(name, size, color, trans):
+        surface = pygame.Surface(size)
+        surface.fill(color)
+        if trans:
+            # 透明色にする角の色
+            surface.fill((0, 255, 0), pygame.Rect(0, 0, 8, 8))
+            surface.set_at((0, 0), (0, 255, 0))
+        pygame.image.save(surface, os.path.join(root, 'image', name))
+        return {'name': name, 'trans': (0,0) if trans else False}
+
+    imageConf = [
+        saveImage('bg.png', (640, 480), (40, 60, 90), False),
+        saveImage('box.png', (600, 150), (20, 20, 20), False),
+        saveImage('frame.png', (180, 200), (90, 90, 40), False),
+    ]
+    linkingList = []
+    for i in range(speakers):
+        color = (rand.randint(80, 255), rand.randint(80, 255), rand.randint(80, 255))
+        imageConf.append(saveImage('s%d.png' % i, (200, 260), color, True))
+        imageConf.append(saveImage('s%d_back.png' % i, (200, 260), tuple(c//2 for c in color), True))
+        linkingList.append({'【話者%d】' % i: {'main': 's%d.png' % i, 'back': 's%d_back.png' % i}})
+
+    # sound: 短い無音のSE
+    with wave.open(os.path.join(root, 'sound', 'se.wav'), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(22050)
+        f.writeframes(b'\x00\x00' * 2205)
+
+    # maintext: 話者の台詞に、画像、SE、text、dice、skipのタグを混ぜる
+    paragraphs = []
+    lines = ['<event name=image removeall>',
+             '<event name=image file="bg.png" x=0 y=0 put>',
+             '<event name=image file="box.png" x=20 y=320 put>']
+    for i in range(speakers):
+        lines.append('<event name=image file="s%d.png" x=%d y=%d put>' % (i, 20 + 420*i//max(1, speakers-1), 60))
+    lines.append('合成カセットです。')
+    paragraphs.append('\n'.join(lines))
+    for page in range(1, pages):
+        lines = []
+        speaker = rand.randrange(speakers)
+        if page % 19 == 0:
+            # 通常行のないページ
+            paragraphs.append('<event name=skip>')
+            continue
+        if page % 7 == 0:
+            lines.append('<event name=image file="s%d.png" x=%d y=%d>' % (speaker, rand.randint(0, 440), rand.randint(40, 80)))
+        if page % 11 == 0:
+            lines.append('<event name=sound file="se.wav" volume=0.2 play>')
+        if page % 13 == 0:
+            lines.append('<event name=text string="%dページ" x=560 y=10 fontsize=14>' % page)
+        if page % 29 == 0:
+            lines.append('<event name=image file="s%d.png" shake=4 put>' % speaker)
+        if page % 31 == 0:
+            lines.append('# コメント行')
+        lines.append('【話者%d】' % speaker)
+        for j in range(rand.randint(1, 3)):
+            lines.append('%dページ%d行目。' % (page, j) + 'あいうえおかきくけこ'[:rand.randint(3, 10)])
+        if page % 17 == 0:
+            lines.append('<event name=dice skill="目星" result=%d x=25 y=420>' % rand.randint(1, 100))
+        paragraphs.append('\n'.join(lines))
+    with open(os.path.join(root, 'maintext', 'synthetic.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(paragraphs))
+
+    attrs = {
+        'cassette': root,
+        'maintextName': 'synthetic.txt',
+        'imageConf': imageConf,
+        'imageOpenName': 'frame.png',
+        'imageOpenXY': [230, 140],
+        'seConf': [{'name': 'se.wav'}],
+        'soundTurnPage': 'se.wav',
+        'bgmConf': [],
+        'linkingList': linkingList,
+        'useOpening': False,
+        'diceDic': {'目星': 85},
+    }
+    return type('Conf', (baseConf,), attrs)
+
+
+class Benchmark:
+    '''ひとつのカセットでDialogFrameの各処理を計るクラス。
+    property
+        name 結果に出す名前
+        conf そのカセットのConf
+        repeat startup、saveData、loadDataを計る回数
+        results 処理の名前をキーにした統計のディクショナリ
+    '''
+
+    def __init__(self, df, name, conf, dbPath, repeat):
+        self.df = df
+        self.name = name
+        self.conf = conf
+        self.repeat = repeat
+        self.results = {}
+        # DialogFrameのConfとセーブDBをこのカセットのものに差し替えて、画面とキャッシュを作りなおす
+        df.Conf = conf
+        df.initialize(dbPath)
+
+    def run(self):
+        '''全部計って結果を返す。'''
+        self.startup()
+        self.frame = self.df.DialogFrame()
+        self.status()['mode'] = 'dialog'
+        self.textList = self.rsrc().textList
+        self.dialogMode()
+        self.dialogEvent()
+        self.imageLinking()
+        self.backMode()
+        self.seekPage()
+        self.skipParagraphs()
+        self.saveLoad()
+        self.rsrc().close()
+        self.df.saveStore.close()
+        return {
+            'cassette': os.path.basename(self.conf.cassette),
+            'pages': len(self.textList),
+            'images': len(self.conf.imageConf),
+            'results': self.results,
+        }
+
+    def status(self):
+        # loadDataで入れ替わるので毎回引く
+        return self.frame._DialogFrame__status
+
+    def rsrc(self):
+        return self.frame._DialogFrame__rsrc
+
+    def log(self, message):
+        print('[%s] %s' % (self.name, message), file=sys.stderr)
+
+    def startup(self):
+        self.log('startup')
+        samples = []
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            rsrc = self.df.FrameResources()
+            samples.append(time.perf_counter() - start)
+            # 先読みのスレッドを止めてから次を計る
+            rsrc.close()
+        self.results['startup'] = summarize(samples)
+
+    def dialogMode(self):
+        self.log('dialogMode')
+        status = self.status()
+        samples = []
+        for page in range(len(self.textList)):
+            status['page'] = page
+            samples.append(timed(self.frame.dialogMode))
+            # 描画の登録がたまらないように、フレームの残りもやっておく(これは計らない)
+            self.frame.composeImages()
+            self.df.compositor.update()
+        self.results['dialogMode'] = summarize(samples)
+
+    def dialogEvent(self):
+        self.log('dialogEvent')
+        status = self.status()
+        byName = {}
+        for page in range(len(self.textList)):
+            for tag in self.textList[page].tags:
+                status['page'] = page
+                byName.setdefault(tag.name, []).append(timed(self.frame.dialogEvent, tag))
+            self.df.compositor.update()
+        self.results['dialogEvent'] = summarize([s for samples in byName.values() for s in samples])
+        for name,samples in sorted(byName.items()):
+            self.results['dialogEvent.' + name] = summarize(samples)
+
+    def imageLinking(self):
+        self.log('imageLinking')
+        # imageタグを台本の順に当てながら、関連付けだけを計る
+        order = self.df.DisplayList()
+        positions = self.rsrc().positions.copy()
+        samples = []
+        for paragraph in self.textList:
+            for tag in paragraph.tags:
+                if tag.name == 'image':
+                    self.df.applyImageTag(tag.attrs, order, positions)
+            samples.append(timed(self.df.applyLinking, paragraph.speakerKeys, order, positions))
+        self.results['imageLinking'] = summarize(samples)
+
+    def backMode(self):
+        self.log('backMode')
+        status = self.status()
+        last = len(self.textList) - 1
+        status['page'] = last
+        status['mode'] = 'dialog__back'
+        samples = []
+        for pageBack in range(1, last+1):
+            status['pageBack'] = pageBack
+            samples.append(timed(self.frame.backMode))
+            self.df.compositor.update()
+        self.results['backMode'] = summarize(samples)
+
+        backward = []
+        forward = []
+        for pageBack in range(1, last+1):
+            status['pageBack'] = pageBack
+            backward.append(timed(self.frame.skipTagLines, True))
+            status['pageBack'] = pageBack
+            forward.append(timed(self.frame.skipTagLines, False))
+        self.results['skipTagLines.back'] = summarize(backward)
+        self.results['skipTagLines.forward'] = summarize(forward)
+        status['mode'] = 'dialog'
+        status['pageBack'] = 0
+
+    def seekPage(self):
+        self.log('seekPage')
+        index = [timed(self.frame.checkpoints)]
+        rand = random.Random(0)
+        samples = [timed(self.frame.seekPage, rand.randrange(len(self.textList))) for i in range(self.repeat)]
+        self.results['seekPage.index'] = summarize(index)
+        self.results['seekPage'] = summarize(samples)
+        self.status()['page'] = 0
+
+    def skipParagraphs(self):
+        self.log('skipParagraphs')
+        # 全部既読にして、台本の最後まで1パラグラフずつ進める
+        readPages = self.frame.readPages()
+        readPages.bits[:] = b'\xff' * len(readPages.bits)
+        self.frame.seekPage(0)
+        status = self.status()
+        status['mode'] = 'dialog__skip'
+        samples = []
+        while status['mode'] == 'dialog__skip':
+            samples.append(timed(self.frame.skipParagraphs, 0))
+        self.results['skipParagraphs'] = summarize(samples)
+        status['page'] = 0
+
+    def saveLoad(self):
+        self.log('saveData/loadData')
+        rand = random.Random(0)
+        saves = []
+        flushes = []
+        loads = []
+        for i in range(self.repeat):
+            self.status()['page'] = rand.randrange(len(self.textList))
+            saves.append(timed(self.frame.saveData, 1))
+            self.status()['mode'] = 'dialog'
+            # 書き込みスレッドがディスクに書き終わるまで
+            flushes.append(timed(self.df.saveStore.flush))
+            loads.append(timed(self.frame.loadData, 1))
+            self.status()['mode'] = 'dialog'
+        self.results['saveData'] = summarize(saves)
+        self.results['saveData.flush'] = summarize(flushes)
+        self.results['loadData'] = summarize(loads)
+
+
+def revision():
+    '''gitのコミットがわかれば返す。'''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='DialogFrameの処理時間を画面なしで計る。')
+    parser.add_argument('--out', help='JSONの出力先。書かなければ標準出力')
+    parser.add_argument('--pages', default='200,5000', help='合成カセットのページ数(カンマ区切り)')
+    parser.add_argument('--speakers', type=int, default=6, help='合成カセットの話者の数')
+    parser.add_argument('--repeat', type=int, default=20, help='startup、saveData、loadDataを計る回数')
+    parser.add_argument('--config', default=TUTORIAL_CONFIG, help='元にするDialogFrameConfig.py')
+    args = parser.parse_args(argv)
+
+    os.chdir(HERE)
+    baseConf = loadConfig(args.config)
+    pygame.init()
+    import DialogFrame as df
+
+    workDir = tempfile.mkdtemp(prefix='dfbench-')
+    scenarios = {}
+    try:
+        # 元のカセットはセーブDBだけ写しを使う
+        dbPath = os.path.join(workDir, 'save.sqlite3')
+        shutil.copy(os.path.join(baseConf.cassette, 'other', '(新品)save.sqlite3'), dbPath)
+        scenarios['tutorial'] = Benchmark(df, 'tutorial', baseConf, dbPath, args.repeat).run()
+
+        for pages in [int(p) for p in args.pages.split(',') if p.strip()]:
+            if pages <= 0:
+                continue
+            name = 'synthetic-%d' % pages
+            root = os.path.join(workDir, 'cassette-' + name)
+            conf = createSyntheticCassette(root, baseConf, pages, args.speakers)
+            dbPath = os.path.join(root, 'other', 'save.sqlite3')
+            scenarios[name] = Benchmark(df, name, conf, dbPath, args.repeat).run()
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    data = {
+        'benchmark': 'DialogFrame',
+        'revision': revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'sdl': '.'.join(str(v) for v in pygame.get_sdl_version()),
+        'platform': platform.platform(),
+        'scenarios': scenarios,
+    }
+    text = json.dumps(data, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return data
+
+
+if __name__ == '__main__':
+    main()
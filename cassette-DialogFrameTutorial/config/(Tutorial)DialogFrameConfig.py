@@ -7,14 +7,20 @@ class Conf:
     cassette = 'cassette-DialogFrameTutorial'
     # メインテキストの名前
     maintextName = 'DialogFrameTutorial.txt'
+    # メインテキストのパラグラフを、読んだあと何個まで覚えておくか。
+    # 台本がどんなに長くても、覚えておくのはこの数とパラグラフの位置だけ。
+    scriptCacheSize = 64
 
     # 画像はimageフォルダに入れること。
     #     name ファイル名
     #     trans 透明色にしたい色の座標 もともと透明のPNGならFalseでいいよ親切機能だから
+    #     layer 置く層(書かなければ'character')。下から'background' 'character' 'ui' 'overlay'の順に重なって、
+    #           同じ層の中は置いた順。'overlay'はいつでも画像オープンの層
     imageConf = [
         {
             'name': 'skype.jpg',
             'trans': False,
+            'layer': 'background',
         },
         {
             'name': 'dialogbox.png',
@@ -59,6 +65,22 @@ class Conf:
 
     ]
 
+    # 画像とSEを詰めたアーカイブの名前。otherフォルダにあれば使う。
+    # DialogFrameConfig.pyのあるフォルダで python cassette_archive.py とやると作れる。
+    # 素材を差し替えたら作りなおすこと(元ファイルが変わった素材はフォルダから読む)。
+    cassetteArchive = 'cassette.pack'
+
+    # 画像を使うときになってから読むかどうか。Falseなら起動時に全部読む。
+    lazyImages = True
+    # 台本で何ページ先までに出てくる画像とSEを、裏で読んでおくか。
+    imagePreloadPages = 20
+
+    # 自前のイベントタグを足すプラグイン。otherフォルダに置いた.pyファイルの名前を書く。
+    # プラグインには register(registry, engine) という関数を書いて、その中で
+    #     registry.register('タグ名', 処理する関数, {'属性名': 'str'か'int'か'float'か'flag'}, required=(必須の属性名,))
+    # と登録する。処理する関数は (frame, dic) を受け取る。engineからcompositorやtextCacheが使える。
+    tagPlugins = []
+
     # 「いつでも画像オープン」に画像を登録
     imageOpenName = 'diceframe.png'
     imageOpenXY = [230, 140]
@@ -156,6 +178,44 @@ class Conf:
     # 20~30くらいでどうぞ。
     framerate = 20
 
+    # レンダリング済み文字のキャッシュの大きさ(バイト)。書かなければ16MB。
+    textCacheBudget = 16 * 1024 * 1024
+
+    # デコードしたSEを覚えておく大きさ(バイト)。書かなければ32MB。超えたら長く鳴らしていないSEから捨てる。
+    soundCacheBudget = 32 * 1024 * 1024
+
+    # BGMを切り替えるときのクロスフェードの長さ(ミリ秒)。0ならすぐ切り替える。
+    bgmFadeTime = 1000
+    # デコードしたBGMを持っておく大きさ(バイト)。書かなければ64MB。台本で先に出てくる曲は裏で読んでおく。
+    # 1曲で数十MBになることもある。超えたら長く鳴らしていない曲から捨てる。鳴っている曲と次の曲は捨てない。
+    bgmCacheBudget = 64 * 1024 * 1024
+
+    # 動きのない画面ではキー入力が来るまでゲームループを止めておくかどうか。TrueかFalse。
+    useIdle = True
+    # 止めているときに何ミリ秒ごとに1フレームだけ回すか。
+    idleTimeout = 500
+    # 終了時に止めていた時間や、入力から描画までの時間を表示するかどうか。
+    idleReport = False
+
+    # <event name=skip pause=ミリ秒>で待っているあいだに、ページ送りキーで待つのをやめられるかどうか。TrueかFalse。
+    pauseSkippable = False
+
+    # フレームごとに、処理の段階(イベント、タグ、文字、画像、描画、display.update、待ち)ごとの時間を記録するかどうか。
+    # Trueにすると、終了時にlogフォルダのprofileFileに書き出す。拡張子が.jsonならJSON、それ以外はCSV。
+    profileFrames = False
+    profileFile = 'frames.csv'
+    # 記録しておくフレーム数の上限。超えたら古いものから捨てる。
+    profileHistory = 100000
+    # パーセンタイルを出すのに使う直近のフレーム数。
+    profileWindow = 300
+    # フレーム時間とキャッシュのヒット率を左上に表示するかどうか。profileFramesがTrueのときだけ効く。
+    profileOverlay = False
+
+    # ページの画像と文字を一枚に合成したものを、何ページ先まで裏で作っておくか。
+    prefetchPages = 3
+    # 合成したページを覚えておく大きさ(バイト)。1ページで1MBちょっと。0なら合成しない。
+    layerCacheBudget = 16 * 1024 * 1024
+
     # ヘルプのメッセージ。
     helpConf = {
         # 「ヘルプ:F11」みたいな表示をどこに配置するか。nw,ne,sw,seで指定してね。いらないなら''に。
@@ -169,6 +229,7 @@ class Conf:
             'キーヘルプ',
             'Z:進む',
             'X:ページ戻りモードへ',
+            'S:スキップ',
             'C:いつでも画像オープン',
             'F12:タイトル画面に戻る',
         ],
@@ -187,6 +248,19 @@ class Conf:
             '<event name=dice',
         ],
     }
+    # ページ戻りモードで、そのページのときの画像とBGMを出すために、最近何ページぶんの場面を覚えておくか。
+    sceneHistoryPages = 256
+    # 好きなページに飛ぶとき(台本が変わったあとのセーブのロードなど)に使う、チェックポイントの間隔(ページ数)。
+    # 飛ぶときは一番近いチェックポイントから、多くてもこのページ数ぶんだけタグをたどる。
+    checkpointInterval = 50
+
+    # スキップモード。本編でスキップキーを押すと、描画を飛ばして一気にページを進める。なにかキーを押すと止まる。
+    # Trueなら読んだことのあるパラグラフだけ飛ばして、未読の手前で止まる。Falseなら台本の最後まで。
+    skipReadOnly = True
+    # スキップ中、1フレームでページを進めるのに使う時間(ミリ秒)。描くのはそのフレームでたどり着いたページだけ。
+    skipFrameTime = 30
+    # スキップ中の通知内容
+    skipMessage = 'スキップ中です。なにかキーを押すと止まります。'
 
     # セーブとかロードとか、あとヘルプ表示するとき出るボックスの設定。
     announceConf = {
@@ -198,6 +272,8 @@ class Conf:
 
     # セーブ、ロード機能を使うかどうか。
     useSave = False
+    # スロット一覧の1ページに何スロット出すか。
+    slotsPerPage = 5
 
     # キーコンフィグ。
     keyConf = {
@@ -216,6 +292,11 @@ class Conf:
         'load2': 'f2',
         'load3': 'f3',
         'load4': 'f4',
+        # スロット一覧を開く(セーブ、ロード)。一覧からなら何番のスロットでも使える
+        'saveSlots': 'f5',
+        'loadSlots': 'f6',
+        # スキップモードへ
+        'skip': 's',
         # ヘルプを見る
         'showHelp': 'f11',
         # スタート画面へ戻る
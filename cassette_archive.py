@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''cassette_archive
+
+カセットの画像とSEを、デコード済みのまま一個のファイルに詰めるモジュール。
+詰めたファイル(アーカイブ)はDialogFrameがmmapで開いて、
+画像のデコードやSEのデコードをせずにサーフィスとSoundを作る。
+
+アーカイブの作り方:
+    DialogFrameConfig.pyのあるフォルダで
+        python cassette_archive.py
+    とやると、Conf.cassetteのotherフォルダにcassette.packができる。
+    画像はConf.imageConfのtransを反映して、透明色を透明にした状態で入る。
+    SEはそのとき初期化したmixerの形式のPCMで入る。
+
+使用例:
+    import cassette_archive
+    archive = cassette_archive.CassetteArchive('cassette-xxx/other/cassette.pack')
+    surface = archive.surface('lecturer.png', 'cassette-xxx/image/lecturer.png')
+    sound = archive.sound('ban.ogg', 'cassette-xxx/sound/ban.ogg')
+    archive.close()
+
+ただし使用条件:
+    アーカイブにない素材や、詰めたあとで元ファイルが変わった素材はNoneを返すので、
+    呼び出し側でフォルダの元ファイルを読むこと。
+    surfaceはpygame.display.set_modeのあと、soundはmixerの初期化のあとに呼ぶこと。
+
+アーカイブの中身:
+    先頭16バイト: MAGIC(8バイト) + インデックスの位置(8バイト、リトルエンディアン)
+    そのあと: 各素材のピクセル(RGBA)かPCM
+    最後: インデックス(JSON)
+
+========================================
+バージョン1.0(2026-10-18)
+    完成。
+    CassetteArchive.closeを足した。
+'''
+
+import os
+import sys
+import json
+import mmap
+import struct
+import pygame
+
+MAGIC = b'DFPACK01'
+HEADER = struct.Struct('<8sQ')
+
+
+def stamp(path):
+    '''元ファイルが変わったか見分けるための(大きさ, 更新時刻)。'''
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def pack(cassette, imageConf, seConf, archivePath):
+    '''カセットの画像とSEをarchivePathに詰める。
+    pygame.display.set_modeとmixerの初期化が済んでいること。
+    '''
+
+    entries = {}
+    with open(archivePath, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0))
+
+        for image in imageConf:
+            path = cassette+os.sep+'image'+os.sep+image['name']
+            surface = pygame.image.load(path).convert_alpha()
+            if image['trans'] != False:
+                # 透明色の画素のアルファを0にしておけば、colorkeyなしで同じ見た目になる
+                color = surface.get_at(image['trans'])
+                pixels = pygame.PixelArray(surface)
+                pixels.replace(color, (color.r, color.g, color.b, 0))
+                del pixels
+            data = pygame.image.tostring(surface, 'RGBA')
+            entries['image/' + image['name']] = {
+                'offset': f.tell(),
+                'length': len(data),
+                'size': list(surface.get_size()),
+                'trans': list(image['trans']) if image['trans'] != False else None,
+                'stamp': stamp(path),
+            }
+            f.write(data)
+
+        for sound in seConf:
+            path = cassette+os.sep+'sound'+os.sep+sound['name']
+            data = pygame.mixer.Sound(path).get_raw()
+            entries['sound/' + sound['name']] = {
+                'offset': f.tell(),
+                'length': len(data),
+                'stamp': stamp(path),
+            }
+            f.write(data)
+
+        indexOffset = f.tell()
+        index = {
+            # SEのPCMはこの形式。実行時のmixerと違ったら使えない
+            'mixer': list(pygame.mixer.get_init()),
+            'entries': entries,
+        }
+        f.write(json.dumps(index).encode('utf-8'))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, indexOffset))
+    return entries
+
+
+class CassetteArchive:
+    '''packで作ったアーカイブをmmapで開いて、素材を取り出すクラス。
+    property
+        entries インデックス
+        mixer SEのPCMの形式(frequency, size, channels)
+    '''
+
+    def __init__(self, archivePath):
+        self.file = open(archivePath, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, indexOffset = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('Not a cassette archive: ' + archivePath)
+        index = json.loads(self.map[indexOffset:].decode('utf-8'))
+        self.entries = index['entries']
+        self.mixer = tuple(index['mixer'])
+
+    def entry(self, key, sourcePath):
+        '''元ファイルが詰めたときのままならインデックスの項目を返す。'''
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if os.path.exists(sourcePath) and stamp(sourcePath) != entry['stamp']:
+            return None
+        return entry
+
+    def buffer(self, entry):
+        '''項目の中身をコピーせずに返す。'''
+        return memoryview(self.map)[entry['offset']:entry['offset']+entry['length']]
+
+    def surface(self, name, sourcePath):
+        '''画像のサーフィスを返す。アーカイブになければNone。'''
+        entry = self.entry('image/' + name, sourcePath)
+        if entry is None:
+            return None
+        surface = pygame.image.frombuffer(self.buffer(entry), tuple(entry['size']), 'RGBA')
+        # 画面のピクセル形式に合わせる(デコードではなくただの並べ替え)
+        surface = surface.convert_alpha()
+        if entry['trans'] is not None:
+            # 透明にした画素をcolorkeyにもしておく。RLEのblitになるのでフォルダから読んだときと同じ描画になる
+            surface.set_colorkey(surface.get_at(tuple(entry['trans'])), pygame.RLEACCEL)
+        return surface
+
+    def sound(self, name, sourcePath):
+        '''SEのSoundを返す。アーカイブにないか、mixerの形式が違えばNone。'''
+        entry = self.entry('sound/' + name, sourcePath)
+        if entry is None or pygame.mixer.get_init() != self.mixer:
+            return None
+        return pygame.mixer.Sound(buffer=self.buffer(entry))
+
+    def close(self):
+        '''mmapとファイルを閉じる。作ったサーフィスとSoundは写しなので、閉じたあとも使える。'''
+        self.map.close()
+        self.file.close()
+
+
+if __name__ == '__main__':
+    from DialogFrameConfig import Conf
+    # 画面も音も出さなくていいが、convert_alphaのためにディスプレイだけは作る
+    # 音の出ない機械でもSEを詰められるように、mixerもダミーで初期化する(PCMの形式は同じ)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pygame.init()
+    if pygame.mixer.get_init() is None:
+        try:
+            pygame.mixer.init()
+        except pygame.error as e:
+            sys.exit('mixerを初期化できないのでSEを詰められません: %s' % e)
+    pygame.display.set_mode((1, 1))
+    archivePath = (sys.argv[1] if len(sys.argv) > 1 else
+        Conf.cassette+os.sep+'other'+os.sep+getattr(Conf, 'cassetteArchive', 'cassette.pack'))
+    entries = pack(Conf.cassette, Conf.imageConf, Conf.seConf, archivePath)
+    print('%s: %d entries, %d bytes' % (archivePath, len(entries), os.path.getsize(archivePath)))
@@ -0,0 +1,47 @@
+# coding: utf-8
+
+'''テストの共通の準備。
+
+DialogFrameはimportするときにDialogFrameConfigを読むので、先にチュートリアルの設定を登録しておく。
+SDLはbenchmark_dialog_frameがdummyドライバにするので、画面も音も出ない。
+'''
+
+import os
+import sys
+import shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+
+import benchmark_dialog_frame
+
+benchmark_dialog_frame.loadConfig(benchmark_dialog_frame.TUTORIAL_CONFIG)
+
+import DialogFrame
+
+
+@pytest.fixture
+def saveDB(tmp_path):
+    '''新品のセーブDBを一時フォルダに写して、そのパスを返す。カセットのセーブデータは変わらない。'''
+    dbPath = str(tmp_path / 'save.sqlite3')
+    shutil.copy(os.path.join(ROOT, DialogFrame.Conf.cassette, 'other', '(新品)save.sqlite3'), dbPath)
+    return dbPath
+
+
+@pytest.fixture
+def speakerIndex(monkeypatch):
+    '''チュートリアルのlinkingListで作ったSpeakerIndexを、モジュールのspeakerIndexにしておく。'''
+    index = DialogFrame.SpeakerIndex(DialogFrame.Conf.linkingList)
+    monkeypatch.setattr(DialogFrame, 'speakerIndex', index, raising=False)
+    return index
+
+
+@pytest.fixture
+def tutorialText():
+    '''チュートリアルのメインテキストのScriptText。'''
+    conf = DialogFrame.Conf
+    textList = DialogFrame.ScriptText(os.path.join(ROOT, conf.cassette, 'maintext', conf.maintextName))
+    yield textList
+    textList.close()
@@ -0,0 +1,45 @@
+# coding: utf-8
+
+'''BGMsのテスト。
+
+    python -m pytest -q tests
+で実行する。mixerは使わないので、曲はデコードしたことにして入れる。
+'''
+
+import DialogFrame
+
+MB = 1024 * 1024
+
+
+def loadedBGMs(budget, sizes):
+    bgms = DialogFrame.BGMs()
+    bgms.budget = budget
+    for name,size in sizes:
+        track = bgms.track(name)
+        track.sound = object()
+        track.size = size
+    return bgms
+
+
+def loadedNames(bgms):
+    return [name for name,track in bgms.tracks.items() if track.sound is not None]
+
+
+def test_trim_keeps_tracks_within_budget():
+    bgms = loadedBGMs(64*MB, [('a', 10*MB), ('b', 10*MB), ('c', 10*MB)])
+    bgms.trim('c')
+    assert loadedNames(bgms) == ['a', 'b', 'c']
+
+
+def test_trim_drops_oldest_by_bytes():
+    bgms = loadedBGMs(64*MB, [('a', 30*MB), ('b', 30*MB), ('c', 30*MB)])
+    bgms.trim('c')
+    assert loadedNames(bgms) == ['b', 'c']
+    assert bgms.tracks['a'].size == 0
+
+
+def test_trim_never_drops_playing_or_keep():
+    bgms = loadedBGMs(16*MB, [('a', 34*MB), ('b', 34*MB), ('c', 34*MB)])
+    bgms.playing = 'a'
+    bgms.trim('c')
+    assert loadedNames(bgms) == ['a', 'c']
@@ -0,0 +1,81 @@
+# coding: utf-8
+
+'''CheckpointIndex(好きなページの状態を作る索引)のテスト。
+チェックポイントから作った状態と、台本を頭から一ページずつたどった状態を比べる。
+
+    python -m pytest -q tests
+で実行する。
+'''
+
+import random
+
+import DialogFrame
+
+LINES = [
+    'ふつうの行',
+    '【せんせー】',
+    '【こども】',
+    '<event name=image removeall>',
+    '<event name=image file="skype.jpg" x=0 y=0 put>',
+    '<event name=image file="lecturer.png" x=400 y=200 put>',
+    '<event name=image file="pupil.png" x=180 y=220 put>',
+    '<event name=image file="pupil_back.png" x=30 put>',
+    '<event name=image file="lecturer.png" remove>',
+    '<event name=image file="lecturer_back.png" y=10>',
+    '<event name=image changefrom="skype.jpg" changeto="dialogbox.png">',
+    '<event name=bgm file="machi.mp3" volume=0.3 play>',
+    '<event name=bgm file="other.mp3">',
+    '<event name=bgm volume=0.5 stop>',
+    '<event name=bgm play>',
+    '<event name=sound file="ban.ogg" volume=0.7>',
+    '<event name=sound file="switch.ogg" volume=0.2 play>',
+]
+
+
+def summary(state):
+    """比べるための、状態の中身だけのタプル。"""
+    return (state.order.exportState(), {name: list(xy) for name,xy in state.positions.items()},
+        dict(state.volumes), dict(state.bgm))
+
+
+def replay(textList, page):
+    state = DialogFrame.ScriptState()
+    for index in range(page):
+        state.apply(textList[index])
+    return state
+
+
+def assertMatchesReplay(textList, intervals):
+    expected = [summary(replay(textList, page)) for page in range(len(textList))]
+    for interval in intervals:
+        index = DialogFrame.CheckpointIndex(textList, interval)
+        for page in range(len(textList)):
+            assert summary(index.stateAt(page)) == expected[page], (interval, page)
+
+
+def test_state_at_matches_replay(tmp_path, speakerIndex):
+    rand = random.Random(24)
+    for trial in range(30):
+        drafts = ['\n'.join(rand.choice(LINES) for i in range(rand.randint(1, 5)))
+            for j in range(rand.randint(1, 40))]
+        path = tmp_path / 'main.txt'
+        path.write_bytes('\n\n'.join(drafts).encode('utf-8'))
+        textList = DialogFrame.ScriptText(str(path))
+        assertMatchesReplay(textList, (1, 3, 7, 50))
+        textList.close()
+
+
+def test_state_at_tutorial(tutorialText, speakerIndex):
+    assertMatchesReplay(tutorialText, (1, 10, DialogFrame.Conf.checkpointInterval))
+
+
+def test_state_at_does_not_share_checkpoint(tmp_path, speakerIndex):
+    path = tmp_path / 'main.txt'
+    path.write_bytes('<event name=image file="skype.jpg" put>\n\nふつうの行'.encode('utf-8'))
+    textList = DialogFrame.ScriptText(str(path))
+    index = DialogFrame.CheckpointIndex(textList, 10)
+    state = index.stateAt(1)
+    state.order.put('pupil.png')
+    state.positions['skype.jpg'][0] = 99
+    assert summary(index.stateAt(1)) == summary(replay(textList, 1))
+    textList.close()
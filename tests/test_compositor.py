@@ -0,0 +1,65 @@
+# coding: utf-8
+
+'''Compositorの描き直し範囲のテスト。
+
+    python -m pytest -q tests
+で実行する。SDLのdummyドライバで動かすので、画面は出ない。
+'''
+
+import pytest
+
+import pygame
+import DialogFrame
+
+
+@pytest.fixture
+def compositor(monkeypatch):
+    pygame.display.init()
+    screen = pygame.display.set_mode((640, 480))
+    # updateが時間を記録するので、何もしないプロファイラーを置いておく
+    monkeypatch.setattr(DialogFrame, 'profiler', DialogFrame.FrameProfiler(False, 1, 1), raising=False)
+    yield DialogFrame.Compositor(screen)
+    pygame.display.quit()
+
+
+def image():
+    surface = pygame.Surface((100, 80))
+    surface.fill((200, 100, 50))
+    return surface
+
+
+def draw(compositor, timeline, surface, now):
+    source, xy = timeline.apply('a', surface, (10, 20), now)
+    if source is not None:
+        compositor.blit(source, xy, DialogFrame.Compositor.BASE)
+    compositor.update()
+    return compositor.dirtyRects
+
+
+def test_static_image_is_not_redrawn(compositor):
+    timeline = DialogFrame.Timeline()
+    surface = image()
+    assert draw(compositor, timeline, surface, 0)
+    assert draw(compositor, timeline, surface, 100) == []
+
+
+def test_fade_redraws_every_step(compositor):
+    timeline = DialogFrame.Timeline()
+    surface = image()
+    timeline.start('a', 'fade', None, 1000, ('dialog', 0), 0)
+    draw(compositor, timeline, surface, 0)
+    # 同じ写しのサーフィスに透明度だけ付けなおしていても、毎回描き直す
+    for now in range(100, 1000, 100):
+        assert draw(compositor, timeline, surface, now) == [pygame.Rect(10, 20, 100, 80)]
+    # 終わったら元のサーフィスに戻り、そのあとは描き直さない
+    timeline.update(1000, ['a'])
+    assert draw(compositor, timeline, surface, 1000)
+    assert draw(compositor, timeline, surface, 1100) == []
+
+
+def test_invalidate_redraws_whole_screen(compositor):
+    timeline = DialogFrame.Timeline()
+    surface = image()
+    draw(compositor, timeline, surface, 0)
+    compositor.invalidate()
+    assert draw(compositor, timeline, surface, 100) == [pygame.Rect(0, 0, 640, 480)]
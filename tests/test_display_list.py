@@ -0,0 +1,112 @@
+# coding: utf-8
+
+'''DisplayList(表示中の画像の層と表示順)のテスト。
+
+    python -m pytest -q tests
+で実行する。
+'''
+
+import random
+
+import pytest
+
+import DialogFrame
+
+DisplayList = DialogFrame.DisplayList
+
+
+@pytest.fixture(autouse=True)
+def defaultLayers(monkeypatch):
+    monkeypatch.setattr(DisplayList, 'defaultLayers', {'bg.png': DisplayList.BACKGROUND, 'box.png': DisplayList.UI})
+
+
+def test_put_orders_by_layer_then_put_order():
+    order = DisplayList(['a', 'box.png', 'b', 'bg.png'])
+    order.put('open.png', DisplayList.OVERLAY)
+    order.put('a')
+    assert list(order) == ['bg.png', 'a', 'b', 'box.png', 'open.png']
+    assert len(order) == 5
+    assert order.layerOf('open.png') == DisplayList.OVERLAY
+    assert order.layerOf('c') is None
+
+
+def test_remove_and_clear():
+    order = DisplayList(['bg.png', 'a', 'b', 'box.png'])
+    order.put('open.png', DisplayList.OVERLAY)
+    order.remove('a')
+    order.remove('c')
+    assert list(order) == ['bg.png', 'b', 'box.png', 'open.png']
+    order.clear(DisplayList.SCENE_LAYERS)
+    assert list(order) == ['open.png']
+    assert not order.hasLayer(DisplayList.CHARACTER)
+    assert order.hasLayer(DisplayList.OVERLAY)
+    order.clear()
+    assert list(order) == []
+
+
+def test_replace_keeps_layer_and_position():
+    order = DisplayList(['bg.png', 'a', 'b', 'c'])
+    order.replace('a', 'x')
+    assert list(order) == ['bg.png', 'x', 'b', 'c']
+    # newがほかの位置にあれば、そっちは消える
+    order.replace('x', 'c')
+    assert list(order) == ['bg.png', 'c', 'b']
+    # oldがなければ何もしない
+    order.replace('z', 'y')
+    assert list(order) == ['bg.png', 'c', 'b']
+    order.replace('bg.png', 'night.png')
+    assert order.layerOf('night.png') == DisplayList.BACKGROUND
+
+
+def test_copy_is_independent():
+    order = DisplayList(['a', 'b'])
+    copied = order.copy()
+    copied.put('c')
+    copied.remove('a')
+    assert list(order) == ['a', 'b']
+    assert list(copied) == ['b', 'c']
+    assert order == DisplayList(['a', 'b'])
+
+
+def test_matches_list_model():
+    """キャラクターの層だけなら、前の実装(リスト)と同じ順になる。"""
+    rand = random.Random(17)
+    names = list('abcdef')
+    for trial in range(200):
+        order = DisplayList()
+        model = []
+        for step in range(30):
+            op = rand.choice(('put', 'remove', 'replace'))
+            name, other = rand.sample(names, 2)
+            if op == 'put':
+                order.put(name)
+                if name not in model:
+                    model.append(name)
+            elif op == 'remove':
+                order.remove(name)
+                if name in model:
+                    model.remove(name)
+            else:
+                order.replace(name, other)
+                if name in model:
+                    # otherはnameの位置に入り、ほかの位置にあったotherは消える
+                    model = [other if n == name else n for n in model if n != other]
+            assert list(order) == model
+
+
+def test_export_state_round_trip():
+    order = DisplayList(['bg.png', 'a', 'box.png'])
+    order.put('open.png', DisplayList.OVERLAY)
+    order.put('b', DisplayList.UI)
+    state = order.exportState()
+    assert state == ['bg.png', 'a', 'box.png', ['b', DisplayList.UI], ['open.png', DisplayList.OVERLAY]]
+    restored = DisplayList.fromState(state)
+    assert restored == order
+    assert list(restored) == list(order)
+    assert restored.layerOf('b') == DisplayList.UI
+
+
+def test_from_legacy_state():
+    """バージョン1.0のセーブは画像名だけのリスト。"""
+    restored = DisplayList.fromState(['a', 'bg.png', 'box.png'])
+    assert list(restored) == ['bg.png', 'a', 'box.png']
@@ -0,0 +1,38 @@
+# coding: utf-8
+
+'''FrameIdlerのテスト。
+
+    python -m pytest -q tests
+で実行する。SDLのdummyドライバで動かすので、画面は出ない。
+'''
+
+import pytest
+
+import pygame
+from pygame.locals import KEYDOWN, K_x, K_z
+import DialogFrame
+
+
+@pytest.fixture
+def idler():
+    pygame.display.init()
+    pygame.display.set_mode((64, 48))
+    pygame.event.clear()
+    yield DialogFrame.FrameIdler(True, 500)
+    pygame.display.quit()
+
+
+def test_wait_keeps_event_order(idler):
+    pygame.event.post(pygame.event.Event(KEYDOWN, key=K_z, mod=0))
+    pygame.event.post(pygame.event.Event(KEYDOWN, key=K_x, mod=0))
+    idler.wait()
+    keys = [event.key for event in pygame.event.get() if event.type == KEYDOWN]
+    assert keys == [K_z, K_x]
+    assert idler.wakes == 1
+
+
+def test_wait_times_out_without_input(idler):
+    idler.wait(pygame.time.get_ticks() + 10)
+    assert idler.waits == 1
+    assert idler.wakes == 0
+    assert pygame.event.peek(KEYDOWN) is False
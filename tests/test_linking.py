@@ -0,0 +1,100 @@
+# coding: utf-8
+
+'''SpeakerIndexとapplyLinking(発言者と立ち絵の関連付け)のテスト。
+前の実装(毎フレームlinkingListを全部なめる)と、ランダムな関連付けで結果を比べる。
+
+    python -m pytest -q tests
+で実行する。
+'''
+
+import random
+
+import pytest
+
+import DialogFrame
+
+
+def baselineFind(linkingList, line):
+    """前の実装のキー検索。"""
+    return {key for linkingDic in linkingList for key in linkingDic if key in line}
+
+
+def baselineLinking(linkingList, keys, order, positions):
+    """前の実装の関連付け。orderはリスト、positionsは座標のディクショナリ。
+    途中で同じ画像が二つ並んだらFalseを返す(前の実装はそこから先がおかしくなる)。"""
+    unique = True
+    for linkingDic in linkingList:
+        for key,dic in linkingDic.items():
+            if key in keys:
+                source, target = dic['back'], dic['main']
+            else:
+                source, target = dic['main'], dic['back']
+            if source in order:
+                unique = unique and target not in order
+                order[order.index(source)] = target
+                positions[target] = positions[source]
+    return unique
+
+
+def randomLinkingList(rand, images):
+    linkingList = []
+    for i in range(rand.randint(1, 6)):
+        main, back = rand.sample(images, 2)
+        key = ''.join(rand.choice('abc') for j in range(rand.randint(1, 3)))
+        linkingList.append({key: {'main': main, 'back': back}})
+    return linkingList
+
+
+def test_find_contained_keys():
+    index = DialogFrame.SpeakerIndex([
+        {'【せんせー】': {'main': 'a', 'back': 'b'}},
+        {'せんせ': {'main': 'c', 'back': 'd'}},
+        {'こども': {'main': 'e', 'back': 'f'}},
+    ])
+    assert index.find('【せんせー】はろー') == {'【せんせー】', 'せんせ'}
+    assert index.find('こどもとせんせ') == {'こども', 'せんせ'}
+    assert index.find('だれもいない') == set()
+    assert DialogFrame.SpeakerIndex([]).find('こども') == set()
+
+
+def test_find_matches_baseline():
+    rand = random.Random(16)
+    for trial in range(500):
+        linkingList = randomLinkingList(rand, list('pqrstu'))
+        index = DialogFrame.SpeakerIndex(linkingList)
+        line = ''.join(rand.choice('abcx') for j in range(rand.randint(0, 12)))
+        assert index.find(line) == baselineFind(linkingList, line), (linkingList, line)
+
+
+def test_apply_linking_matches_baseline(monkeypatch):
+    rand = random.Random(16)
+    images = list('pqrstu')
+    compared = 0
+    for trial in range(2000):
+        linkingList = randomLinkingList(rand, images)
+        monkeypatch.setattr(DialogFrame, 'speakerIndex', DialogFrame.SpeakerIndex(linkingList), raising=False)
+        names = rand.sample(images, rand.randint(0, len(images)))
+        # imageタグのputは関連付けの相方がいれば置かないので、mainとbackが両方ある状態にはならない
+        if any(dic['main'] in names and dic['back'] in names
+                for linkingDic in linkingList for dic in linkingDic.values()):
+            continue
+        keys = {key for linkingDic in linkingList for key in linkingDic if rand.random() < 0.5}
+        positions = {name: (i, i) for i,name in enumerate(images)}
+        expectedOrder, expectedPositions = list(names), dict(positions)
+        # 前の実装は同じ画像を二つ並べてしまうことがある。そうならない場合だけ比べる
+        if not baselineLinking(linkingList, keys, expectedOrder, expectedPositions):
+            continue
+        order = DialogFrame.DisplayList(names)
+        DialogFrame.applyLinking(keys, order, positions)
+        assert list(order) == expectedOrder, (linkingList, names, keys)
+        assert {name: positions[name] for name in order} == {name: expectedPositions[name] for name in order}
+        compared += 1
+    assert compared > 500
+
+
+def test_apply_linking_tutorial(speakerIndex):
+    order = DialogFrame.DisplayList(['skype.jpg', 'lecturer.png', 'pupil.png'])
+    positions = {'skype.jpg': (0, 0), 'lecturer.png': (400, 200), 'pupil.png': (180, 220)}
+    DialogFrame.applyLinking({'【こども】'}, order, positions)
+    assert list(order) == ['skype.jpg', 'lecturer_back.png', 'pupil.png']
+    assert positions['lecturer_back.png'] == (400, 200)
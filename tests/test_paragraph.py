@@ -0,0 +1,65 @@
+# coding: utf-8
+
+'''EventTagとParagraph(メインテキストのコンパイル)のテスト。
+
+    python -m pytest -q tests
+で実行する。
+'''
+
+import pytest
+
+import DialogFrame
+
+
+def test_event_tag_converts_attributes():
+    tag = DialogFrame.EventTag('<event name=image file="lecturer.png" x=400 y=200 put>')
+    assert tag.name == 'image'
+    assert tag.attrs == {'name': 'image', 'file': 'lecturer.png', 'x': 400, 'y': 200, 'put': None}
+    assert tag.backPass is False
+
+
+def test_event_tag_back_pass():
+    tag = DialogFrame.EventTag('<event name=dice skill="目星" result=30 x=10 y=10>')
+    assert tag.backPass is True
+
+
+@pytest.mark.parametrize('line', [
+    # 前は'mag' in 'image'でimageタグとして処理されていた
+    '<event name=mag file="lecturer.png" put>',
+    '<event name=imag file="lecturer.png" put>',
+    '<event name=image file="lecturer.png" x=abc>',
+    '<event name=image file="lecturer.png" color=1>',
+    '<event name=sound play>',
+])
+def test_event_tag_rejects_bad_lines(line):
+    with pytest.raises(ValueError):
+        DialogFrame.EventTag(line)
+
+
+def test_paragraph_compile(speakerIndex):
+    paragraph = DialogFrame.Paragraph('\n'.join([
+        '<event name=image file="pupil.png" x=180 y=220 put>',
+        '# コメントは捨てる',
+        '【こども】',
+        'はいせんせー。',
+    ]))
+    assert [tag.name for tag in paragraph.tags] == ['image']
+    assert paragraph.textLines == ['【こども】', 'はいせんせー。']
+    assert paragraph.lines == [paragraph.tags[0], '【こども】', 'はいせんせー。']
+    assert paragraph.speakerKeys == {'【こども】'}
+    assert paragraph.displayable
+    assert not paragraph.skipBack
+    assert not paragraph.animated
+
+
+def test_paragraph_flags(speakerIndex):
+    paragraph = DialogFrame.Paragraph('<event name=skip back>\n<event name=image file="pupil.png" shake=1>')
+    assert paragraph.skipBack
+    assert not paragraph.displayable
+    assert paragraph.animated
+    assert DialogFrame.Paragraph('<event name=image file="pupil.png" put>').displayable is False
+
+
+def test_paragraph_reports_bad_tag(speakerIndex):
+    with pytest.raises(ValueError):
+        DialogFrame.Paragraph('【こども】\n<event name=mag file="pupil.png" put>')
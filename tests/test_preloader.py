@@ -0,0 +1,46 @@
+# coding: utf-8
+
+'''ResourcePreloaderのテスト。
+
+    python -m pytest -q tests
+で実行する。
+'''
+
+import threading
+
+import DialogFrame
+
+
+class Entry:
+    '''読まれたらloadedを立てるだけの、ImagesやSoundsのかわり。'''
+
+    def __init__(self):
+        self.loaded = threading.Event()
+
+    def load(self):
+        self.loaded.set()
+
+
+def test_stop_ends_waiting_thread():
+    preloader = DialogFrame.ResourcePreloader(2)
+    near, far = Entry(), Entry()
+    preloader.follow(iter([(0, near), (10, far)]))
+    thread = preloader.thread
+    assert near.loaded.wait(5)
+    # farはhorizonより先なので、スレッドはページが進むのを待っている
+    preloader.stop()
+    assert not thread.is_alive()
+    assert not far.loaded.is_set()
+    # stopしたあとのfollowではスレッドを作らない
+    preloader.follow(iter([(0, Entry())]))
+    assert preloader.thread is None
+
+
+def test_stop_after_manifest_is_done():
+    preloader = DialogFrame.ResourcePreloader(2)
+    entry = Entry()
+    preloader.follow(iter([(0, entry)]))
+    thread = preloader.thread
+    assert entry.loaded.wait(5)
+    preloader.stop()
+    assert not thread.is_alive()
@@ -0,0 +1,102 @@
+# coding: utf-8
+
+'''DBAccessのテスト。
+
+    python -m pytest -q tests
+で実行する。セーブDBは一時フォルダに作るので、カセットのセーブデータは変わらない。
+'''
+
+import json
+import sqlite3
+
+import pytest
+
+import DialogFrame
+
+
+@pytest.fixture
+def store(saveDB):
+    store = DialogFrame.DBAccess(saveDB)
+    store.migrate()
+    yield store
+    store.close()
+
+
+def readPages(count, pages):
+    readPages = DialogFrame.ReadPages('main.txt', count)
+    for page in pages:
+        readPages.mark(page)
+    return readPages
+
+
+def test_read_pages_are_merged_with_stored(store):
+    store.writeReadPages(readPages(20, [0, 1, 2]))
+    # DBのぶんを足していないReadPagesを書いても、前の既読は消えない
+    store.writeReadPages(readPages(20, [10, 11]))
+    stored = store.loadReadPages('main.txt')
+    assert stored[0] == 20
+    assert DialogFrame.ReadPages('main.txt', 20, stored[1]).bits == readPages(20, [0, 1, 2, 10, 11]).bits
+
+
+def test_read_pages_of_changed_script_are_replaced(store):
+    store.writeReadPages(readPages(20, [0, 1, 2]))
+    store.writeReadPages(readPages(30, [25]))
+    stored = store.loadReadPages('main.txt')
+    assert stored[0] == 30
+    assert DialogFrame.ReadPages('main.txt', 30, stored[1]).bits == readPages(30, [25]).bits
+
+
+def test_save_merges_read_pages(store):
+    store.writeReadPages(readPages(20, [3]))
+    store.writeData(1, {'paragraph': 20}, {'page': 5}, None, readPages(20, [4, 5]))
+    stored = store.loadReadPages('main.txt')
+    assert DialogFrame.ReadPages('main.txt', 20, stored[1]).bits == readPages(20, [3, 4, 5]).bits
+
+
+def test_read_pages_load_later_sees_earlier_writes(store):
+    store.writeReadPages(readPages(20, [7]))
+    pages = readPages(20, [1])
+    store.loadReadPagesLater('main.txt', pages.mergeStored)
+    store.flush()
+    assert pages.merged
+    assert pages.bits == readPages(20, [1, 7]).bits
+
+
+def test_read_pages_load_later_without_row(store):
+    pages = readPages(20, [1])
+    store.loadReadPagesLater('main.txt', pages.mergeStored)
+    store.flush()
+    assert pages.merged
+    assert pages.bits == readPages(20, [1]).bits
+
+
+def test_migrate_keeps_legacy_columns(saveDB):
+    """バージョン1.0のセーブはスナップショットを足すだけで、rsrc列とstatus列は残す。前のDBは写しておく。"""
+    rsrc = json.dumps({'imageInstances': {}, 'soundInstances': {}, 'bgmDic': {}})
+    default = {'mode': 'opening', 'page': 0, 'imageOrder': [], 'num': 0, 'num2': 0, 'message': '', 'frameNum': 0}
+    status = json.dumps(dict(default, default=default, mode='dialog', page=4))
+    connection = sqlite3.connect(saveDB)
+    with connection:
+        connection.execute('INSERT INTO saves (savenum, rsrc, status, paragraph) VALUES (?, ?, ?, ?)',
+            (3, rsrc, status, 20))
+    connection.close()
+
+    store = DialogFrame.DBAccess(saveDB)
+    store.migrate()
+    try:
+        row, = store.selectData({'savenum': 3})
+        assert (row['rsrc'], row['status']) == (rsrc, status)
+        assert DialogFrame.decodeSnapshot(store.loadSnapshot(3))['status'] == {'mode': 'dialog', 'page': 4}
+        assert store.listSlots(0, 10)[0]['page'] == 4
+        # 二回目はもう作りなおさない
+        store.migrate()
+    finally:
+        store.close()
+
+    backup = sqlite3.connect(saveDB + '.v1.bak')
+    try:
+        columns = [row[1] for row in backup.execute('PRAGMA table_info(saves)')]
+        assert 'snapshot' not in columns
+        assert backup.execute('SELECT rsrc, status FROM saves WHERE savenum = 3').fetchone() == (rsrc, status)
+    finally:
+        backup.close()
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+'''ScriptTextのテスト。
+
+    python -m pytest -q tests
+で実行する。メインテキストは一時フォルダに作る。
+'''
+
+import random
+
+import pytest
+
+import DialogFrame
+
+
+def scriptText(tmp_path, data, name='main.txt'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return DialogFrame.ScriptText(str(path))
+
+
+def test_encoding_is_checked_past_the_sample(tmp_path):
+    # 先頭のサンプルはASCIIだけなので、utf-8に見えてしまう
+    head = ('a' * 99 + '\n\n') * 1000
+    textList = scriptText(tmp_path, (head + 'こんにちは、世界').encode('sjis'))
+    assert len(head) > DialogFrame.ScriptText.sampleSize
+    assert textList.encoding == 'sjis'
+    assert textList.draft(len(textList) - 1) == 'こんにちは、世界'
+    textList.close()
+
+
+def test_undecodable_script_is_an_error(tmp_path):
+    with pytest.raises(ValueError):
+        scriptText(tmp_path, b'abc\n\n\xff\xff\xff')
+
+
+def test_closed_script_raises(tmp_path):
+    textList = scriptText(tmp_path, 'あ\n\nい'.encode('utf-8'))
+    textList.close()
+    assert textList.file.closed
+    with pytest.raises(ValueError):
+        textList.draft(1)
+
+
+def test_separators(tmp_path):
+    """パラグラフの区切りは空行。改行は\\r\\n、\\r、\\nのどれでもよく、混ざっていてもよい。"""
+    rand = random.Random(9)
+    for trial in range(200):
+        lines = [rand.choice(['', 'あ', 'い', '<event name=image file="a.png" put>', '# c'])
+            for i in range(rand.randint(1, 12))]
+        data = b''.join(line.encode('utf-8') + rand.choice([b'\r\n', b'\r', b'\n'])
+            for line in lines[:-1]) + lines[-1].encode('utf-8')
+        path = tmp_path / 'main.txt'
+        path.write_bytes(data)
+        # 前の実装はテキストモード(改行は\nにそろう)で読んで'\n\n'で分けていた
+        with open(str(path), encoding='utf-8') as f:
+            expected = f.read().split('\n\n')
+        textList = DialogFrame.ScriptText(str(path))
+        assert [textList.draft(i) for i in range(len(textList))] == expected, data
+        textList.close()
+
+
+def baselineSkipTagLines(drafts, page, pageBack, back, depth=0):
+    """前の実装(再帰するskipTagLines)。pageBackを返す。表示するパラグラフがなければRecursionError。"""
+    if depth > 200:
+        raise RecursionError
+    normalLineExists = False
+    for line in drafts[page - pageBack].split('\n'):
+        for string in DialogFrame.Conf.pageBackMode['pass']:
+            if line.startswith(string):
+                normalLineExists = True
+        if 'event name=skip' in line and 'back' in line:
+            normalLineExists = False
+            break
+        if (line.startswith('<event ') and line.endswith('>')):
+            continue
+        elif line.startswith('#'):
+            continue
+        else:
+            normalLineExists = True
+    if normalLineExists:
+        return pageBack
+    if not back:
+        pageBack -= 1
+        if pageBack < 0:
+            return baselineSkipTagLines(drafts, page, pageBack + 1, True, depth + 1)
+        return baselineSkipTagLines(drafts, page, pageBack, back, depth + 1)
+    pageBack += 1
+    if pageBack > page:
+        return baselineSkipTagLines(drafts, page, pageBack - 1, False, depth + 1)
+    return baselineSkipTagLines(drafts, page, pageBack, back, depth + 1)
+
+
+def test_seek_matches_recursive_skip(tmp_path):
+    paragraphs = [
+        'ふつうの行',
+        '<event name=image file="a.png" put>',
+        '<event name=image file="a.png" put>\nふつうの行',
+        '<event name=dice skill="目星" result=30 x=10 y=10>',
+        '<event name=skip back>\nふつうの行',
+        '# コメントだけ',
+        '<event name=bgm file="a.mp3" play>\n# コメント',
+    ]
+    rand = random.Random(22)
+    compared = 0
+    for trial in range(300):
+        drafts = [rand.choice(paragraphs) for i in range(rand.randint(1, 15))]
+        textList = scriptText(tmp_path, '\n\n'.join(drafts).encode('utf-8'))
+        for page in range(len(drafts)):
+            for pageBack in range(page + 1):
+                for back in (True, False):
+                    try:
+                        expected = baselineSkipTagLines(drafts, page, pageBack, back)
+                    except RecursionError:
+                        # 0~pageに表示するパラグラフがない。前の実装は止まらなかった
+                        continue
+                    assert page - textList.seek(page - pageBack, back, page) == expected, (drafts, page, pageBack, back)
+                    compared += 1
+        textList.close()
+    assert compared > 1000
@@ -0,0 +1,108 @@
+# coding: utf-8
+
+'''スキップモード(skipParagraphs)のテスト。
+合成カセットで、スキップしたあとの画像とBGMの状態が、一ページずつめくったときと同じになるかを見る。
+
+    python -m pytest -q tests
+で実行する。カセットとセーブDBは一時フォルダに作る。
+'''
+
+import os
+
+import pytest
+
+import benchmark_dialog_frame
+import DialogFrame
+
+# initializeが作りなおすモジュールの変数。テストのあとで元に戻す
+GLOBALS = ('screen', 'compositor', 'framerate', 'clock', 'idler', 'profiler', 'profileOverlay',
+    'fonts', 'font', 'textCache', 'layerCache', 'soundCache', 'keyConf', 'saveStore', 'speakerIndex')
+# 合成カセットのページに足すbgmタグ
+BGM_TAGS = {
+    5: '<event name=bgm file="a.mp3" volume=0.4 play>',
+    30: '<event name=bgm file="b.mp3">',
+    33: '<event name=bgm play>',
+    50: '<event name=bgm volume=0.2 stop>',
+}
+
+
+@pytest.fixture
+def newFrame(tmp_path, monkeypatch):
+    conf = benchmark_dialog_frame.createSyntheticCassette(str(tmp_path), DialogFrame.Conf, 120, 3)
+    # 合成カセットにはBGMがないので足す。曲のファイルはないので鳴らないが、状態は変わる
+    path = os.path.join(conf.cassette, 'maintext', conf.maintextName)
+    with open(path, encoding='utf-8') as f:
+        paragraphs = f.read().split('\n\n')
+    for page,line in BGM_TAGS.items():
+        paragraphs[page] = line + '\n' + paragraphs[page]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(paragraphs))
+    monkeypatch.setattr(DialogFrame, 'Conf', conf)
+    monkeypatch.setattr(DialogFrame.DisplayList, 'defaultLayers', {})
+    for name in GLOBALS:
+        monkeypatch.setattr(DialogFrame, name, getattr(DialogFrame, name, None), raising=False)
+    DialogFrame.initialize()
+    frames = []
+
+    def newFrame():
+        frame = DialogFrame.DialogFrame()
+        frame._DialogFrame__status['mode'] = 'dialog'
+        frames.append(frame)
+        return frame
+    yield newFrame
+    DialogFrame.saveStore.close()
+    for frame in frames:
+        frame._DialogFrame__rsrc.close()
+
+
+def status(frame):
+    return frame._DialogFrame__status
+
+
+def state(frame):
+    """比べるための、画像とBGMとSEの音量の状態。"""
+    rsrc = frame._DialogFrame__rsrc
+    order = status(frame)['imageOrder']
+    return (order.exportState(), {name: list(rsrc.positions[name]) for name in order},
+        (rsrc.bgm.name, rsrc.bgm.vol, rsrc.bgm.put),
+        {name: sound.vol for name,sound in rsrc.soundDic.items()})
+
+
+def play(frame, page):
+    """pageまで一ページずつめくる。"""
+    for index in range(page + 1):
+        status(frame)['page'] = index
+        status(frame)['num'] = 0
+        frame.dialogMode()
+    return state(frame)
+
+
+@pytest.mark.parametrize('read', [1, 8, 45, 118])
+def test_skip_stops_at_first_unread_page(newFrame, read):
+    frame = newFrame()
+    frame.dialogMode()
+    readPages = frame.readPages()
+    for page in range(read + 1):
+        readPages.mark(page)
+    status(frame)['mode'] = 'dialog__skip'
+    frame.skipParagraphs(60)
+    assert status(frame)['mode'] == 'dialog'
+    assert status(frame)['page'] == read
+    assert state(frame) == play(newFrame(), read)
+
+
+def test_skip_continues_next_frame(newFrame):
+    frame = newFrame()
+    frame.dialogMode()
+    readPages = frame.readPages()
+    for page in range(60):
+        readPages.mark(page)
+    status(frame)['mode'] = 'dialog__skip'
+    # 時間を使い切ったら、スキップモードのまま次のフレームに回す
+    frame.skipParagraphs(0)
+    assert status(frame)['mode'] == 'dialog__skip'
+    assert status(frame)['page'] == 1
+    while status(frame)['mode'] == 'dialog__skip':
+        frame.skipParagraphs(0)
+    assert status(frame)['page'] == 59
+    assert state(frame) == play(newFrame(), 59)
@@ -0,0 +1,90 @@
+# coding: utf-8
+
+'''セーブのスナップショット形式のテスト。
+
+    python -m pytest -q tests
+で実行する。
+'''
+
+import json
+import zlib
+
+import pytest
+
+import DialogFrame
+
+
+def state():
+    return {
+        'status': {'mode': 'dialog', 'page': 12, 'imageOrder': ['skype.jpg', ['diceframe.png', 3]]},
+        'rsrc': {'images': {'lecturer.png': [400, 200]}, 'sounds': {'ban.ogg': 0.5},
+            'bgm': {'name': 'machi.mp3', 'put': True}},
+        'script': [80, 12345],
+    }
+
+
+def versioned(version, state):
+    """バージョンを指定してスナップショットを作る。"""
+    payload = zlib.compress(json.dumps(state).encode('utf-8'))
+    return DialogFrame.SNAPSHOT_HEADER.pack(DialogFrame.SNAPSHOT_MAGIC, version, zlib.crc32(payload)) + payload
+
+
+def test_round_trip():
+    snapshot = DialogFrame.encodeSnapshot(state())
+    assert snapshot[:4] == DialogFrame.SNAPSHOT_MAGIC
+    assert DialogFrame.decodeSnapshot(snapshot) == state()
+    # DBから読んだmemoryviewでもいい
+    assert DialogFrame.decodeSnapshot(memoryview(snapshot)) == state()
+
+
+def test_checksum_mismatch():
+    snapshot = bytearray(DialogFrame.encodeSnapshot(state()))
+    snapshot[-1] ^= 0xff
+    with pytest.raises(ValueError, match='checksum'):
+        DialogFrame.decodeSnapshot(bytes(snapshot))
+
+
+@pytest.mark.parametrize('snapshot', [
+    b'',
+    b'DFSV',
+    b'XXXX' + DialogFrame.encodeSnapshot({})[4:],
+    versioned(DialogFrame.SNAPSHOT_VERSION + 1, {}),
+])
+def test_broken_snapshots(snapshot):
+    with pytest.raises(ValueError):
+        DialogFrame.decodeSnapshot(snapshot)
+
+
+def test_version_1_image_open_is_upgraded():
+    """バージョン1はいつでも画像オープンをnum2で持っていた。"""
+    decoded = DialogFrame.decodeSnapshot(versioned(1, {'status': {'imageOrder': ['skype.jpg'], 'num2': 1}}))
+    assert decoded['status'] == {
+        'imageOrder': ['skype.jpg', [DialogFrame.Conf.imageOpenName, DialogFrame.DisplayList.OVERLAY]]}
+    decoded = DialogFrame.decodeSnapshot(versioned(1, {'status': {'imageOrder': ['skype.jpg']}}))
+    assert decoded['status'] == {'imageOrder': ['skype.jpg']}
+    assert DialogFrame.decodeSnapshot(versioned(1, {}))['status'] == {}
+
+
+def test_legacy_snapshot():
+    """バージョン1.0のrsrc列とstatus列(JSON)から作りなおす。初期値と同じものは書かない。"""
+    rsrc = {
+        'imageInstances': {
+            'lecturer.png': {'xy': [400, 200]},
+            'skype.jpg': {'xy': list(DialogFrame.Images.defaultXY)},
+        },
+        'soundInstances': {
+            'ban.ogg': {'vol': 0.5},
+            'pi.ogg': {'vol': DialogFrame.Sounds.defaultVolume},
+        },
+        'bgmDic': {'name': 'machi.mp3', 'vol': DialogFrame.BGMs.defaults['vol'], 'put': True},
+    }
+    default = {'mode': 'opening', 'page': 0, 'imageOrder': [], 'num': 0, 'num2': 0, 'message': '', 'frameNum': 0}
+    status = dict(default, default=default, mode='dialog__announce', page=7,
+        imageOrder=['skype.jpg', 'lecturer.png'], num2=1, message='セーブしました', frameNum=33, pageBack=0)
+    decoded = DialogFrame.decodeSnapshot(DialogFrame.legacySnapshot(json.dumps(rsrc), json.dumps(status)))
+    assert decoded == {
+        'status': {'mode': 'dialog', 'page': 7,
+            'imageOrder': ['skype.jpg', 'lecturer.png', [DialogFrame.Conf.imageOpenName, DialogFrame.DisplayList.OVERLAY]]},
+        'rsrc': {'images': {'lecturer.png': [400, 200]}, 'sounds': {'ban.ogg': 0.5},
+            'bgm': {'name': 'machi.mp3', 'put': True}},
+    }
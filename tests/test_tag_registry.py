@@ -0,0 +1,71 @@
+# coding: utf-8
+
+'''TagRegistry(イベントタグの登録簿とプラグイン)のテスト。
+
+    python -m pytest -q tests
+で実行する。プラグインは一時フォルダに作る。
+'''
+
+import pytest
+
+import DialogFrame
+
+
+def handler(frame, dic):
+    pass
+
+
+@pytest.fixture
+def registry():
+    registry = DialogFrame.TagRegistry()
+    registry.register('wait', handler, {'ms': 'int', 'rate': 'float', 'now': 'flag', 'color': 'color'},
+        required=('ms',))
+    return registry
+
+
+def test_compile_converts_types(registry):
+    dic = registry.compile('<line>', {'name': 'wait', 'ms': '10', 'rate': '0.5', 'now': None, 'color': '1,2,3'})
+    assert dic == {'name': 'wait', 'ms': 10, 'rate': 0.5, 'now': None, 'color': (1, 2, 3)}
+
+
+@pytest.mark.parametrize('dic, message', [
+    ({'name': 'sleep', 'ms': '10'}, 'Unknown event tag'),
+    ({'ms': '10'}, 'Unknown event tag'),
+    ({'name': 'wait', 'ms': '10', 'speed': '1'}, 'Unknown attribute'),
+    ({'name': 'wait', 'ms': None}, 'needs a value'),
+    ({'name': 'wait', 'ms': 'ten'}, 'must be int'),
+    ({'name': 'wait', 'ms': '10', 'color': '300,0,0'}, 'must be color'),
+    ({'name': 'wait', 'rate': '1.0'}, 'is required'),
+])
+def test_compile_errors(registry, dic, message):
+    with pytest.raises(ValueError, match=message):
+        registry.compile('<line>', dic)
+
+
+def test_register_rejects_unknown_type(registry):
+    with pytest.raises(ValueError):
+        registry.register('bad', handler, {'ms': 'long'})
+
+
+def test_builtin_tags_are_registered():
+    assert set(DialogFrame.tagRegistry.handlers) >= {'image', 'sound', 'bgm', 'text', 'skip', 'dice'}
+
+
+def test_plugin_registers_tag(registry, tmp_path):
+    (tmp_path / 'myplugin.py').write_text('\n'.join([
+        'def register(registry, engine):',
+        '    def flash(frame, dic):',
+        '        frame.flashed = dic["times"]',
+        '    registry.register("flash", flash, {"times": "int"})',
+        '    registry.engine = engine',
+        '',
+    ]), encoding='utf-8')
+    registry.loadPlugins(str(tmp_path), ['myplugin.py'], DialogFrame)
+    assert registry.engine is DialogFrame
+    dic = registry.compile('<event name=flash times=3>', {'name': 'flash', 'times': '3'})
+
+    class Frame:
+        pass
+    frame = Frame()
+    registry.handlers['flash'](frame, dic)
+    assert frame.flashed == 3
@@ -0,0 +1,49 @@
+# coding: utf-8
+
+'''Timelineのテスト。
+
+    python -m pytest -q tests
+で実行する。
+'''
+
+import pytest
+
+import DialogFrame
+
+
+@pytest.fixture
+def timeline(monkeypatch):
+    monkeypatch.setattr(DialogFrame, 'speakerIndex',
+        DialogFrame.SpeakerIndex([{'あ': {'main': 'a1', 'back': 'a2'}}]), raising=False)
+    return DialogFrame.Timeline()
+
+
+def test_finished_tween_is_dropped(timeline):
+    timeline.start('a1', 'fade', None, 500, ('dialog', 0), 0)
+    timeline.update(100, ['a1'])
+    assert timeline.running()
+    timeline.update(500, ['a1'])
+    assert not timeline.running()
+
+
+def test_hidden_image_tween_is_dropped(timeline):
+    timeline.start('b', 'fade', None, 500, ('dialog', 0), 0)
+    timeline.update(100, ['a1'])
+    assert not timeline.running()
+
+
+def test_linking_swap_moves_tween_to_partner(timeline):
+    timeline.start('a1', 'fade', None, 500, ('dialog', 0), 0)
+    # 発言者が変わってa1がa2に入れ替わっても、フェードは続く
+    timeline.update(100, ['a2'])
+    assert list(timeline.tweens) == ['a2']
+    assert timeline.tweens['a2']['fade'].start == 0
+    timeline.update(200, ['a1'])
+    assert list(timeline.tweens) == ['a1']
+
+
+def test_linking_swap_keeps_partner_tween(timeline):
+    timeline.start('a1', 'fade', None, 500, ('dialog', 0), 0)
+    timeline.start('a2', 'fade', None, 500, ('dialog', 0), 300)
+    timeline.update(400, ['a2'])
+    assert timeline.tweens['a2']['fade'].start == 300